@@ -0,0 +1,49 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+
+from api.deps import get_current_user
+from core.db import get_db
+from models import User, AiJob
+
+router = APIRouter(prefix="/ai-jobs", tags=["ai-jobs"])
+
+
+def _job_out(j: AiJob) -> dict:
+    return {
+        "id": j.id,
+        "kind": j.kind,
+        "problem_id": j.problem_id,
+        "user_id": j.user_id,
+        "target_id": j.target_id,
+        "status": j.status,
+        "attempts": int(j.attempts or 0),
+        "last_error": j.last_error,
+        "run_after": j.run_after.isoformat() if j.run_after else None,
+        "created_at": j.created_at.isoformat() if j.created_at else None,
+        "updated_at": j.updated_at.isoformat() if j.updated_at else None,
+    }
+
+
+@router.get("")
+def list_jobs(
+    problem_id: Optional[int] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """自分が起点の AI ジョブ（problem_id 指定でその問題のみ）"""
+    q = select(AiJob).where(AiJob.user_id == user.id)
+    if problem_id is not None:
+        q = q.where(AiJob.problem_id == problem_id)
+    rows = db.execute(q.order_by(AiJob.id.desc()).limit(limit)).scalars().all()
+    return {"items": [_job_out(j) for j in rows]}
+
+
+@router.get("/{job_id:int}")
+def get_job(job_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    j = db.get(AiJob, job_id)
+    if not j or j.user_id != user.id:
+        raise HTTPException(404, "not found")
+    return _job_out(j)
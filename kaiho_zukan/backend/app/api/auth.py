@@ -1,28 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from core.db import get_db
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from core.db import SessionLocal
 from models import User
-from security.auth import hash_pw, verify_pw, make_token
+from security.auth import hash_pw_async, verify_pw_async, needs_rehash, make_token
+from security import login_throttle
 from schemas.auth import RegisterIn, LoginIn, TokenOut
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+# bcrypt は専用プロセスプールで await し、DB アクセスはスレッドプールで実行する
+# （ログインが集中しても他のエンドポイントのスレッドを塞がない）。
+# DB セッションは各関数の中で開いて閉じる。bcrypt を待つ間はプールの接続を持たない
+
+def _find_user(username: str):
+    with SessionLocal() as db:
+        row = db.execute(select(User.id, User.password_hash).where(User.username==username)).first()
+    return (int(row[0]), row[1]) if row else None
+
+def _create_user(username: str, password_hash: str, nickname: str) -> int:
+    with SessionLocal() as db:
+        user = User(username=username, password_hash=password_hash, nickname=nickname)
+        db.add(user)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(400, "username already exists")
+        return user.id
+
+def _update_hash(user_id: int, password_hash: str) -> None:
+    with SessionLocal() as db:
+        db.execute(update(User).where(User.id==user_id).values(password_hash=password_hash))
+        db.commit()
+
 @router.post("/register", response_model=TokenOut)
-def register(payload: RegisterIn, db: Session = Depends(get_db)):
+async def register(payload: RegisterIn):
     username = payload.username.strip()
     if not username or not payload.password:
         raise HTTPException(400, "username/password required")
-    exists = db.execute(select(User).where(User.username==username)).scalar_one_or_none()
-    if exists:
+    if await run_in_threadpool(_find_user, username):
         raise HTTPException(400, "username already exists")
-    user = User(username=username, password_hash=hash_pw(payload.password), nickname=payload.nickname or username)
-    db.add(user); db.commit()
-    return TokenOut(access_token=make_token(user.id))
+    hashed = await hash_pw_async(payload.password)
+    uid = await run_in_threadpool(_create_user, username, hashed, payload.nickname or username)
+    return TokenOut(access_token=make_token(uid))
 
 @router.post("/login", response_model=TokenOut)
-def login(payload: LoginIn, db: Session = Depends(get_db)):
-    user = db.execute(select(User).where(User.username==payload.username)).scalar_one_or_none()
-    if not user or not verify_pw(payload.password, user.password_hash):
+async def login(payload: LoginIn):
+    wait = login_throttle.retry_after(payload.username)
+    if wait is not None:
+        raise HTTPException(429, "ログイン試行が多すぎます。しばらくしてから再度お試しください", headers={"Retry-After": str(wait)})
+    found = await run_in_threadpool(_find_user, payload.username)
+    if not found or not await verify_pw_async(payload.password, found[1]):
+        login_throttle.record_failure(payload.username)
         raise HTTPException(401, "認証情報が正しくありません")
-    return TokenOut(access_token=make_token(user.id))
+    uid, hashed = found
+    login_throttle.reset(payload.username)
+    # BCRYPT_ROUNDS を変えた場合はログイン時に新しいコストで作り直す
+    if needs_rehash(hashed):
+        await run_in_threadpool(_update_hash, uid, await hash_pw_async(payload.password))
+    return TokenOut(access_token=make_token(uid))
@@ -1,18 +1,18 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from core.db import get_db
-from models import Category
+from fastapi import APIRouter, Request, Response
+from api.etag import etag_matches
+from core.db import async_session
+from services import category_tree
 
 router = APIRouter(prefix="/categories", tags=["categories"])
 
 @router.get("/tree")
-def cat_tree(db: Session = Depends(get_db)):
-    parents = db.execute(
-        select(Category).where(Category.parent_id == None).order_by(Category.id)
-    ).scalars().all()
-    def to_dict(cat: Category):
-        return {"id": cat.id, "name": cat.name,
-                "children":[{"id": c.id, "name": c.name,
-                             "children":[{"id": g.id,"name": g.name} for g in c.children]} for c in cat.children]}
-    return [to_dict(p) for p in parents]
+async def cat_tree(request: Request):
+    """カテゴリ木（services.category_tree のスナップショット）。ETag / If-None-Match に対応し、一致すれば DB に触れず 304"""
+    snap = category_tree.cached()
+    if snap is None:
+        async with async_session() as db:
+            snap = await db.run_sync(category_tree.get_snapshot)
+    etag = f'W/"cat-{snap.version}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=snap.body, media_type="application/json", headers={"ETag": etag})
@@ -1,14 +1,13 @@
 from fastapi import Depends, Request, HTTPException
 from sqlalchemy.orm import Session
-from core.db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.db import get_db, get_async_read_db
 from security.auth import parse_token
+from security import user_cache
 from models import User
 
-def get_current_user(
-    request: Request,
-    db: Session = Depends(get_db),
-    authorization: str | None = None
-) -> User:
+def current_user_id(request: Request, authorization: str | None = None) -> int:
+    """トークンのユーザ ID（DB は引かない）"""
     token = None
     if authorization and authorization.lower().startswith("bearer "):
         token = authorization.split(" ", 1)[1].strip()
@@ -23,7 +22,36 @@ def get_current_user(
     uid = parse_token(token)
     if not uid:
         raise HTTPException(401, "Invalid token")
+    return uid
+
+def get_current_user(
+    request: Request,
+    db: Session = Depends(get_db),
+    authorization: str | None = None
+) -> User:
+    uid = current_user_id(request, authorization)
+    user = user_cache.get(db, uid)
+    if user is not None:
+        return user
     user = db.get(User, uid)
     if not user:
         raise HTTPException(401, "User not found")
+    user_cache.put(user)
+    return user
+
+async def get_current_user_async(
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    authorization: str | None = None
+) -> User:
+    """非同期ハンドラ用。返す User はセッションに属さない（読み取り専用）"""
+    uid = current_user_id(request, authorization)
+    user = user_cache.peek(uid)
+    if user is not None:
+        return user
+    user = await db.get(User, uid)
+    if not user:
+        raise HTTPException(401, "User not found")
+    user_cache.put(user)
+    db.expunge(user)
     return user
@@ -0,0 +1,11 @@
+"""ETag / If-None-Match の照合（スナップショットから返す GET の 304 応答用）"""
+from fastapi import Request
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match のいずれかが etag と一致するか（カンマ区切りの複数指定・* ・W/ の有無を問わない弱い比較）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or etag.removeprefix("W/") in tags
@@ -1,17 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy.orm import Session, defer
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, case
 from typing import Optional, List
-import os, time, random, threading
+import random
 
-from api.deps import get_current_user
-from core.db import get_db
+from api import pagination
+from api.deps import get_current_user, get_current_user_async
+from core.db import get_db, get_async_read_db
 from core.config import get_settings
 from models import (
     User, Problem, Explanation, ExplanationLike, ExplanationImage, ExplanationWrongFlag,
     Option, Answer, ProblemImage, AiJudgement, Notification
 )
-from services.ai_judge import judge_problem_for_user, judge_explanation_ai
+from services import ai_jobs, likes, llm_gateway, notification_writer, notify_hub, uploads, user_stats
 
 settings = get_settings()
 
@@ -32,155 +34,148 @@ def _rank_info(total_creations: int) -> tuple[str, int]:
     else:
         return "ランク：プラチナ", 4
 
-router = APIRouter(prefix="/explanations", tags=["explanations"])
 
-@router.get("/problem/{pid:int}")
-def list_explanations(
-    pid: int,
-    sort: str = "likes",
-    request: Request = None,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+# 並び順ごとのカーソルのキー（likes / recent 以外はランダム順で続きを返さない）
+_EXPLANATION_ORDERS = {
+    "likes": lambda: [(Explanation.like_count, True), (Explanation.id, False)],
+    "recent": lambda: [(Explanation.id, True)],
+}
+EXPLANATION_FIELDS = (
+    "id", "content", "likes", "is_ai", "option_index", "user_id", "by", "author_icon_url", "author_rank",
+    "author_rank_level", "liked", "images", "thumbnails", "ai_is_wrong", "ai_judge_score", "ai_judge_reason",
+    "wrong_flag_count", "flagged_wrong", "solvers_count", "crowd_maybe_wrong",
+)
+
+
+def _explanations_query(
+    pid: int, sort: str = "likes", limit: Optional[int] = None, cursor: Optional[str] = None, content: bool = True
 ):
+    """問題の解説（いいね順は explanations(problem_id, like_count) で引ける）。content=False なら本文を読まない"""
     q = select(Explanation).where(Explanation.problem_id == pid)
+    if not content:
+        q = q.options(defer(Explanation.content))
+    order = _EXPLANATION_ORDERS.get(sort)
+    if order is not None:
+        order = order()
+        if cursor:
+            q = q.where(pagination.after(order, pagination.decode_cursor(cursor, sort, len(order))))
+        q = q.order_by(*(expr.desc() if desc else expr.asc() for expr, desc in order))
+    if limit is not None:
+        q = q.limit(limit)
+    return q
+
+
+def _explanation_cursor_key(sort: str):
     if sort == "likes":
-        q = q.order_by(Explanation.like_count.desc(), Explanation.id.asc())
-    elif sort == "recent":
-        q = q.order_by(Explanation.id.desc())
-    exps = db.execute(q).scalars().all()
+        return lambda it: (it["likes"], it["id"])
+    if sort == "recent":
+        return lambda it: (it["id"],)
+    return None
+
 
+def _solvers_query(pid: int):
+    """問題を解いたユーザ数（answers(problem_id, user_id) だけで数えられる）"""
+    return select(func.count(func.distinct(Answer.user_id))).where(Answer.problem_id == pid)
+
+
+def _explanation_items(
+    db: Session,
+    pid: int,
+    viewer_id: int,
+    sort: str = "likes",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    content: bool = True,
+) -> list[dict]:
+    """
+    問題 pid の解説一覧を組み立てる（/explanations/problem, /problems/{pid}/explanations, /review/item 共通）。
+    解説の件数に関係なく、画像・いいね/フラグ状態・投稿者情報・AI判定を固定回数のクエリでまとめて取得する。
+    content=False なら本文を読まない（content は None）。
+    """
+    exps = db.execute(_explanations_query(pid, sort, limit, cursor, content)).scalars().all()
+    if not exps:
+        return []
     ex_ids = [e.id for e in exps]
-    wrong_flag_counts = {eid: 0 for eid in ex_ids}
-    if ex_ids:
-        rows = db.execute(
-            select(ExplanationWrongFlag.explanation_id, func.count())
-            .where(ExplanationWrongFlag.explanation_id.in_(ex_ids))
-            .group_by(ExplanationWrongFlag.explanation_id)
+
+    images: dict[int, list[str]] = {eid: [] for eid in ex_ids}
+    for eid, fn in db.execute(
+        select(ExplanationImage.explanation_id, ExplanationImage.filename)
+        .where(ExplanationImage.explanation_id.in_(ex_ids))
+        .order_by(ExplanationImage.id.asc())
+    ).all():
+        images[int(eid)].append(fn)
+
+    liked_ids = {
+        int(r[0])
+        for r in db.execute(
+            select(ExplanationLike.explanation_id).where(
+                ExplanationLike.user_id == viewer_id,
+                ExplanationLike.explanation_id.in_(ex_ids),
+            )
         ).all()
-        for eid, cnt in rows:
-            wrong_flag_counts[int(eid)] = int(cnt or 0)
-
-    flagged_rows = db.execute(
-        select(ExplanationWrongFlag.explanation_id)
-        .where(
-            ExplanationWrongFlag.user_id == user.id,
-            ExplanationWrongFlag.explanation_id.in_(ex_ids),
-        )
-    ).all() if ex_ids else []
-    flagged_ids = {int(r[0]) for r in flagged_rows}
-
-    liked_rows = db.execute(
-        select(ExplanationLike.explanation_id)
-        .where(
-            ExplanationLike.user_id == user.id,
-            ExplanationLike.explanation_id.in_(ex_ids),
-        )
-    ).all() if ex_ids else []
-    liked_ids = {int(r[0]) for r in liked_rows}
+    }
 
-    uids = list({e.user_id for e in exps if getattr(e, "user_id", None) is not None})
-    user_map: dict[int, dict[str, object]] = {}
-    problem_counts: dict[int, int] = {}
-    explanation_counts: dict[int, int] = {}
+    # 誤りフラグ件数と閲覧者自身のフラグ有無を 1 クエリで
+    wrong_flag_counts = {eid: 0 for eid in ex_ids}
+    flagged_ids: set[int] = set()
+    for eid, cnt, mine in db.execute(
+        select(
+            ExplanationWrongFlag.explanation_id,
+            func.count(),
+            func.sum(case((ExplanationWrongFlag.user_id == viewer_id, 1), else_=0)),
+        )
+        .where(ExplanationWrongFlag.explanation_id.in_(ex_ids))
+        .group_by(ExplanationWrongFlag.explanation_id)
+    ).all():
+        wrong_flag_counts[int(eid)] = int(cnt or 0)
+        if mine:
+            flagged_ids.add(int(eid))
+
+    uids = list({e.user_id for e in exps if e.user_id is not None})
+    user_map: dict[int, User] = {}
+    stats: dict[int, dict[str, int]] = {}
+    judgement_map: dict[int, AiJudgement] = {}
     if uids:
-        user_rows = db.execute(select(User).where(User.id.in_(uids))).scalars().all()
-        problem_counts = {
-            int(uid): int(cnt or 0)
-            for uid, cnt in db.execute(
-                select(Problem.created_by, func.count())
-                .where(Problem.created_by.in_(uids))
-                .group_by(Problem.created_by)
-            ).all()
-        }
-        explanation_counts = {
-            int(uid): int(cnt or 0)
-            for uid, cnt in db.execute(
-                select(Explanation.user_id, func.count())
-                .where(Explanation.user_id.in_(uids))
-                .group_by(Explanation.user_id)
-            ).all()
+        user_map = {u.id: u for u in db.execute(select(User).where(User.id.in_(uids))).scalars().all()}
+        stats = user_stats.load(db, uids)
+        judgement_map = {
+            j.user_id: j
+            for j in db.execute(
+                select(AiJudgement).where(
+                    AiJudgement.problem_id == pid,
+                    AiJudgement.user_id.in_(uids),
+                )
+            ).scalars().all()
         }
-        for u in user_rows:
-            total_creations = problem_counts.get(u.id, 0) + explanation_counts.get(u.id, 0)
-            rank, rank_level = _rank_info(int(total_creations))
-            display_name = u.nickname if u.nickname else u.username
-            user_map[u.id] = {
-                "user": u,
-                "display_name": display_name,
-                "icon_url": _icon_url(u),
-                "rank": rank,
-                "rank_level": rank_level,
-                "problem_count": problem_counts.get(u.id, 0),
-                "explanation_count": explanation_counts.get(u.id, 0),
-            }
-    judgement_map = {}
-    if uids:
-        jrows = db.execute(
-            select(AiJudgement).where(
-                AiJudgement.problem_id == pid,
-                AiJudgement.user_id.in_(uids),
-            )
-        ).scalars().all()
-        judgement_map = {j.user_id: j for j in jrows}
 
     try:
-        solvers = db.execute(
-            select(func.count(func.distinct(Answer.user_id))).where(Answer.problem_id == pid)
-        ).scalar_one() or 0
+        solvers = db.execute(_solvers_query(pid)).scalar_one() or 0
     except Exception:
         solvers = 0
 
     items = []
     for e in exps:
+        by = None
         author_icon_url = None
         author_rank = None
         author_rank_level = None
-        user_obj = None
-        info = None
         if e.user_id is None:
             by = "AI"
         else:
-            info = user_map.get(e.user_id)
-            if info:
-                by = info.get("display_name")
-                author_icon_url = info.get("icon_url")
-                author_rank = info.get("rank")
-                author_rank_level = info.get("rank_level")
-                user_obj = info.get("user")
-            else:
-                user_obj = db.get(User, e.user_id)
-                by = (user_obj.nickname if user_obj and user_obj.nickname else (user_obj.username if user_obj else None))
-        if user_obj is None and e.user_id is not None and info is None:
-            user_obj = db.get(User, e.user_id)
-        if author_icon_url is None and user_obj is not None:
-            author_icon_url = _icon_url(user_obj)
-        if author_rank is None and user_obj is not None:
-            total_creations = problem_counts.get(user_obj.id, 0) + explanation_counts.get(user_obj.id, 0)
-            author_rank, author_rank_level = _rank_info(int(total_creations))
-            if by is None:
-                by = user_obj.nickname if user_obj.nickname else user_obj.username
-
+            u = user_map.get(e.user_id)
+            if u is not None:
+                by = u.nickname if u.nickname else u.username
+                author_icon_url = _icon_url(u)
+            author_rank, author_rank_level = _rank_info(user_stats.total_creations(stats.get(e.user_id, {})))
         if not by:
             by = "ユーザー"
 
-        imgs = db.execute(
-            select(ExplanationImage).where(ExplanationImage.explanation_id == e.id).order_by(ExplanationImage.id.asc())
-        ).scalars().all()
-        img_urls = [f"/uploads/{im.filename}" for im in imgs]
-
-        j = judgement_map.get(getattr(e, "user_id", None))
+        j = judgement_map.get(e.user_id)
         wrong_cnt = wrong_flag_counts.get(e.id, 0)
         crowd_maybe_wrong = (solvers >= 10 and (wrong_cnt / max(1, solvers)) > 0.3)
-
-        if author_rank_level is not None:
-            try:
-                author_rank_level = int(author_rank_level)
-            except (TypeError, ValueError):
-                author_rank_level = None
-
         items.append({
             "id": e.id,
-            "content": e.content,
+            "content": e.content if content else None,
             "likes": e.like_count,
             "is_ai": (e.user_id is None),
             "option_index": e.option_index,
@@ -190,7 +185,8 @@ def list_explanations(
             "author_rank": author_rank,
             "author_rank_level": author_rank_level,
             "liked": (e.id in liked_ids),
-            "images": img_urls,
+            "images": [uploads.url(fn) for fn in images.get(e.id, [])],
+            "thumbnails": [uploads.url(fn, "thumb") for fn in images.get(e.id, [])],
             "ai_is_wrong": (j.is_wrong if j else None),
             "ai_judge_score": (j.score if j else None),
             "ai_judge_reason": (j.reason if j else None),
@@ -200,11 +196,42 @@ def list_explanations(
             "crowd_maybe_wrong": bool(crowd_maybe_wrong),
         })
 
-    if sort not in ("likes", "recent"):
-        import random
+    if sort not in _EXPLANATION_ORDERS:
         random.shuffle(items)
+    return items
 
-    return {"items": items}
+
+def _explanation_page(
+    db: Session,
+    pid: int,
+    viewer_id: int,
+    sort: str,
+    cursor: Optional[str],
+    limit: Optional[int],
+    fields: Optional[str],
+) -> dict:
+    """解説一覧の 1 ページ（cursor / limit / fields= は api.pagination）"""
+    limit = pagination.page_limit(limit, cursor)
+    want = pagination.parse_fields(fields, EXPLANATION_FIELDS)
+    fetch = limit + 1 if limit is not None else None
+    items = _explanation_items(db, pid, viewer_id, sort, fetch, cursor, content="content" in want)
+    items, next_cursor = pagination.page(items, limit, sort, _explanation_cursor_key(sort))
+    return {"items": [pagination.project(it, want) for it in items], "next_cursor": next_cursor}
+
+router = APIRouter(prefix="/explanations", tags=["explanations"])
+
+@router.get("/problem/{pid:int}")
+async def list_explanations(
+    pid: int,
+    sort: str = "likes",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    request: Request = None,
+    user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    return await db.run_sync(_explanation_page, pid, user.id, sort, cursor, limit, fields)
 
 @router.post("/problem/{pid:int}")
 def create_explanation(
@@ -221,33 +248,17 @@ def create_explanation(
     e = Explanation(problem_id=pid, user_id=user.id, content=content)
     db.add(e); db.flush()
 
-    if images:
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        subdir = os.path.join(settings.UPLOAD_DIR, "expl", str(e.id))
-        os.makedirs(subdir, exist_ok=True)
-        for f in images:
-            try:
-                blob = f.file.read()
-                if not blob:
-                    continue
-                base = os.path.basename(f.filename or "image")
-                name, ext = os.path.splitext(base)
-                ext = (ext or "").lower()
-                if ext not in (".png", ".jpg", ".jpeg", ".gif", ".webp"):
-                    ext = ".bin"
-                fn = f"e{e.id}_{int(time.time()*1000)}_{random.randint(1000,9999)}{ext}"
-                path = os.path.join(subdir, fn)
-                with open(path, "wb") as out:
-                    out.write(blob)
-                rel = os.path.relpath(path, settings.UPLOAD_DIR).replace("\\", "/")
-                db.add(ExplanationImage(explanation_id=e.id, filename=rel))
-            except Exception:
-                continue
+    for rel in uploads.save_images(images):
+        db.add(ExplanationImage(explanation_id=e.id, filename=rel))
 
+    user_stats.bump(db, user.id, explanation_count=1)
+    ai_enabled = llm_gateway.enabled()
+    if ai_enabled:
+        ai_jobs.enqueue(db, "judge_problem", pid, user.id)
+        ai_jobs.enqueue(db, "judge_explanation", pid, user.id, target_id=e.id)
     db.commit()
-    if settings.OPENAI_ENABLED and settings.OPENAI_API_KEY:
-        threading.Thread(target=judge_problem_for_user, args=(pid, user.id), daemon=True).start()
-        threading.Thread(target=judge_explanation_ai, args=(e.id,), daemon=True).start()
+    if ai_enabled:
+        ai_jobs.notify()
     return {"ok": True, "id": e.id}
 
 @router.get("/problem/{pid:int}/mine")
@@ -285,98 +296,69 @@ def edit_explanation(
     # If empty string is explicitly sent, delete this explanation
     if content is not None and (str(content).strip() == ""):
         # Remove likes and images first to avoid FK issues, then delete the row
+        image_files = uploads.explanation_files(db, [eid])
         db.query(ExplanationLike).filter(ExplanationLike.explanation_id == eid).delete(synchronize_session=False)
         db.query(ExplanationImage).filter(ExplanationImage.explanation_id == eid).delete(synchronize_session=False)
         db.delete(e)
+        user_stats.refresh(db, [user.id])
         db.commit()
+        uploads.release(image_files)
         return {"ok": True, "deleted": True, "id": eid}
     if content is not None:
         e.content = content
         changed = True
 
+    image_files: list[str] = []
     if clear_images:
+        image_files = uploads.explanation_files(db, [eid])
         db.query(ExplanationImage).filter(ExplanationImage.explanation_id == eid).delete(synchronize_session=False)
         changed = True
 
-    if images:
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        subdir = os.path.join(settings.UPLOAD_DIR, "expl", str(e.id))
-        os.makedirs(subdir, exist_ok=True)
-        for f in images:
-            try:
-                blob = f.file.read()
-                if not blob:
-                    continue
-                base = os.path.basename(f.filename or "image")
-                name, ext = os.path.splitext(base)
-                ext = (ext or "").lower()
-                if ext not in (".png", ".jpg", ".jpeg", ".gif", ".webp"):
-                    ext = ".bin"
-                fn = f"e{e.id}_{int(time.time()*1000)}_{random.randint(1000,9999)}{ext}"
-                path = os.path.join(subdir, fn)
-                with open(path, "wb") as out:
-                    out.write(blob)
-                rel = os.path.relpath(path, settings.UPLOAD_DIR).replace("\\", "/")
-                db.add(ExplanationImage(explanation_id=e.id, filename=rel))
-                changed = True
-            except Exception:
-                continue
+    for rel in uploads.save_images(images):
+        db.add(ExplanationImage(explanation_id=e.id, filename=rel))
+        changed = True
 
     if changed:
+        ai_enabled = llm_gateway.enabled()
+        if ai_enabled:
+            ai_jobs.enqueue(db, "judge_problem", e.problem_id, e.user_id)
+            ai_jobs.enqueue(db, "judge_explanation", e.problem_id, e.user_id, target_id=e.id)
         db.commit()
-        if settings.OPENAI_ENABLED and settings.OPENAI_API_KEY:
-            threading.Thread(target=judge_problem_for_user, args=(e.problem_id, e.user_id), daemon=True).start()
-            threading.Thread(target=judge_explanation_ai, args=(e.id,), daemon=True).start()
+        uploads.release(image_files)
+        if ai_enabled:
+            ai_jobs.notify()
 
     return {"ok": True, "id": e.id}
 
 # like / unlike on a single explanation
+def _explanation_row(db: Session, eid: int):
+    row = db.execute(
+        select(Explanation.user_id, Explanation.problem_id, Explanation.like_count).where(Explanation.id == eid)
+    ).first()
+    if not row:
+        raise HTTPException(404, "not found")
+    return row
+
 @router.post("/{eid:int}/like")
 def like_explanation(eid: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    e = db.get(Explanation, eid)
-    if not e:
-        raise HTTPException(404, "not found")
-    exists = db.execute(select(ExplanationLike).where(ExplanationLike.explanation_id==eid, ExplanationLike.user_id==user.id)).scalar_one_or_none()
-    if not exists:
-        db.add(ExplanationLike(explanation_id=eid, user_id=user.id))
-        e.like_count += 1
-        # upsert notification for explanation owner
-        try:
-            if e.user_id and e.user_id != user.id:
-                exists_n = db.execute(
-                    select(Notification).where(
-                        Notification.user_id == e.user_id,
-                        Notification.type == "explanation_like",
-                        Notification.problem_id == e.problem_id,
-                        Notification.actor_user_id == user.id,
-                    )
-                ).scalar_one_or_none()
-                if not exists_n:
-                    db.add(Notification(
-                        user_id=e.user_id,
-                        type="explanation_like",
-                        problem_id=e.problem_id,
-                        actor_user_id=user.id,
-                        ai_judged_wrong=None,
-                        crowd_judged_wrong=None,
-                    ))
-        except Exception:
-            pass
+    e = _explanation_row(db, eid)
+    like_count = e.like_count
+    if likes.like(db, "explanation", eid, user.id):
+        user_stats.bump(db, e.user_id, explanation_likes=1)
+        like_count = likes.count(db, "explanation", eid)
         db.commit()
-    return {"ok": True, "likes": e.like_count}
+        notification_writer.record_like(e.user_id, "explanation_like", e.problem_id, user.id)
+    return {"ok": True, "likes": like_count}
 
 @router.delete("/{eid:int}/like")
 def unlike_explanation(eid: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    e = db.get(Explanation, eid)
-    if not e:
-        raise HTTPException(404, "not found")
-    row = db.execute(select(ExplanationLike).where(ExplanationLike.explanation_id==eid, ExplanationLike.user_id==user.id)).scalar_one_or_none()
-    if row:
-        db.delete(row)
-        if e.like_count and e.like_count > 0:
-            e.like_count -= 1
+    e = _explanation_row(db, eid)
+    like_count = e.like_count
+    if likes.unlike(db, "explanation", eid, user.id):
+        user_stats.bump(db, e.user_id, explanation_likes=-1)
+        like_count = likes.count(db, "explanation", eid)
         db.commit()
-    return {"ok": True, "likes": e.like_count}
+    return {"ok": True, "likes": like_count}
 
 # wrong-flags
 @router.post("/{expl_id:int}/wrong-flags")
@@ -394,7 +376,7 @@ def add_wrong_flag(expl_id: int, user: User = Depends(get_current_user), db: Ses
         # If crowd judgement passes threshold (>=10 solvers and >30% flags), notify (upsert) the author
         try:
             # solvers count for the problem
-            solvers = db.execute(select(func.count(func.distinct(Answer.user_id))).where(Answer.problem_id == e.problem_id)).scalar_one() or 0
+            solvers = db.execute(_solvers_query(e.problem_id)).scalar_one() or 0
             wrong_cnt = db.execute(select(func.count(ExplanationWrongFlag.id)).where(ExplanationWrongFlag.explanation_id == expl_id)).scalar_one() or 0
             if solvers >= 10 and (wrong_cnt / max(1, solvers)) > 0.3:
                 if e.user_id and e.user_id != user.id:
@@ -407,16 +389,21 @@ def add_wrong_flag(expl_id: int, user: User = Depends(get_current_user), db: Ses
                     ).scalar_one_or_none()
                     if existing:
                         existing.crowd_judged_wrong = True
+                        n = existing
                     else:
-                        db.add(Notification(
+                        n = Notification(
                             user_id=e.user_id,
                             type="explanation_wrong",
                             problem_id=e.problem_id,
                             actor_user_id=None,
                             ai_judged_wrong=False,
                             crowd_judged_wrong=True,
-                        ))
+                        )
+                        db.add(n)
+                    db.flush()
+                    notified = (n.user_id, n.id)
                     db.commit()
+                    notify_hub.publish(*notified)
         except Exception:
             pass
     count = db.execute(
@@ -444,7 +431,11 @@ def delete_my_explanations(pid: int, user: User = Depends(get_current_user), db:
     ex_ids = [row[0] for row in db.execute(select(Explanation.id).where(Explanation.problem_id == pid, Explanation.user_id == user.id)).all()]
     if not ex_ids:
         return {"ok": True, "deleted": 0}
+    image_files = uploads.explanation_files(db, ex_ids)
+    db.query(ExplanationImage).filter(ExplanationImage.explanation_id.in_(ex_ids)).delete(synchronize_session=False)
     db.query(ExplanationLike).filter(ExplanationLike.explanation_id.in_(ex_ids)).delete(synchronize_session=False)
     deleted = db.query(Explanation).filter(Explanation.id.in_(ex_ids)).delete(synchronize_session=False)
+    user_stats.refresh(db, [user.id])
     db.commit()
+    uploads.release(image_files)
     return {"ok": True, "deleted": int(deleted or 0)}
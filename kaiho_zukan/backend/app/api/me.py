@@ -1,9 +1,13 @@
 from fastapi import APIRouter, Depends, Form
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func, text
-from api.deps import get_current_user
-from core.db import get_db
+from sqlalchemy.orm import Session, defer
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from api import pagination
+from api.deps import get_current_user, get_current_user_async
+from core.db import get_db, get_async_read_db
 from models import User, Category, UserCategory
+from security import user_cache
+from services import leaderboard
 
 
 
@@ -15,10 +19,10 @@ def _icon_url(user: User) -> str:
 router = APIRouter(tags=["me"])
 
 @router.get("/me")
-def me(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    cats = db.execute(
+async def me(user: User = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_read_db)):
+    cats = (await db.execute(
         select(Category.id, Category.name).join(UserCategory, UserCategory.category_id==Category.id).where(UserCategory.user_id==user.id)
-    ).all()
+    )).all()
     return {"id": user.id, "username": user.username, "nickname": user.nickname, "points": user.points,
             "icon_url": _icon_url(user),
             "categories": [{"id": c.id, "name": c.name} for c in cats]}
@@ -36,48 +40,62 @@ def update_me(nickname: str | None = Form(None), user: User = Depends(get_curren
     if nickname is not None:
         user.nickname = nickname
         db.commit()
+        user_cache.invalidate(user.id)
+        leaderboard.mark_dirty()
     return {"ok": True}
 
+MY_PROBLEM_FIELDS = ("id", "title", "qtype", "like_count", "ex_cnt")
+
 @router.get("/my/explanations/problems")
-def my_explanations_problems(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def my_explanations_problems(cursor: str | None = None, limit: int | None = None, fields: str | None = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     from models import Problem, Explanation
-    rows = db.execute(
+    limit = pagination.page_limit(limit, cursor)
+    want = pagination.parse_fields(fields, ("id", "title", "qtype"))
+    q = (
         select(Problem)
+        .options(defer(Problem.body))
         .join(Explanation, Explanation.problem_id == Problem.id)
         .where(Explanation.user_id == user.id)
         .group_by(Problem.id)
-        .order_by(Problem.id.desc())
-    ).scalars().all()
-    items = [{"id": p.id, "title": p.title, "qtype": p.qtype} for p in rows]
-    return {"items": items}
+    )
+    q = pagination.keyset(q, [(Problem.id, True)], "new", cursor, limit)
+    rows, next_cursor = pagination.page(db.execute(q).scalars().all(), limit, "new", lambda p: (p.id,))
+    items = [pagination.project({"id": p.id, "title": p.title, "qtype": p.qtype}, want) for p in rows]
+    return {"items": items, "next_cursor": next_cursor}
 
 @router.get("/my/problems")
-def my_problems(sort: str = "new", user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def my_problems(sort: str = "new", cursor: str | None = None, limit: int | None = None, fields: str | None = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     from models import Problem, Explanation
+    limit = pagination.page_limit(limit, cursor)
+    want = pagination.parse_fields(fields, MY_PROBLEM_FIELDS)
+    ex_cnt = func.count(Explanation.id)
     base = (
         select(
             Problem,
-            func.count(Explanation.id).label("ex_cnt"),
+            ex_cnt.label("ex_cnt"),
         )
+        .options(defer(Problem.body))
         .outerjoin(Explanation, Explanation.problem_id == Problem.id)
         .where(Problem.created_by == user.id)
         .group_by(Problem.id)
     )
+    having = False
     if sort == "likes":
-        q = base.order_by(Problem.like_count.desc(), Problem.id.desc())
+        order, key = [(Problem.like_count, True), (Problem.id, True)], lambda r: (int(r[0].like_count or 0), r[0].id)
     elif sort == "ex_cnt":
-        q = base.order_by(text("ex_cnt DESC"), Problem.id.desc())
+        order, key, having = [(ex_cnt, True), (Problem.id, True)], lambda r: (int(r[1] or 0), r[0].id), True
     else:
-        q = base.order_by(Problem.id.desc())
-    rows = db.execute(q).all()
+        order, key = [(Problem.id, True)], lambda r: (r[0].id,)
+    q = pagination.keyset(base, order, sort, cursor, limit, having=having)
+    rows, next_cursor = pagination.page(db.execute(q).all(), limit, sort, key)
     items = [
-        {
+        pagination.project({
             "id": p.id,
             "title": p.title,
             "qtype": p.qtype,
             "like_count": int(p.like_count or 0),
-            "ex_cnt": int(ex_cnt or 0),
-        }
-        for p, ex_cnt in rows
+            "ex_cnt": int(cnt or 0),
+        }, want)
+        for p, cnt in rows
     ]
-    return {"items": items}
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+
+from api.deps import get_current_user
+from models import User
+from core.db import pool_stats, replica_stats
+from services import category_tree, image_payload, llm_cache, notify_hub
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("")
+def metrics(user: User = Depends(get_current_user)):
+    """プロセス内キャッシュなどの稼働状況（ワーカー単位の値）"""
+    return {
+        "image_cache": image_payload.stats(),
+        "llm_cache": llm_cache.stats(),
+        "db_pool": pool_stats(),
+        "db_replicas": replica_stats(),
+        "notify_hub": notify_hub.stats(),
+        "category_tree": category_tree.stats(),
+    }
@@ -1,45 +1,169 @@
+import json
 from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, update
 
-from api.deps import get_current_user
-from core.db import get_db
+from api.deps import get_current_user, get_current_user_async, current_user_id
+from core.config import get_settings
+from core.db import get_db, get_async_read_db, async_session
 from models import User, Notification, Problem
+from security import user_cache
+from services import notification_writer, notify_hub
 
+settings = get_settings()
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
+# 再接続時の再送を 1 回に読む件数
+_REPLAY_BATCH = 200
+
 
 @router.get("")
-def list_notifications(
+async def list_notifications(
     unseen_only: bool = False,
     limit: int = 50,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    before_seq: Optional[int] = None,
+    after_seq: Optional[int] = None,
+    user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    q = select(Notification).where(Notification.user_id == user.id).order_by(Notification.created_at.desc())
+    """
+    新しい順（seq の降順。いいねが増えた集約通知は先頭へ上がる）に返す。問題タイトルと操作したユーザー名は 1 クエリで JOIN する。
+    - before_seq: これより古いもの（次ページは next_before_seq を渡す）
+    - after_seq: これより後に追加・更新されたもの（ポーリング用。件数が limit を超える場合は古い側から limit 件で、
+      次回は next_after_seq を渡す。next_before_seq は付けない）
+    """
+    limit = max(1, min(200, limit))
+    q = _select_notifications(user.id)
     if unseen_only:
         q = q.where(Notification.seen == False)  # noqa: E712 (SQLAlchemy boolean expr)
-    rows = db.execute(q.limit(max(1, min(200, limit)))).scalars().all()
-    items = [
-        (n, db.get(Problem, n.problem_id) if n.problem_id else None, db.get(User, n.actor_user_id) if n.actor_user_id else None)
-        for n in rows
-    ]
-    out = []
-    for n, prob, actor in items:
-        out.append({
-            "id": n.id,
-            "type": n.type,
-            "problem_id": n.problem_id,
-            "problem_title": getattr(prob, "title", None),
-            "actor_user_id": n.actor_user_id,
-            "actor_name": getattr(actor, "nickname", None) or getattr(actor, "username", None),
-            "ai_judged_wrong": n.ai_judged_wrong,
-            "crowd_judged_wrong": n.crowd_judged_wrong,
-            "seen": bool(n.seen),
-            "created_at": n.created_at.isoformat() if hasattr(n.created_at, 'isoformat') else n.created_at,
-        })
-    return {"items": out}
+    if before_seq is not None:
+        q = q.where(Notification.seq < before_seq)
+    if after_seq is not None:
+        q = q.where(Notification.seq > after_seq)
+        # 取りこぼしが出ないよう after_seq の直後から取り、表示順に並べ直す
+        rows = list(reversed((await db.execute(q.order_by(Notification.seq.asc()).limit(limit))).all()))
+        items = [_notification_out(*row) for row in rows]
+        # 返した中で最新のもの（無ければ渡された値のまま）から続ける
+        next_after_seq = items[0]["seq"] if items else after_seq
+        return {"items": items, "next_before_seq": None, "next_after_seq": next_after_seq}
+    rows = (await db.execute(q.order_by(Notification.seq.desc()).limit(limit))).all()
+    items = [_notification_out(*row) for row in rows]
+    next_before_seq = items[-1]["seq"] if len(items) == limit else None
+    return {"items": items, "next_before_seq": next_before_seq, "next_after_seq": None}
+
+
+@router.get("/unread-count")
+async def unread_count(
+    user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    # idx_notif_user_seen だけで数えられる（行は読まない）
+    count = (await db.execute(
+        select(func.count()).select_from(Notification)
+        .where(Notification.user_id == user.id, Notification.seen == False)  # noqa: E712
+    )).scalar_one()
+    return {"count": int(count or 0)}
+
+
+def _select_notifications(user_id: int):
+    """通知に問題タイトルと操作したユーザー名を JOIN した select（行は _notification_out で変換）"""
+    actor = aliased(User)
+    return (
+        select(Notification, Problem.title, actor.nickname, actor.username)
+        .outerjoin(Problem, Problem.id == Notification.problem_id)
+        .outerjoin(actor, actor.id == Notification.actor_user_id)
+        .where(Notification.user_id == user_id)
+    )
+
+
+def _notification_out(n: Notification, problem_title: Optional[str], nickname: Optional[str], username: Optional[str]) -> dict:
+    return {
+        "id": n.id,
+        "seq": int(n.seq or 0),
+        "type": n.type,
+        "problem_id": n.problem_id,
+        "problem_title": problem_title,
+        "actor_user_id": n.actor_user_id,
+        "actor_name": nickname or username,
+        # いいね通知を集約した行では actor_* は最新のユーザ、actor_count が件数
+        "actor_count": int(n.actor_count or 1),
+        "recent_actor_ids": notification_writer.parse_recent(n.recent_actor_ids) or ([n.actor_user_id] if n.actor_user_id else []),
+        "ai_judged_wrong": n.ai_judged_wrong,
+        "crowd_judged_wrong": n.crowd_judged_wrong,
+        "seen": bool(n.seen),
+        "created_at": n.created_at.isoformat() if hasattr(n.created_at, 'isoformat') else n.created_at,
+    }
+
+
+@router.get("/stream")
+async def stream_notifications(request: Request, last_event_id: Optional[int] = None):
+    """
+    通知を Server-Sent Events で送る（ポーリングの代わり）。
+    event: notification / id: 通知の seq / data: 一覧と同じ形の JSON。追加だけでなく更新（誤り判定の追記・いいねの集約）も送る。
+    再接続時は Last-Event-ID ヘッダ（付けられないクライアントは last_event_id クエリ）より後に追加・更新された通知を再送する。
+    """
+    # 認証は Depends を使わない（依存のセッションがストリームの間ずっと接続を掴むため）
+    user_id = current_user_id(request)
+    if user_cache.peek(user_id) is None:
+        async with async_session() as db:
+            if await db.get(User, user_id) is None:
+                raise HTTPException(401, "User not found")
+    header = request.headers.get("last-event-id")
+    if header and header.strip().isdigit():
+        last_event_id = int(header.strip())
+    return StreamingResponse(
+        _event_stream(user_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(item: dict, event_id: int) -> str:
+    return f"id: {event_id}\nevent: notification\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+
+
+async def _load_items(user_id: int, *conds, limit: Optional[int] = None) -> list[dict]:
+    """ストリーム用。接続はストリームの間ずっとは持たず、読むたびに短く開け閉めする"""
+    q = _select_notifications(user_id).where(*conds).order_by(Notification.seq.asc())
+    if limit is not None:
+        q = q.limit(limit)
+    async with async_session() as db:
+        return [_notification_out(*row) for row in (await db.execute(q)).all()]
+
+
+async def _event_stream(user_id: int, last_id: Optional[int]):
+    # 先に購読してから再送分を読む（間に入った通知を落とさない。重複は id・seq で判別できる）
+    sub = notify_hub.subscribe(user_id)
+    try:
+        if last_id is None:
+            # 初回接続: 既存の通知は一覧 API で取る前提で、今の最新 seq から始める
+            async with async_session() as db:
+                last_id = (await db.execute(
+                    select(func.max(Notification.seq)).where(Notification.user_id == user_id)
+                )).scalar() or 0
+        else:
+            while True:
+                items = await _load_items(user_id, Notification.seq > last_id, limit=_REPLAY_BATCH)
+                for item in items:
+                    last_id = item["seq"]
+                    yield _sse(item, last_id)
+                if len(items) < _REPLAY_BATCH:
+                    break
+        yield "retry: 3000\n\n"
+        while True:
+            ids = await sub.wait(settings.NOTIFY_KEEPALIVE_SEC)
+            if not ids:
+                yield ": keep-alive\n\n"
+                continue
+            for item in await _load_items(user_id, Notification.id.in_(ids)):
+                # 同じ通知が続けて更新されて古い seq の内容が届いても Last-Event-ID は巻き戻さない
+                last_id = max(last_id, item["seq"])
+                yield _sse(item, last_id)
+    finally:
+        notify_hub.unsubscribe(sub)
 
 
 @router.post("/seen")
@@ -50,11 +174,30 @@ def mark_seen(
 ):
     if not isinstance(ids, list) or not ids:
         return {"ok": True, "updated": 0}
-    rows = db.execute(
-        select(Notification).where(Notification.user_id == user.id, Notification.id.in_(ids))
-    ).scalars().all()
-    for n in rows:
-        n.seen = True
+    # 行は読まずに 1 本の UPDATE で済ませる（updated は今回既読になった件数）
+    res = db.execute(
+        update(Notification)
+        .where(Notification.user_id == user.id, Notification.id.in_(ids), Notification.seen == False)  # noqa: E712
+        .values(seen=True)
+        .execution_options(synchronize_session=False)
+    )
     db.commit()
-    return {"ok": True, "updated": len(rows)}
+    return {"ok": True, "updated": int(res.rowcount or 0)}
 
+
+@router.post("/seen-all")
+def mark_all_seen(
+    up_to_seq: Optional[int] = None,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    未読をすべて既読にする。up_to_seq を渡すとその seq 以下（その値を含む）だけ
+    （画面に出ている最新の seq を渡せば、その後に届いた通知やいいねが増えた集約通知は未読のまま残る）
+    """
+    q = update(Notification).where(Notification.user_id == user.id, Notification.seen == False)  # noqa: E712
+    if up_to_seq is not None:
+        q = q.where(Notification.seq <= up_to_seq)
+    res = db.execute(q.values(seen=True).execution_options(synchronize_session=False))
+    db.commit()
+    return {"ok": True, "updated": int(res.rowcount or 0)}
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from PIL import Image
 import io, base64
 from core.config import get_settings
+from services import llm_cache, llm_gateway
 
 settings = get_settings()
 
@@ -13,6 +15,7 @@ router = APIRouter()
 async def ocr_image(
     file: UploadFile = File(..., description="Image file for OCR (png/jpg/jpeg)"),
     lang: str = Form("jpn+eng"),
+    no_cache: bool = Form(False),
 ):
     try:
         content = await file.read()
@@ -26,7 +29,7 @@ async def ocr_image(
             raise HTTPException(status_code=400, detail="invalid image")
 
         # Prefer OpenAI (gpt-4o-mini) when enabled, otherwise 400 (or later: fallback to tesseract)
-        if not (settings.OPENAI_ENABLED and settings.OPENAI_API_KEY):
+        if not llm_gateway.enabled():
             raise HTTPException(status_code=400, detail="openai disabled or missing api key")
 
         # Build data URL for image
@@ -40,8 +43,7 @@ async def ocr_image(
 
         # Call OpenAI vision with concise OCR instruction (Japanese+English)
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=settings.OPENAI_API_KEY)
+            client = llm_gateway.get_client()
             prompt = (
                 "以下の画像内に含まれるテキストだけを正確に抽出して返してください。"
                 "改行も適切に保持し、説明や前後の補足は一切不要です。"
@@ -50,13 +52,16 @@ async def ocr_image(
                 {"type": "text", "text": prompt},
                 {"type": "image_url", "image_url": {"url": data_url}},
             ]
-            resp = client.chat.completions.create(
+            # 同期の HTTP 呼び出しなのでイベントループを塞がないようスレッドで実行
+            text = (await run_in_threadpool(
+                llm_cache.complete,
+                client,
                 model=(settings.OPENAI_MODEL or "gpt-4o-mini"),
                 messages=[{"role": "user", "content": message}],
                 temperature=0.0,
                 max_tokens=1500,
-            )
-            text = (resp.choices[0].message.content or "").strip()
+                bypass=no_cache,
+            )).strip()
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"openai error: {e}")
 
@@ -0,0 +1,92 @@
+"""
+一覧 API のカーソルページング（keyset）と fields= による項目の絞り込み。
+
+- カーソルは sort 名と (並び順のキー..., id) を JSON にして base64url にした不透明な文字列。
+  別の sort で作られたカーソルや壊れたカーソルは 400
+- 次ページは「前ページ最後の行より後ろ」の条件（k1 < v1 OR (k1 = v1 AND k2 < v2) ...）で読む。
+  OFFSET を使わないので、何ページ目でも並び順のインデックスを途中から読むだけで済む
+- limit + 1 件読み、続きがあれば next_cursor を返す（最後のページは None）
+- limit も cursor も付けない呼び出し（カーソルを辿らない従来のクライアント）には従来どおり全件を返す
+- fields= はカンマ区切りの項目名。指定が無ければ従来どおり全項目。本文（Problem.body / Explanation.content）は
+  指定されたときだけ読み込む（defer）
+"""
+import base64
+import json
+from typing import Any, Callable, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.sql import ColumnElement
+
+from core.config import get_settings
+
+settings = get_settings()
+
+# 並び順: (式, 降順か) のリスト。最後は一意なキー（id）にする
+Order = list[tuple[ColumnElement, bool]]
+
+
+def page_limit(limit: Optional[int], cursor: Optional[str] = None) -> Optional[int]:
+    """1 ページの件数。limit も cursor も無ければ None（全件）"""
+    if limit is None:
+        return settings.LIST_PAGE_SIZE if cursor else None
+    return max(1, min(int(limit), settings.LIST_PAGE_MAX))
+
+
+def encode_cursor(sort: str, values: Sequence[Any]) -> str:
+    raw = json.dumps({"s": sort, "k": list(values)}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, n: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        obj = json.loads(raw)
+        values = obj["k"]
+        ok = obj["s"] == sort and isinstance(values, list) and len(values) == n
+    except Exception:
+        ok = False
+    if not ok or not all(isinstance(v, (int, float, str)) for v in values):
+        raise HTTPException(400, "invalid cursor")
+    return values
+
+
+def after(order: Order, values: Sequence[Any]):
+    """並び順で values の行より後ろにある行の条件"""
+    conds = []
+    for i, (expr, desc) in enumerate(order):
+        head = [order[j][0] == values[j] for j in range(i)]
+        conds.append(and_(*head, expr < values[i] if desc else expr > values[i]))
+    return or_(*conds)
+
+
+def keyset(q, order: Order, sort: str, cursor: Optional[str], limit: Optional[int], having: bool = False):
+    """q に並び順・カーソル条件・limit + 1 を付ける（集計値で並べるときは having=True。limit が None なら全件）"""
+    if cursor:
+        cond = after(order, decode_cursor(cursor, sort, len(order)))
+        q = q.having(cond) if having else q.where(cond)
+    q = q.order_by(*(expr.desc() if desc else expr.asc() for expr, desc in order))
+    return q if limit is None else q.limit(limit + 1)
+
+
+def page(rows: list, limit: Optional[int], sort: str, key: Optional[Callable[[Any], Sequence[Any]]]) -> tuple[list, Optional[str]]:
+    """limit + 1 件読んだ結果を 1 ページ分と next_cursor に分ける（key が None の並び順は続きを返さない）"""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (encode_cursor(sort, key(rows[-1])) if key else None)
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> set[str]:
+    """fields= を項目名の集合にする（未指定なら全項目。id は常に含める）"""
+    if not fields:
+        return set(allowed)
+    want = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = want - set(allowed)
+    if unknown:
+        raise HTTPException(400, f"unknown fields: {', '.join(sorted(unknown))}")
+    return want | ({"id"} & set(allowed))
+
+
+def project(item: dict, fields: set[str]) -> dict:
+    return {k: v for k, v in item.items() if k in fields}
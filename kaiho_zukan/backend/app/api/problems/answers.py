@@ -1,12 +1,14 @@
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Form, HTTPException
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
 from api.deps import get_current_user
 from core.db import get_db
 from models import Answer, Explanation, Problem, User
+from security import user_cache
+from services import problem_sampler, problem_state, user_stats
 
 router = APIRouter()
 
@@ -30,18 +32,23 @@ def answer_problem(
         correct = None if is_correct is None else bool(is_correct)
     else:
         correct = None if is_correct is None else bool(is_correct)
-    db.add(
-        Answer(
-            problem_id=pid,
-            user_id=user.id,
-            selected_option_id=selected_option_id,
-            free_text=free_text,
-            is_correct=correct,
-        )
+    answer = Answer(
+        problem_id=pid,
+        user_id=user.id,
+        selected_option_id=selected_option_id,
+        free_text=free_text,
+        is_correct=correct,
     )
+    db.add(answer)
+    db.flush()
+    problem_state.record(db, user.id, problem, answer.id, correct, answer.created_at)
     if correct:
-        user.points += 1
+        db.execute(update(User).where(User.id == user.id).values(points=User.points + 1))
+    user_stats.bump(db, user.id, answer_count=1, correct_count=1 if correct else 0)
     db.commit()
+    if correct:
+        user_cache.invalidate(user.id)
+        problem_sampler.on_solved(user.id, pid, problem.child_id, problem.grand_id)
     explanations = db.execute(
         select(Explanation)
         .where(Explanation.problem_id == pid)
@@ -1,215 +1,38 @@
-import os
-import random
-import threading
-import time
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
-from sqlalchemy import func, select
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from api.deps import get_current_user
+from api.deps import get_current_user, get_current_user_async
 from core.config import get_settings
-from core.db import get_db
+from core.db import get_async_read_db, get_db
 from models import (
-    Answer,
     Explanation,
     ExplanationImage,
     ExplanationLike,
-    ExplanationWrongFlag,
     Problem,
     User,
-    AiJudgement,
 )
-from services.ai_judge import judge_problem_for_user
-from api.explanations import _icon_url, _rank_info
+from services import ai_jobs, llm_gateway, uploads, user_stats
+from api.explanations import _explanation_page
 
 settings = get_settings()
 router = APIRouter()
 
 
 @router.get("/{pid:int}/explanations")
-def problem_explanations(
+async def problem_explanations(
     pid: int,
     sort: str = Query("likes"),
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    query = select(Explanation).where(Explanation.problem_id == pid)
-    if sort == "likes":
-        query = query.order_by(Explanation.like_count.desc(), Explanation.id.asc())
-    elif sort == "recent":
-        query = query.order_by(Explanation.id.desc())
-    explanations = db.execute(query).scalars().all()
-
-    explanation_ids = [explanation.id for explanation in explanations]
-    liked_rows = db.execute(
-        select(ExplanationLike.explanation_id).where(
-            ExplanationLike.user_id == user.id,
-            ExplanationLike.explanation_id.in_(explanation_ids)
-            if explanation_ids
-            else (ExplanationLike.explanation_id == -1),
-        )
-    ).all() if explanation_ids else []
-    liked_ids = {int(row[0]) for row in liked_rows}
-
-    wrong_flag_counts = {eid: 0 for eid in explanation_ids}
-    if explanation_ids:
-        rows = db.execute(
-            select(ExplanationWrongFlag.explanation_id, func.count())
-            .where(ExplanationWrongFlag.explanation_id.in_(explanation_ids))
-            .group_by(ExplanationWrongFlag.explanation_id)
-        ).all()
-        for explanation_id, count in rows:
-            wrong_flag_counts[int(explanation_id)] = int(count or 0)
-    flagged_rows = db.execute(
-        select(ExplanationWrongFlag.explanation_id).where(
-            ExplanationWrongFlag.user_id == user.id,
-            ExplanationWrongFlag.explanation_id.in_(explanation_ids)
-            if explanation_ids
-            else (ExplanationWrongFlag.explanation_id == -1),
-        )
-    ).all() if explanation_ids else []
-    flagged_ids = {int(row[0]) for row in flagged_rows}
-
-    user_ids = list(
-        {
-            explanation.user_id
-            for explanation in explanations
-            if getattr(explanation, "user_id", None) is not None
-        }
-    )
-    problem_counts: dict[int, int] = {}
-    explanation_counts: dict[int, int] = {}
-    user_map: dict[int, dict[str, object]] = {}
-    judgement_map: dict[int, AiJudgement] = {}
-    if user_ids:
-        user_rows = db.execute(select(User).where(User.id.in_(user_ids))).scalars().all()
-        problem_counts.update({
-            int(uid): int(cnt or 0)
-            for uid, cnt in db.execute(
-                select(Problem.created_by, func.count())
-                .where(Problem.created_by.in_(user_ids))
-                .group_by(Problem.created_by)
-            ).all()
-        })
-        explanation_counts.update({
-            int(uid): int(cnt or 0)
-            for uid, cnt in db.execute(
-                select(Explanation.user_id, func.count())
-                .where(Explanation.user_id.in_(user_ids))
-                .group_by(Explanation.user_id)
-            ).all()
-        })
-        for user_row in user_rows:
-            total_creations = problem_counts.get(user_row.id, 0) + explanation_counts.get(user_row.id, 0)
-            rank, rank_level = _rank_info(int(total_creations))
-            display_name = user_row.nickname if user_row.nickname else user_row.username
-            user_map[user_row.id] = {
-                "user": user_row,
-                "display_name": display_name,
-                "icon_url": _icon_url(user_row),
-                "rank": rank,
-                "rank_level": rank_level,
-            }
-        judgements = (
-            db.execute(
-                select(AiJudgement).where(
-                    AiJudgement.problem_id == pid,
-                    AiJudgement.user_id.in_(user_ids),
-                )
-            )
-            .scalars()
-            .all()
-        )
-        judgement_map = {judgement.user_id: judgement for judgement in judgements}
-
-    try:
-        solvers = db.execute(
-            select(func.count(func.distinct(Answer.user_id))).where(Answer.problem_id == pid)
-        ).scalar_one() or 0
-    except Exception:
-        solvers = 0
-
-    items = []
-    for explanation in explanations:
-        author_icon_url = None
-        author_rank = None
-        author_rank_level = None
-        user_row = None
-        info = None
-        if explanation.user_id is None:
-            created_by = "AI"
-        else:
-            info = user_map.get(explanation.user_id) if explanation.user_id is not None else None
-            if info:
-                created_by = info.get("display_name")
-                author_icon_url = info.get("icon_url")
-                author_rank = info.get("rank")
-                author_rank_level = info.get("rank_level")
-                user_row = info.get("user")
-            else:
-                user_row = db.get(User, explanation.user_id) if explanation.user_id is not None else None
-                created_by = (
-                    user_row.nickname
-                    if user_row and user_row.nickname
-                    else (user_row.username if user_row else None)
-                )
-        if user_row is None and explanation.user_id is not None and info is None:
-            user_row = db.get(User, explanation.user_id)
-        if author_icon_url is None and user_row is not None:
-            author_icon_url = _icon_url(user_row)
-        if author_rank is None and user_row is not None:
-            total_creations = problem_counts.get(user_row.id, 0) + explanation_counts.get(user_row.id, 0)
-            author_rank, author_rank_level = _rank_info(int(total_creations))
-            if not created_by:
-                created_by = user_row.nickname if user_row.nickname else user_row.username
-        if not created_by:
-            created_by = "ユーザー"
-
-        images = (
-            db.execute(
-                select(ExplanationImage)
-                .where(ExplanationImage.explanation_id == explanation.id)
-                .order_by(ExplanationImage.id.asc())
-            )
-            .scalars()
-            .all()
-        )
-        image_urls = [f"/uploads/{image.filename}" for image in images]
-
-        judgement = judgement_map.get(getattr(explanation, "user_id", None))
-        wrong_count = wrong_flag_counts.get(explanation.id, 0)
-        crowd_maybe_wrong = solvers >= 10 and (wrong_count / max(1, solvers)) > 0.3
-
-        items.append(
-            {
-                "id": explanation.id,
-                "content": explanation.content,
-                "likes": explanation.like_count,
-                "is_ai": explanation.user_id is None,
-                "option_index": explanation.option_index,
-                "user_id": explanation.user_id,
-                "by": created_by,
-                "author_icon_url": author_icon_url,
-                "author_rank": author_rank,
-                "author_rank_level": author_rank_level,
-                "liked": explanation.id in liked_ids,
-                "images": image_urls,
-                "ai_is_wrong": (judgement.is_wrong if judgement else None),
-                "ai_judge_score": (judgement.score if judgement else None),
-                "ai_judge_reason": (judgement.reason if judgement else None),
-                "wrong_flag_count": wrong_count,
-                "flagged_wrong": explanation.id in flagged_ids,
-                "solvers_count": int(solvers),
-                "crowd_maybe_wrong": bool(crowd_maybe_wrong),
-            }
-        )
-
-    if sort not in ("likes", "recent"):
-        random.shuffle(items)
-
-    return {"items": items}
+    return await db.run_sync(_explanation_page, pid, user.id, sort, cursor, limit, fields)
 
 
 @router.post("/{pid:int}/explanations")
@@ -228,36 +51,16 @@ def create_explanation_under_problem(
     db.add(explanation)
     db.flush()
 
-    if images:
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        subdir = os.path.join(settings.UPLOAD_DIR, "expl", str(explanation.id))
-        os.makedirs(subdir, exist_ok=True)
-        for upload in images:
-            try:
-                blob = upload.file.read()
-                if not blob:
-                    continue
-                base = os.path.basename(upload.filename or "image")
-                name, ext = os.path.splitext(base)
-                ext = (ext or "").lower()
-                if ext not in (".png", ".jpg", ".jpeg", ".gif", ".webp"):
-                    ext = ".bin"
-                filename = (
-                    f"e{explanation.id}_{int(time.time() * 1000)}_{random.randint(1000, 9999)}{ext}"
-                )
-                path = os.path.join(subdir, filename)
-                with open(path, "wb") as out:
-                    out.write(blob)
-                rel_path = os.path.relpath(path, settings.UPLOAD_DIR).replace("\\", "/")
-                db.add(ExplanationImage(explanation_id=explanation.id, filename=rel_path))
-            except Exception:
-                continue
+    for rel_path in uploads.save_images(images):
+        db.add(ExplanationImage(explanation_id=explanation.id, filename=rel_path))
 
+    user_stats.bump(db, user.id, explanation_count=1)
+    ai_enabled = llm_gateway.enabled()
+    if ai_enabled:
+        ai_jobs.enqueue(db, "judge_problem", pid, user.id)
     db.commit()
-    if settings.OPENAI_ENABLED and settings.OPENAI_API_KEY:
-        threading.Thread(
-            target=judge_problem_for_user, args=(pid, user.id), daemon=True
-        ).start()
+    if ai_enabled:
+        ai_jobs.notify()
     return {"ok": True, "id": explanation.id}
 
 
@@ -302,6 +105,7 @@ def delete_my_explanations_for_problem(
     ]
     if not explanation_ids:
         return {"ok": True, "deleted": 0}
+    image_files = uploads.explanation_files(db, explanation_ids)
     db.query(ExplanationImage).filter(
         ExplanationImage.explanation_id.in_(explanation_ids)
     ).delete(synchronize_session=False)
@@ -311,5 +115,7 @@ def delete_my_explanations_for_problem(
     deleted = db.query(Explanation).filter(Explanation.id.in_(explanation_ids)).delete(
         synchronize_session=False
     )
+    user_stats.refresh(db, [user.id])
     db.commit()
+    uploads.release(image_files)
     return {"ok": True, "deleted": len(explanation_ids)}
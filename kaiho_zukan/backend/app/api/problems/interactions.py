@@ -4,54 +4,37 @@ from sqlalchemy.orm import Session
 
 from api.deps import get_current_user
 from core.db import get_db
-from models import Notification, Problem, ProblemExplLike, ProblemLike, User
+from models import Problem, User
+from services import likes, notification_writer, problem_sampler, user_stats
 
 router = APIRouter()
 
 
+def _problem_row(db: Session, pid: int):
+    row = db.execute(
+        select(Problem.created_by, Problem.child_id, Problem.grand_id, Problem.like_count, Problem.expl_like_count)
+        .where(Problem.id == pid)
+    ).first()
+    if not row:
+        raise HTTPException(404, "not found")
+    return row
+
+
 @router.post("/{pid:int}/like")
 def like_problem(
     pid: int,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    problem = db.get(Problem, pid)
-    if not problem:
-        raise HTTPException(404, "not found")
-    exists = db.execute(
-        select(ProblemLike).where(
-            ProblemLike.problem_id == pid,
-            ProblemLike.user_id == user.id,
-        )
-    ).scalar_one_or_none()
-    if not exists:
-        db.add(ProblemLike(problem_id=pid, user_id=user.id))
-        problem.like_count += 1
-        try:
-            if problem.created_by and problem.created_by != user.id:
-                existing_notification = db.execute(
-                    select(Notification).where(
-                        Notification.user_id == problem.created_by,
-                        Notification.type == "problem_like",
-                        Notification.problem_id == problem.id,
-                        Notification.actor_user_id == user.id,
-                    )
-                ).scalar_one_or_none()
-                if not existing_notification:
-                    db.add(
-                        Notification(
-                            user_id=problem.created_by,
-                            type="problem_like",
-                            problem_id=problem.id,
-                            actor_user_id=user.id,
-                            ai_judged_wrong=None,
-                            crowd_judged_wrong=None,
-                        )
-                    )
-        except Exception:
-            pass
+    problem = _problem_row(db, pid)
+    like_count = problem.like_count
+    if likes.like(db, "problem", pid, user.id):
+        user_stats.bump(db, problem.created_by, problem_likes=1)
+        like_count = likes.count(db, "problem", pid)
         db.commit()
-    return {"ok": True, "like_count": problem.like_count}
+        notification_writer.record_like(problem.created_by, "problem_like", pid, user.id)
+        problem_sampler.on_like_changed(pid, problem.child_id, problem.grand_id, like_count)
+    return {"ok": True, "like_count": like_count}
 
 
 @router.delete("/{pid:int}/like")
@@ -60,21 +43,14 @@ def unlike_problem(
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    problem = db.get(Problem, pid)
-    if not problem:
-        raise HTTPException(404, "not found")
-    row = db.execute(
-        select(ProblemLike).where(
-            ProblemLike.problem_id == pid,
-            ProblemLike.user_id == user.id,
-        )
-    ).scalar_one_or_none()
-    if row:
-        db.delete(row)
-        if problem.like_count and problem.like_count > 0:
-            problem.like_count -= 1
+    problem = _problem_row(db, pid)
+    like_count = problem.like_count
+    if likes.unlike(db, "problem", pid, user.id):
+        user_stats.bump(db, problem.created_by, problem_likes=-1)
+        like_count = likes.count(db, "problem", pid)
         db.commit()
-    return {"ok": True, "like_count": problem.like_count}
+        problem_sampler.on_like_changed(pid, problem.child_id, problem.grand_id, like_count)
+    return {"ok": True, "like_count": like_count}
 
 
 @router.post("/{pid:int}/explanations/like")
@@ -83,20 +59,11 @@ def like_problem_explanations(
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    problem = db.get(Problem, pid)
-    if not problem:
-        raise HTTPException(404, "not found")
-    exists = db.execute(
-        select(ProblemExplLike).where(
-            ProblemExplLike.problem_id == pid,
-            ProblemExplLike.user_id == user.id,
-        )
-    ).scalar_one_or_none()
-    if not exists:
-        db.add(ProblemExplLike(problem_id=pid, user_id=user.id))
-        problem.expl_like_count += 1
+    expl_like_count = _problem_row(db, pid).expl_like_count
+    if likes.like(db, "problem_expl", pid, user.id):
+        expl_like_count = likes.count(db, "problem_expl", pid)
         db.commit()
-    return {"ok": True, "expl_like_count": problem.expl_like_count}
+    return {"ok": True, "expl_like_count": expl_like_count}
 
 
 @router.delete("/{pid:int}/explanations/like")
@@ -105,18 +72,8 @@ def unlike_problem_explanations(
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    problem = db.get(Problem, pid)
-    if not problem:
-        raise HTTPException(404, "not found")
-    row = db.execute(
-        select(ProblemExplLike).where(
-            ProblemExplLike.problem_id == pid,
-            ProblemExplLike.user_id == user.id,
-        )
-    ).scalar_one_or_none()
-    if row:
-        db.delete(row)
-        if problem.expl_like_count and problem.expl_like_count > 0:
-            problem.expl_like_count -= 1
+    expl_like_count = _problem_row(db, pid).expl_like_count
+    if likes.unlike(db, "problem_expl", pid, user.id):
+        expl_like_count = likes.count(db, "problem_expl", pid)
         db.commit()
-    return {"ok": True, "expl_like_count": problem.expl_like_count}
+    return {"ok": True, "expl_like_count": expl_like_count}
@@ -1,8 +1,4 @@
 import json
-import os
-import random
-import threading
-import time
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
@@ -24,9 +20,9 @@ from models import (
     ProblemImage,
     ProblemLike,
     User,
+    UserProblemState,
 )
-from services.ai_explain import generate_ai_explanations
-from services.ai_judge import judge_all_explanations, judge_problem_for_user
+from services import ai_jobs, llm_gateway, problem_sampler, uploads, user_stats
 
 settings = get_settings()
 router = APIRouter()
@@ -119,40 +115,17 @@ def create_problem(
             )
         )
 
-    if images:
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        for f in images:
-            try:
-                content = f.file.read()
-                if not content:
-                    continue
-                base = os.path.basename(f.filename or "image")
-                name, ext = os.path.splitext(base)
-                safe_ext = (
-                    ext.lower()
-                    if ext and ext.lower() in (".png", ".jpg", ".jpeg", ".gif", ".webp")
-                    else ".bin"
-                )
-                filename = f"p{p.id}_{int(time.time() * 1000)}_{random.randint(1000, 9999)}{safe_ext}"
-                path = os.path.join(settings.UPLOAD_DIR, filename)
-                with open(path, "wb") as out:
-                    out.write(content)
-                db.add(ProblemImage(problem_id=p.id, filename=filename))
-            except Exception:
-                continue
+    for filename in uploads.save_images(images):
+        db.add(ProblemImage(problem_id=p.id, filename=filename))
 
+    user_stats.refresh(db, [user.id])
+    ai_enabled = llm_gateway.enabled()
+    if ai_enabled:
+        ai_jobs.enqueue(db, "generate", p.id, user.id)
     db.commit()
-
-    if settings.OPENAI_ENABLED and settings.OPENAI_API_KEY:
-        def _gen_and_judge(pid: int, uid: int) -> None:
-            try:
-                generate_ai_explanations(pid)
-                judge_all_explanations(pid)
-                judge_problem_for_user(pid, uid)
-            except Exception:
-                pass
-
-        threading.Thread(target=_gen_and_judge, args=(p.id, user.id), daemon=True).start()
+    problem_sampler.on_problem_added(p.id, p.child_id, p.grand_id)
+    if ai_enabled:
+        ai_jobs.notify()
 
     return {"id": p.id, "ok": True}
 
@@ -180,7 +153,10 @@ def edit_problem(
     if not p:
         raise HTTPException(404, "not found")
     is_owner = p.created_by == user.id
+    prev_category = (p.child_id, p.grand_id)
     updated_explanations = False
+    # 消した解説画像のファイル（commit 後に release する）
+    image_files: list[str] = []
     should_regen_ai = is_owner and any(
         v is not None
         for v in [
@@ -267,6 +243,7 @@ def edit_problem(
                 ).all()
             ]
             if ex_ids:
+                image_files += uploads.explanation_files(db, ex_ids)
                 db.query(ExplanationImage).filter(
                     ExplanationImage.explanation_id.in_(ex_ids)
                 ).delete(synchronize_session=False)
@@ -320,6 +297,7 @@ def edit_problem(
             ).all()
         ]
         if ex_ids:
+            image_files += uploads.explanation_files(db, ex_ids)
             db.query(ExplanationImage).filter(
                 ExplanationImage.explanation_id.in_(ex_ids)
             ).delete(synchronize_session=False)
@@ -339,15 +317,26 @@ def edit_problem(
                 )
             )
 
+    if updated_explanations:
+        user_stats.refresh(db, [user.id])
+    rejudge = llm_gateway.enabled() and (
+        should_regen_ai or updated_explanations
+    )
+    if rejudge:
+        ai_jobs.enqueue(db, "judge_problem", p.id, user.id)
+    if (p.child_id, p.grand_id) != prev_category:
+        db.execute(
+            update(UserProblemState)
+            .where(UserProblemState.problem_id == p.id)
+            .values(child_id=p.child_id, grand_id=p.grand_id)
+        )
     db.commit()
-
-    if settings.OPENAI_ENABLED and settings.OPENAI_API_KEY:
-        if should_regen_ai or updated_explanations:
-            threading.Thread(
-                target=judge_problem_for_user,
-                args=(p.id, user.id),
-                daemon=True,
-            ).start()
+    uploads.release(image_files)
+    if (p.child_id, p.grand_id) != prev_category:
+        problem_sampler.on_problem_removed(p.id, *prev_category)
+        problem_sampler.on_problem_added(p.id, p.child_id, p.grand_id, p.like_count)
+    if rejudge:
+        ai_jobs.notify()
 
     return {"ok": True}
 
@@ -363,17 +352,36 @@ def delete_problem(
         raise HTTPException(404, "not found")
     if p.created_by != user.id:
         raise HTTPException(403, "forbidden")
+    # 削除で集計値が変わるユーザ（作成者・解説投稿者・解答者）
+    affected_uids = {p.created_by}
+    affected_uids.update(
+        row[0]
+        for row in db.execute(
+            select(Explanation.user_id).where(Explanation.problem_id == pid).distinct()
+        ).all()
+    )
+    affected_uids.update(
+        row[0]
+        for row in db.execute(select(Answer.user_id).where(Answer.problem_id == pid).distinct()).all()
+    )
     ex_ids = [
         row[0]
         for row in db.execute(select(Explanation.id).where(Explanation.problem_id == pid)).all()
     ]
+    image_files = uploads.explanation_files(db, ex_ids)
     if ex_ids:
+        db.query(ExplanationImage).filter(
+            ExplanationImage.explanation_id.in_(ex_ids)
+        ).delete(synchronize_session=False)
         db.query(ExplanationLike).filter(
             ExplanationLike.explanation_id.in_(ex_ids)
         ).delete(synchronize_session=False)
     db.query(Explanation).filter(Explanation.problem_id == pid).delete(
         synchronize_session=False
     )
+    db.query(UserProblemState).filter(UserProblemState.problem_id == pid).delete(
+        synchronize_session=False
+    )
     db.query(Answer).filter(Answer.problem_id == pid).delete(synchronize_session=False)
     db.query(Option).filter(Option.problem_id == pid).delete(synchronize_session=False)
     db.query(ProblemLike).filter(ProblemLike.problem_id == pid).delete(
@@ -393,18 +401,17 @@ def delete_problem(
         )
     except Exception:
         pass
-    imgs = db.execute(select(ProblemImage).where(ProblemImage.problem_id == pid)).scalars().all()
-    for img in imgs:
-        try:
-            path = os.path.join(settings.UPLOAD_DIR, img.filename)
-            if os.path.exists(path):
-                os.remove(path)
-        except Exception:
-            pass
+    image_files += [
+        r[0] for r in db.execute(select(ProblemImage.filename).where(ProblemImage.problem_id == pid)).all()
+    ]
     db.query(ProblemImage).filter(ProblemImage.problem_id == pid).delete(
         synchronize_session=False
     )
+    category = (p.child_id, p.grand_id)
     db.delete(p)
+    user_stats.refresh(db, affected_uids)
     db.commit()
+    uploads.release(image_files)
+    problem_sampler.on_problem_removed(pid, *category)
     return {"ok": True}
 
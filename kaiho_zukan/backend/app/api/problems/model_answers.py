@@ -1,9 +1,10 @@
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Form, HTTPException, Query
-from sqlalchemy import select
+from sqlalchemy import null, select
 from sqlalchemy.orm import Session
 
+from api import pagination
 from api.deps import get_current_user
 from core.db import get_db
 from models import ModelAnswer, Problem, User
@@ -57,38 +58,45 @@ def get_my_model_answer(
     return {"content": getattr(model_answer, "content", None)}
 
 
+MODEL_ANSWER_FIELDS = ("user_id", "username", "nickname", "content", "is_ai")
+
+
 @router.get("/{pid:int}/model-answers")
 def list_model_answers(
     pid: int,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    rows = db.execute(
-        select(ModelAnswer.content, ModelAnswer.user_id, User.username, User.nickname)
+    limit = pagination.page_limit(limit, cursor)
+    want = pagination.parse_fields(fields, MODEL_ANSWER_FIELDS)
+    content = ModelAnswer.content if "content" in want else null()
+    q = (
+        select(ModelAnswer.id, content, ModelAnswer.user_id, User.username, User.nickname)
         .outerjoin(User, User.id == ModelAnswer.user_id)
         .where(ModelAnswer.problem_id == pid)
-        .order_by(ModelAnswer.id.desc())
-    ).all()
+    )
+    q = pagination.keyset(q, [(ModelAnswer.id, True)], "recent", cursor, limit)
+    rows, next_cursor = pagination.page(db.execute(q).all(), limit, "recent", lambda r: (r[0],))
     items = []
-    for content, user_id, username, nickname in rows:
+    for _id, content, user_id, username, nickname in rows:
         if user_id is None:
-            items.append(
-                {
-                    "user_id": None,
-                    "username": "AI",
-                    "nickname": "AI",
-                    "content": content,
-                    "is_ai": True,
-                }
-            )
+            item = {
+                "user_id": None,
+                "username": "AI",
+                "nickname": "AI",
+                "content": content,
+                "is_ai": True,
+            }
         else:
-            items.append(
-                {
-                    "user_id": int(user_id),
-                    "username": username,
-                    "nickname": nickname,
-                    "content": content,
-                    "is_ai": False,
-                }
-            )
-    return {"items": items}
+            item = {
+                "user_id": int(user_id),
+                "username": username,
+                "nickname": nickname,
+                "content": content,
+                "is_ai": False,
+            }
+        items.append(pagination.project(item, want))
+    return {"items": items, "next_cursor": next_cursor}
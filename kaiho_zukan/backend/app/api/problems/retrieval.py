@@ -1,14 +1,15 @@
-import random
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from sqlalchemy import func, select, text
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, defer
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.deps import get_current_user
-from core.db import get_db
+from api import pagination
+from api.deps import get_current_user, get_current_user_async
+from core.db import get_db, get_read_db, get_async_read_db
+from services import problem_sampler, uploads
 from models import (
-    Answer,
     Explanation,
     ModelAnswer,
     Option,
@@ -60,7 +61,8 @@ def get_problem(
         "qtype": problem.qtype,
         "child_id": problem.child_id,
         "grand_id": problem.grand_id,
-        "images": [f"/uploads/{im.filename}" for im in images],
+        "images": [uploads.url(im.filename) for im in images],
+        "thumbnails": [uploads.url(im.filename, "thumb") for im in images],
         "options": [
             {"id": o.id, "text": o.text, "is_correct": bool(o.is_correct)}
             for o in options
@@ -71,56 +73,63 @@ def get_problem(
     }
 
 
+FOR_EXPLAIN_FIELDS = ("id", "title", "body", "qtype", "like_count", "ex_cnt")
+
+
 @router.get("/for-explain")
 def problems_for_explain(
     child_id: int,
     grand_id: Optional[int] = None,
     sort: str = "likes",
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
 ):
+    limit = pagination.page_limit(limit, cursor)
+    want = pagination.parse_fields(fields, FOR_EXPLAIN_FIELDS)
+    elikes = func.coalesce(func.sum(Explanation.like_count), 0)
+    ex_cnt = func.count(func.distinct(func.coalesce(Explanation.user_id, -1)))
     query = (
-        select(
-            Problem,
-            func.coalesce(func.sum(Explanation.like_count), 0).label("elikes"),
-            func.count(func.distinct(func.coalesce(Explanation.user_id, -1))).label(
-                "ex_cnt"
-            ),
-        )
+        select(Problem, elikes.label("elikes"), ex_cnt.label("ex_cnt"))
         .outerjoin(Explanation, Explanation.problem_id == Problem.id)
         .where(Problem.child_id == child_id)
     )
+    if "body" not in want:
+        query = query.options(defer(Problem.body))
     if grand_id:
         query = query.where(Problem.grand_id == grand_id)
     query = query.group_by(Problem.id)
     if sort == "likes":
-        query = query.order_by(text("elikes DESC"), Problem.id.desc())
+        order, key = [(elikes, True), (Problem.id, True)], lambda r: (int(r[1]), r[0].id)
     elif sort == "explanations":
-        query = query.order_by(text("ex_cnt DESC"), Problem.id.desc())
+        order, key = [(ex_cnt, True), (Problem.id, True)], lambda r: (int(r[2]), r[0].id)
     else:
-        query = query.order_by(Problem.id.desc())
-    rows = db.execute(query).all()
+        order, key = [(Problem.id, True)], lambda r: (r[0].id,)
+    query = pagination.keyset(query, order, sort, cursor, limit, having=len(order) > 1)
+    rows, next_cursor = pagination.page(db.execute(query).all(), limit, sort, key)
     items = [
-        {
+        pagination.project({
             "id": row[0].id,
             "title": row[0].title,
-            "body": row[0].body,
+            "body": row[0].body if "body" in want else None,
             "qtype": row[0].qtype,
             "like_count": int(row[1]),
             "ex_cnt": int(row[2]),
-        }
+        }, want)
         for row in rows
     ]
-    return {"items": items}
+    return {"items": items, "next_cursor": next_cursor}
 
 
 @router.get("/next")
-def next_problem(
+async def next_problem(
     request: Request,
     child_id: str = Query(...),
     grand_id: Optional[str] = Query(None),
     include_answered: Optional[bool] = Query(False),
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
     try:
         child_id_int = int(str(child_id).strip())
@@ -132,27 +141,37 @@ def next_problem(
             grand_id_int = int(str(grand_id).strip())
         except Exception:
             raise HTTPException(400, "grand_id must be integer")
+    return await db.run_sync(_next_problem, user.id, child_id_int, grand_id_int, bool(include_answered))
 
-    sub_query = select(Answer.problem_id).where(
-        Answer.user_id == user.id, Answer.is_correct == True  # noqa: E712
-    )
-    query = select(Problem).where(Problem.child_id == child_id_int)
-    if grand_id_int is not None:
-        query = query.where(Problem.grand_id == grand_id_int)
-    if not include_answered:
-        query = query.where(Problem.id.notin_(sub_query))
-    problems = db.execute(query).scalars().all()
-    if not problems:
+
+def _next_problem(
+    db: Session, user_id: int, child_id_int: int, grand_id_int: Optional[int], include_answered: bool
+) -> dict:
+    selected = None
+    # 索引が古く（他のワーカーで削除・カテゴリ移動された）選んだ問題が条件に合わない場合に備えて数回だけ引き直す
+    for _ in range(3):
+        pid = problem_sampler.pick_problem_id(
+            db, user_id, child_id_int, grand_id_int, include_answered=include_answered
+        )
+        if pid is None:
+            break
+        selected = db.get(Problem, pid)
+        if selected is None:
+            problem_sampler.on_problem_removed(pid, child_id_int, grand_id_int)
+            continue
+        if selected.child_id == child_id_int and grand_id_int in (None, selected.grand_id):
+            break
+        problem_sampler.on_problem_removed(pid, child_id_int, grand_id_int)
+        problem_sampler.on_problem_added(pid, selected.child_id, selected.grand_id, selected.like_count)
+        selected = None
+    if selected is None:
         return {"problem": None}
-    weights = [max(1, p.like_count) for p in problems]
-    choice = random.choices(problems, weights=weights, k=1)[0]
-    selected = choice
     options = db.execute(select(Option).where(Option.problem_id == selected.id)).scalars().all()
     expl_liked = bool(
         db.execute(
             select(ProblemExplLike).where(
                 ProblemExplLike.problem_id == selected.id,
-                ProblemExplLike.user_id == user.id,
+                ProblemExplLike.user_id == user_id,
             )
         ).scalar_one_or_none()
     )
@@ -160,7 +179,7 @@ def next_problem(
         db.execute(
             select(ProblemLike).where(
                 ProblemLike.problem_id == selected.id,
-                ProblemLike.user_id == user.id,
+                ProblemLike.user_id == user_id,
             )
         ).scalar_one_or_none()
     )
@@ -182,6 +201,7 @@ def next_problem(
         "liked": liked,
         "expl_like_count": selected.expl_like_count,
         "expl_liked": expl_liked,
-        "images": [f"/uploads/{im.filename}" for im in images],
+        "images": [uploads.url(im.filename) for im in images],
+        "thumbnails": [uploads.url(im.filename, "thumb") for im in images],
         "options": [{"id": o.id, "text": o.text, "content": o.text} for o in options],
     }
@@ -1,6 +1,5 @@
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
 import os
 import uuid
 import shutil
@@ -8,14 +7,9 @@ import shutil
 from api.deps import get_current_user
 from core.db import get_db
 from core.config import get_settings
-from models import (
-    User,
-    Answer,
-    Problem,
-    Explanation,
-    ProblemLike,
-    ExplanationLike,
-)
+from models import User
+from security import user_cache
+from services import leaderboard, user_stats
 
 router = APIRouter(tags=["profile"])
 
@@ -41,40 +35,15 @@ def _rank_from_creations(total_creations: int) -> str:
 
 
 def _profile_payload(user: User, db: Session, include_answer_stats: bool = True) -> dict:
-    answer_count = (
-        db.execute(select(func.count(Answer.id)).where(Answer.user_id == user.id)).scalar()
-        or 0
-    )
-    correct_count = (
-        db.execute(
-            select(func.count(Answer.id)).where(Answer.user_id == user.id, Answer.is_correct == True)
-        ).scalar()
-        or 0
-    )
+    stats = user_stats.load(db, [user.id]).get(user.id) or {}
+    answer_count = stats.get("answer_count", 0)
+    correct_count = stats.get("correct_count", 0)
     accuracy = float(round((correct_count / answer_count) * 100, 1)) if answer_count > 0 else 0.0
 
-    question_count = (
-        db.execute(select(func.count(Problem.id)).where(Problem.created_by == user.id)).scalar() or 0
-    )
-    answer_creation_count = (
-        db.execute(select(func.count(Explanation.id)).where(Explanation.user_id == user.id)).scalar() or 0
-    )
-    question_likes = (
-        db.execute(
-            select(func.count(ProblemLike.id))
-            .join(Problem, ProblemLike.problem_id == Problem.id)
-            .where(Problem.created_by == user.id)
-        ).scalar()
-        or 0
-    )
-    explanation_likes = (
-        db.execute(
-            select(func.count(ExplanationLike.id))
-            .join(Explanation, ExplanationLike.explanation_id == Explanation.id)
-            .where(Explanation.user_id == user.id)
-        ).scalar()
-        or 0
-    )
+    question_count = stats.get("problem_count", 0)
+    answer_creation_count = stats.get("explanation_count", 0)
+    question_likes = stats.get("problem_likes", 0)
+    explanation_likes = stats.get("explanation_likes", 0)
 
     total_creations = int(question_count) + int(answer_creation_count)
     rank = _rank_from_creations(total_creations)
@@ -169,5 +138,7 @@ def upload_profile_icon(
     db.add(user)
     db.commit()
     db.refresh(user)
+    user_cache.invalidate(user.id)
+    leaderboard.mark_dirty()
 
     return {"icon_url": _icon_url(user)}
@@ -1,152 +1,118 @@
+import datetime as dt
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy.orm import Session, defer
+from sqlalchemy import select, func, case
 from typing import Optional
+from api import pagination
 from api.deps import get_current_user
-from core.db import get_db
-from models import User, Problem, Answer, Explanation, ExplanationLike, ExplanationWrongFlag, AiJudgement, ExplanationImage
-from api.explanations import _icon_url, _rank_info
+from core.db import get_db, get_read_db
+from models import User, Problem, Answer, UserProblemState
+from api.explanations import _explanation_items
+from services import problem_sampler, problem_state, review_scheduler, user_stats
 
 router = APIRouter(prefix="/review", tags=["review"])
 
-@router.get("/stats")
-def review_stats(category_id: int, grand_id: Optional[int] = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    base = select(func.max(Answer.id).label("aid")).join(
-        Problem, Problem.id == Answer.problem_id
+def _state_query(user_id: int, category_id: int, grand_id: Optional[int] = None):
+    """カテゴリ内で解いた問題ごとの最新解答（user_problem_state のカテゴリ列で絞る）"""
+    q = select(UserProblemState, Problem).join(
+        Problem, Problem.id == UserProblemState.problem_id
     ).where(
-        Answer.user_id == user.id, Problem.child_id == category_id
+        UserProblemState.user_id == user_id, UserProblemState.child_id == category_id
     )
     if grand_id is not None:
-        base = base.where(Problem.grand_id == grand_id)
-    sub = base.group_by(Answer.problem_id).subquery()
+        q = q.where(UserProblemState.grand_id == grand_id)
+    return q
+
+HISTORY_FIELDS = ("id", "title", "qtype", "answered_at", "is_correct")
+# last_answer_id は解答 ID なので行ごとに一意（id の代わりになる）
+_HISTORY_ORDER = [(UserProblemState.last_answer_id, True)]
+
+def _history_query(user_id: int, category_id: int, grand_id: Optional[int] = None, cursor: Optional[str] = None, limit: Optional[int] = None):
+    """新しい解答順の 1 ページ分（user_problem_state(user_id, child_id, last_answer_id) を途中から読む）"""
+    q = _state_query(user_id, category_id, grand_id).options(defer(Problem.body))
+    return pagination.keyset(q, _HISTORY_ORDER, "recent", cursor, limit)
+
+def _stats_query(user_id: int, category_id: int, grand_id: Optional[int] = None):
+    q = select(
+        func.count(),
+        func.sum(case((UserProblemState.last_is_correct == True, 1), else_=0)),  # noqa: E712
+    ).where(UserProblemState.user_id == user_id, UserProblemState.child_id == category_id)
+    if grand_id is not None:
+        q = q.where(UserProblemState.grand_id == grand_id)
+    return q
 
-    solved = db.execute(select(func.count()).select_from(sub)).scalar_one() or 0
-    correct = db.execute(
-        select(func.count())
-        .select_from(Answer)
-        .join(sub, Answer.id == sub.c.aid)
-        .where(Answer.is_correct == True)
-    ).scalar_one() or 0
+def _latest_answer_query(user_id: int, pid: int):
+    return select(Answer).where(Answer.user_id==user_id, Answer.problem_id==pid).order_by(Answer.id.desc()).limit(1)
+
+@router.get("/stats")
+def review_stats(category_id: int, grand_id: Optional[int] = None, user: User = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    solved, correct = db.execute(_stats_query(user.id, category_id, grand_id)).one()
+    solved, correct = int(solved or 0), int(correct or 0)
     rate = int(round((correct/solved*100), 0)) if solved > 0 else 0
     return {"solved": int(solved), "correct": int(correct), "rate": rate}
 
 @router.get("/history")
-def review_history(category_id: int, grand_id: Optional[int] = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    base = select(Answer.id).join(Problem, Problem.id==Answer.problem_id).where(Answer.user_id==user.id, Problem.child_id==category_id)
-    if grand_id is not None:
-        base = base.where(Problem.grand_id==grand_id)
-    sub = select(func.max(Answer.id).label("aid")).select_from(Answer).join(Problem, Problem.id==Answer.problem_id).where(Answer.user_id==user.id, Problem.child_id==category_id)
-    if grand_id is not None:
-        sub = sub.where(Problem.grand_id==grand_id)
-    sub = sub.group_by(Answer.problem_id).subquery()
-    rows = db.execute(
-        select(Answer, Problem)
-        .join(sub, sub.c.aid==Answer.id)
-        .join(Problem, Problem.id==Answer.problem_id)
-        .order_by(Answer.id.desc())
-    ).all()
+def review_history(category_id: int, grand_id: Optional[int] = None, cursor: Optional[str] = None, limit: Optional[int] = None, fields: Optional[str] = None, user: User = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    limit = pagination.page_limit(limit, cursor)
+    want = pagination.parse_fields(fields, HISTORY_FIELDS)
+    rows = db.execute(_history_query(user.id, category_id, grand_id, cursor, limit)).all()
+    rows, next_cursor = pagination.page(rows, limit, "recent", lambda r: (r[0].last_answer_id,))
     items = []
-    for a, p in rows:
-        items.append({"id": p.id, "title": p.title, "qtype": p.qtype, "answered_at": a.created_at.isoformat(), "is_correct": bool(a.is_correct) if a.is_correct is not None else None})
-    return {"items": items}
+    for st, p in rows:
+        items.append(pagination.project({"id": p.id, "title": p.title, "qtype": p.qtype, "answered_at": st.last_answered_at.isoformat(), "is_correct": bool(st.last_is_correct) if st.last_is_correct is not None else None}, want))
+    return {"items": items, "next_cursor": next_cursor}
 
 @router.get("/item")
 def review_item(pid: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     p = db.get(Problem, pid)
     if not p:
         raise HTTPException(404, "not found")
-    a = db.execute(select(Answer).where(Answer.user_id==user.id, Answer.problem_id==pid).order_by(Answer.id.desc()).limit(1)).scalar_one_or_none()
+    a = db.execute(_latest_answer_query(user.id, pid)).scalar_one_or_none()
     latest = None
     if a:
         latest = {"is_correct": a.is_correct, "free_text": a.free_text, "selected_option_id": a.selected_option_id}
     # explanations with AI/judge metadata (align with /explanations/problem/{pid})
-    ex = db.execute(select(Explanation).where(Explanation.problem_id==pid).order_by(Explanation.like_count.desc(), Explanation.id.asc()).limit(10)).scalars().all()
-    ex_ids = [e.id for e in ex]
-    liked_ids = set()
-    if ex_ids:
-        rows = db.execute(select(ExplanationLike.explanation_id).where(ExplanationLike.user_id==user.id, ExplanationLike.explanation_id.in_(ex_ids))).all()
-        liked_ids = {int(r[0]) for r in rows}
-    wrong_flag_counts = {eid: 0 for eid in ex_ids}
-    if ex_ids:
-        rows = db.execute(select(ExplanationWrongFlag.explanation_id, func.count()).where(ExplanationWrongFlag.explanation_id.in_(ex_ids)).group_by(ExplanationWrongFlag.explanation_id)).all()
-        for eid, cnt in rows:
-            wrong_flag_counts[int(eid)] = int(cnt or 0)
-    flagged_ids = set()
-    if ex_ids:
-        rows = db.execute(select(ExplanationWrongFlag.explanation_id).where(ExplanationWrongFlag.user_id==user.id, ExplanationWrongFlag.explanation_id.in_(ex_ids))).all()
-        flagged_ids = {int(r[0]) for r in rows}
-    # per-user judgements
-    uids = list({e.user_id for e in ex if getattr(e, "user_id", None) is not None})
-    user_map: dict[int, User] = {}
-    problem_counts: dict[int, int] = {}
-    explanation_counts: dict[int, int] = {}
-    judgement_map = {}
-    if uids:
-        user_rows = db.execute(select(User).where(User.id.in_(uids))).scalars().all()
-        user_map = {u.id: u for u in user_rows}
-        problem_counts = {
-            int(uid): int(cnt or 0)
-            for uid, cnt in db.execute(
-                select(Problem.created_by, func.count())
-                .where(Problem.created_by.in_(uids))
-                .group_by(Problem.created_by)
-            ).all()
-        }
-        explanation_counts = {
-            int(uid): int(cnt or 0)
-            for uid, cnt in db.execute(
-                select(Explanation.user_id, func.count())
-                .where(Explanation.user_id.in_(uids))
-                .group_by(Explanation.user_id)
-            ).all()
-        }
-        jrows = db.execute(select(AiJudgement).where(AiJudgement.problem_id==pid, AiJudgement.user_id.in_(uids))).scalars().all()
-        judgement_map = {j.user_id: j for j in jrows}
-    try:
-        solvers = db.execute(select(func.count(func.distinct(Answer.user_id))).where(Answer.problem_id == pid)).scalar_one() or 0
-    except Exception:
-        solvers = 0
-    ex_items = []
-    for e in ex:
-        author_icon_url = None
-        author_rank = None
-        author_rank_level = None
-        if e.user_id is not None:
-            user_obj = user_map.get(e.user_id)
-            if user_obj is not None:
-                author_icon_url = _icon_url(user_obj)
-            total_creations = problem_counts.get(e.user_id, 0) + explanation_counts.get(e.user_id, 0)
-            rank_label, rank_level = _rank_info(int(total_creations))
-            author_rank = rank_label
-            author_rank_level = rank_level
-        imgs = db.execute(select(ExplanationImage).where(ExplanationImage.explanation_id==e.id).order_by(ExplanationImage.id.asc())).scalars().all()
-        img_urls = [f"/uploads/{im.filename}" for im in imgs]
-        j = judgement_map.get(getattr(e, "user_id", None))
-        wrong_cnt = wrong_flag_counts.get(e.id, 0)
-        crowd_maybe_wrong = (solvers >= 10 and (wrong_cnt / max(1, solvers)) > 0.3)
-        ex_items.append({
-            "id": e.id,
-            "content": e.content,
-            "likes": e.like_count,
-            "is_ai": (e.user_id is None),
-            "by_user_id": e.user_id,
-            "images": img_urls,
-            "liked": (e.id in liked_ids),
-            "ai_is_wrong": (j.is_wrong if j else None),
-            "ai_judge_score": (j.score if j else None),
-            "ai_judge_reason": (j.reason if j else None),
-            "wrong_flag_count": wrong_cnt,
-            "flagged_wrong": (e.id in flagged_ids),
-            "solvers_count": int(solvers),
-            "crowd_maybe_wrong": bool(crowd_maybe_wrong),
-            "author_icon_url": author_icon_url,
-            "author_rank": author_rank,
-            "author_rank_level": author_rank_level,
-        })
+    review_keys = (
+        "id", "content", "likes", "is_ai", "images", "liked", "ai_is_wrong", "ai_judge_score",
+        "ai_judge_reason", "wrong_flag_count", "flagged_wrong", "solvers_count", "crowd_maybe_wrong",
+        "author_icon_url", "author_rank", "author_rank_level",
+    )
+    ex_items = [
+        {**{k: it[k] for k in review_keys}, "by_user_id": it["user_id"]}
+        for it in _explanation_items(db, pid, user.id, sort="likes", limit=10)
+    ]
     return {"problem": {"id": p.id, "title": p.title, "body": p.body, "qtype": p.qtype}, "latest_answer": latest, "explanations": ex_items}
 
+@router.get("/due")
+def review_due(category_id: int, grand_id: Optional[int] = None, limit: int = 20, user: User = Depends(get_current_user), db: Session = Depends(get_read_db)):
+    """復習期限が来た問題を期限の早い順に返す（SM-2。services.review_scheduler）"""
+    limit = max(1, min(int(limit), 100))
+    now = dt.datetime.utcnow()
+    rows = db.execute(review_scheduler.due_query(user.id, category_id, grand_id, now, limit)).all()
+    items = []
+    for st, p in rows:
+        items.append({
+            "id": p.id, "title": p.title, "qtype": p.qtype, "due_at": st.due_at.isoformat(),
+            "interval_days": st.interval_days, "ease": round(st.ease, 2), "repetitions": st.repetitions,
+            "is_correct": bool(st.last_is_correct) if st.last_is_correct is not None else None,
+        })
+    next_due_at = None
+    if not items:
+        nxt = db.execute(review_scheduler.next_due_query(user.id, category_id, grand_id, now)).scalar()
+        next_due_at = nxt.isoformat() if nxt else None
+    return {"items": items, "next_due_at": next_due_at}
+
 @router.post("/mark")
 def review_mark(pid: int, is_correct: bool, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db.add(Answer(problem_id=pid, user_id=user.id, selected_option_id=None, free_text=None, is_correct=bool(is_correct)))
+    p = db.get(Problem, pid)
+    if not p:
+        raise HTTPException(404, "not found")
+    a = Answer(problem_id=pid, user_id=user.id, selected_option_id=None, free_text=None, is_correct=bool(is_correct))
+    db.add(a)
+    db.flush()
+    problem_state.record(db, user.id, p, a.id, a.is_correct, a.created_at)
+    user_stats.bump(db, user.id, answer_count=1, correct_count=1 if is_correct else 0)
     db.commit()
+    if is_correct:
+        problem_sampler.on_solved(user.id, pid, p.child_id, p.grand_id)
     return {"ok": True}
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from . import auth, me, categories, problems, explanations, review, leaderboard, ocr, notifications, profile
+from . import auth, me, categories, problems, explanations, review, leaderboard, ocr, notifications, profile, ai_jobs, metrics
 
 api_router = APIRouter()
 api_router.include_router(auth.router)
@@ -12,4 +12,5 @@ api_router.include_router(leaderboard.router)
 api_router.include_router(ocr.router)
 api_router.include_router(notifications.router)
 api_router.include_router(profile.router)
-
+api_router.include_router(ai_jobs.router)
+api_router.include_router(metrics.router)
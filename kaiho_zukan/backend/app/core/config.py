@@ -3,16 +3,93 @@ from functools import lru_cache
 
 class Settings:
     DATABASE_URL: str = os.getenv("DATABASE_URL", "mysql+pymysql://app:app@db:3306/learn")
+    # 接続プール（uvicorn のワーカー 1 つあたり）: 常駐数、超過分、再接続間隔（秒）、空き待ちの上限（秒）
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_RECYCLE_SEC: int = int(os.getenv("DB_POOL_RECYCLE_SEC", "1800"))
+    DB_POOL_TIMEOUT_SEC: int = int(os.getenv("DB_POOL_TIMEOUT_SEC", "30"))
+    # 非同期ドライバの接続文字列（未指定なら DATABASE_URL のドライバを aiomysql / aiosqlite に読み替える）
+    DATABASE_ASYNC_URL: str | None = os.getenv("DATABASE_ASYNC_URL")
+    # 読み取り専用レプリカ（カンマ区切り。空ならプライマリのみ）、接続失敗時に外す秒数、
+    # 書き込み後にそのユーザの読み取りをプライマリへ送る秒数
+    DATABASE_REPLICA_URLS: list[str] = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+    REPLICA_RETRY_SEC: int = int(os.getenv("REPLICA_RETRY_SEC", "30"))
+    READ_YOUR_WRITES_SEC: int = int(os.getenv("READ_YOUR_WRITES_SEC", "5"))
     JWT_SECRET: str | None = os.getenv("JWT_SECRET")
     JWT_ALG: str = "HS256"
     # Minutes; default 7 days
     JWT_EXPIRES_MIN: int = int(os.getenv("JWT_EXPIRES_MIN", "10080"))
+    # 鍵の切り替え期間中だけ旧鍵のトークンも受け付ける
+    OLD_JWT_SECRET: str | None = os.getenv("OLD_JWT_SECRET")
+    # 検証済みトークンのキャッシュ件数、認証ユーザのスナップショットを使い回す秒数（0 で無効）
+    AUTH_TOKEN_CACHE_SIZE: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+    AUTH_USER_CACHE_SEC: int = int(os.getenv("AUTH_USER_CACHE_SEC", "30"))
+    # パスワードハッシュ: bcrypt のコスト、専用プロセスプールのプロセス数（0 でスレッド実行）
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    # ユーザ名ごとのログイン失敗制限: 窓（秒）内の最大失敗回数（0 で無効）
+    LOGIN_MAX_FAILURES: int = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+    LOGIN_FAILURE_WINDOW_SEC: int = int(os.getenv("LOGIN_FAILURE_WINDOW_SEC", "300"))
 
     OPENAI_ENABLED: bool = os.getenv("OPENAI_ENABLED", "false").lower() == "true"
     OPENAI_API_KEY: str | None = os.getenv("OPENAI_API_KEY")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "/data/uploads")
+    # 問題・解説画像 1 枚あたりの上限（バイト）
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+    # 参照が無くなった画像ファイルを消すまでの猶予（秒）と、削除を確かめる間隔（秒。0 で無効、手動実行のみ）
+    UPLOAD_RELEASE_GRACE_SEC: int = int(os.getenv("UPLOAD_RELEASE_GRACE_SEC", "3600"))
+    UPLOAD_SWEEP_INTERVAL_SEC: int = int(os.getenv("UPLOAD_SWEEP_INTERVAL_SEC", "600"))
+
+    # LLM に送る画像: 長辺の上限（0 で縮小しない）、再圧縮品質、base64 キャッシュ上限
+    IMAGE_MAX_EDGE: int = int(os.getenv("IMAGE_MAX_EDGE", "1568"))
+    IMAGE_JPEG_QUALITY: int = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+    IMAGE_CACHE_MAX_MB: int = int(os.getenv("IMAGE_CACHE_MAX_MB", "64"))
+
+    # LLM クライアント（services.llm_gateway）: バックエンド openai/stub、互換サーバの URL、
+    # タイムアウト（秒）、再試行回数、プロセス全体の同時呼び出し数
+    LLM_BACKEND: str = os.getenv("LLM_BACKEND", "openai").lower()
+    LLM_BASE_URL: str | None = os.getenv("LLM_BASE_URL")
+    LLM_TIMEOUT_SEC: float = float(os.getenv("LLM_TIMEOUT_SEC", "60"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+    # LLM 応答キャッシュ（llm_cache テーブル）: 有効化、有効期限（秒）、最大行数
+    LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_TTL_SEC: int = int(os.getenv("LLM_CACHE_TTL_SEC", "604800"))
+    LLM_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+
+    # AI ジョブ（解説生成・判定）のワーカー数と最大試行回数
+    AI_WORKERS: int = int(os.getenv("AI_WORKERS", "2"))
+    AI_JOB_MAX_ATTEMPTS: int = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+    # 1 問題の全解説をまとめて判定するときの LLM 同時呼び出し数
+    AI_JUDGE_CONCURRENCY: int = int(os.getenv("AI_JUDGE_CONCURRENCY", "4"))
+
+    # /problems/next のサンプリング索引を作り直す間隔（秒）
+    PROBLEM_SAMPLER_TTL_SEC: int = int(os.getenv("PROBLEM_SAMPLER_TTL_SEC", "300"))
+    # ランキングのスナップショットを作り直す間隔（秒）
+    LEADERBOARD_REFRESH_SEC: int = int(os.getenv("LEADERBOARD_REFRESH_SEC", "60"))
+    # カテゴリ木のキャッシュを作り直す間隔（秒。同じプロセスでの変更は即時反映）
+    CATEGORY_TREE_TTL_SEC: int = int(os.getenv("CATEGORY_TREE_TTL_SEC", "300"))
+
+    # 通知のプッシュ配信（/notifications/stream）: memory（プロセス内）/ redis（複数ワーカーで共有）
+    NOTIFY_BACKEND: str = os.getenv("NOTIFY_BACKEND", "memory").lower()
+    NOTIFY_REDIS_URL: str = os.getenv("NOTIFY_REDIS_URL", "redis://localhost:6379/0")
+    # 通知が無いときに送る keep-alive コメントの間隔（秒）
+    NOTIFY_KEEPALIVE_SEC: float = float(os.getenv("NOTIFY_KEEPALIVE_SEC", "15"))
+    # いいね通知の書き方: aggregate（受信者・種類・問題ごとに 1 行へ集約）/ per_actor（いいねした人ごとに 1 行）
+    NOTIFICATION_LIKE_MODE: str = os.getenv("NOTIFICATION_LIKE_MODE", "aggregate").lower()
+    # いいね通知をまとめて書き込む間隔（秒。0 でリクエストごとに即時書き込み）
+    NOTIFICATION_FLUSH_SEC: float = float(os.getenv("NOTIFICATION_FLUSH_SEC", "1"))
+    # 既読通知の保持日数（0 で削除しない）、1 回に削除する件数、アプリ内での実行間隔（秒。0 で無効）
+    NOTIFICATION_RETENTION_DAYS: int = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+    NOTIFICATION_RETENTION_BATCH: int = int(os.getenv("NOTIFICATION_RETENTION_BATCH", "1000"))
+    NOTIFICATION_RETENTION_INTERVAL_SEC: int = int(os.getenv("NOTIFICATION_RETENTION_INTERVAL_SEC", "3600"))
+
+    # 一覧 API（for-explain・my/problems・review/history・解説・模範解答など）の 1 ページの既定件数と上限（limit も cursor も無い従来の呼び出しは全件）
+    LIST_PAGE_SIZE: int = int(os.getenv("LIST_PAGE_SIZE", "100"))
+    LIST_PAGE_MAX: int = int(os.getenv("LIST_PAGE_MAX", "200"))
 
 @lru_cache
 def get_settings() -> Settings:
@@ -1,6 +1,10 @@
-import time, random, os, json, datetime as dt
-from sqlalchemy import create_engine, text, select, func
+import time, random, os, json, threading, itertools, logging, datetime as dt
+from fastapi import Request
+from sqlalchemy import create_engine, event, text, select, func
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from core.config import get_settings
 from models import (
     Base, User, Category, UserCategory, Problem, Option, Explanation, Answer,
@@ -9,18 +13,238 @@ from models import (
 )
 
 settings = get_settings()
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True, future=True)
+
+# プールの待ち時間などの計測値（/metrics の db_pool）
+_pool_stats = {"connects": 0, "checkouts": 0, "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+_pool_stats_lock = threading.Lock()
+
+class TimedQueuePool(QueuePool):
+    """接続の取得にかかった時間（空き待ち）を記録する QueuePool"""
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with _pool_stats_lock:
+                _pool_stats["timeouts"] += 1
+            raise
+        finally:
+            waited = (time.perf_counter() - started) * 1000
+            with _pool_stats_lock:
+                _pool_stats["wait_ms_total"] += waited
+                _pool_stats["wait_ms_max"] = max(_pool_stats["wait_ms_max"], waited)
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs: dict = {"pool_pre_ping": True, "future": True}
+    if not url.startswith("sqlite"):
+        kwargs.update(
+            poolclass=TimedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_recycle=settings.DB_POOL_RECYCLE_SEC,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SEC,
+        )
+    return kwargs
+
+def _on_connect(dbapi_conn, _record):
+    with _pool_stats_lock:
+        _pool_stats["connects"] += 1
+
+def _set_names(dbapi_conn, _record):
+    # MySQLの照合を明示しておく（接続ごとに 1 回。リクエストごとには送らない）
+    try:
+        cur = dbapi_conn.cursor()
+        cur.execute("SET NAMES utf8mb4 COLLATE utf8mb4_0900_ai_ci")
+        cur.close()
+    except Exception:
+        pass
+
+def _on_checkout(_dbapi_conn, _record, _proxy):
+    with _pool_stats_lock:
+        _pool_stats["checkouts"] += 1
+
+def _make_engine(url: str):
+    eng = create_engine(url, **_engine_kwargs(url))
+    event.listen(eng, "connect", _on_connect)
+    if eng.dialect.name == "mysql":
+        event.listen(eng, "connect", _set_names)
+    event.listen(eng, "checkout", _on_checkout)
+    return eng
+
+engine = _make_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
+def pool_stats() -> dict:
+    pool = engine.pool
+    with _pool_stats_lock:
+        out = dict(_pool_stats)
+    out["wait_ms_total"] = round(out["wait_ms_total"], 1)
+    out["wait_ms_max"] = round(out["wait_ms_max"], 1)
+    for name in ("size", "checkedout", "overflow", "checkedin"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            out[name] = fn()
+    return out
+
 def get_db():
     with SessionLocal() as db:
-        # MySQLの照合を明示しておく（必要環境のみ）
+        yield db
+
+# --- 読み取り専用レプリカ（DATABASE_REPLICA_URLS） ---
+# 読み取りだけのハンドラは get_read_db を使う。レプリカを順番に使い、接続できなかったものは
+# REPLICA_RETRY_SEC 秒間外してプライマリに戻す。書き込み直後（READ_YOUR_WRITES_SEC 秒）の
+# ユーザはプライマリから読む（自分の変更がレプリカ遅延で見えなくならないように）。
+# 書き込みの記録は main.py のミドルウェアが note_write() で行う（プロセス内のみ）。
+class _Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = _make_engine(url)
+        self.sessionmaker = sessionmaker(bind=self.engine, autoflush=False, autocommit=False, future=True)
+        self.down_until = 0.0
+
+replicas: list[_Replica] = [_Replica(u) for u in settings.DATABASE_REPLICA_URLS]
+_rr = itertools.count()
+_recent_writes: dict[int, float] = {}
+_replica_stats = {"replica_reads": 0, "primary_reads": 0, "fallbacks": 0, "read_your_writes": 0}
+
+def note_write(user_id: int | None) -> None:
+    if user_id is None or not replicas:
+        return
+    with _pool_stats_lock:
+        if len(_recent_writes) > 100000:
+            _recent_writes.clear()
+        _recent_writes[int(user_id)] = time.monotonic() + settings.READ_YOUR_WRITES_SEC
+
+def _wrote_recently(user_id: int | None) -> bool:
+    if user_id is None:
+        return False
+    until = _recent_writes.get(int(user_id))
+    return until is not None and until > time.monotonic()
+
+def _count(key: str) -> None:
+    with _pool_stats_lock:
+        _replica_stats[key] += 1
+
+def _replica_candidates(request: Request) -> list[_Replica]:
+    """今回の読み取りで試すレプリカ（巡回順、停止中を除く）。書き込み直後のユーザは空"""
+    if not replicas:
+        return []
+    if _wrote_recently(getattr(request.state, "auth_user_id", None)):
+        _count("read_your_writes")
+        return []
+    now = time.monotonic()
+    start = next(_rr)
+    n = len(replicas)
+    return [r for r in (replicas[(start + i) % n] for i in range(n)) if r.down_until <= now]
+
+def _mark_down(r: _Replica, error: Exception) -> None:
+    r.down_until = time.monotonic() + settings.REPLICA_RETRY_SEC
+    _count("fallbacks")
+    logging.getLogger("uvicorn.error").warning("replica unavailable, using primary for %ss: %s", settings.REPLICA_RETRY_SEC, error)
+
+def get_read_db(request: Request):
+    """読み取り専用ハンドラ用のセッション（レプリカが無い・使えない・書き込み直後はプライマリ）"""
+    db = None
+    for r in _replica_candidates(request):
+        db = r.sessionmaker()
         try:
-            db.execute(text("SET NAMES utf8mb4 COLLATE utf8mb4_0900_ai_ci"))
-        except Exception:
-            pass
+            db.connection()  # pool_pre_ping で死活確認される
+            break
+        except Exception as e:
+            db.close()
+            db = None
+            _mark_down(r, e)
+    if db is None:
+        _count("primary_reads")
+        db = SessionLocal()
+    else:
+        _count("replica_reads")
+    with db:
         yield db
 
+# --- 非同期セッション（参照系のホットパス用） ---
+# 同期の engine/SessionLocal と並存する。ドライバは URL から読み替える
+# （mysql+pymysql -> mysql+aiomysql, sqlite -> sqlite+aiosqlite）。DATABASE_ASYNC_URL で明示も可。
+# ハンドラは AsyncSession を受け取り、既存の同期クエリ関数は await db.run_sync(fn, ...) で呼ぶ。
+_async_makers: dict[str, "async_sessionmaker"] = {}
+_async_lock = threading.Lock()
+
+def _async_url(url: str) -> str:
+    if url == settings.DATABASE_URL and settings.DATABASE_ASYNC_URL:
+        return settings.DATABASE_ASYNC_URL
+    for sync_prefix, async_prefix in (
+        ("mysql+pymysql://", "mysql+aiomysql://"),
+        ("mysql://", "mysql+aiomysql://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+def _async_sessionmaker(url: str) -> "async_sessionmaker":
+    maker = _async_makers.get(url)
+    if maker is not None:
+        return maker
+    with _async_lock:
+        if url not in _async_makers:
+            # aiosqlite はファイル DB でも既定が NullPool（毎回接続スレッドを作る）なのでプールを明示する
+            kwargs: dict = {"pool_pre_ping": not url.startswith("sqlite")}
+            if ":memory:" not in url:
+                kwargs.update(
+                    poolclass=AsyncAdaptedQueuePool,
+                    pool_size=settings.DB_POOL_SIZE,
+                    max_overflow=settings.DB_MAX_OVERFLOW,
+                    pool_recycle=settings.DB_POOL_RECYCLE_SEC,
+                    pool_timeout=settings.DB_POOL_TIMEOUT_SEC,
+                )
+            eng = create_async_engine(_async_url(url), **kwargs)
+            event.listen(eng.sync_engine, "connect", _on_connect)
+            if eng.dialect.name == "mysql":
+                event.listen(eng.sync_engine, "connect", _set_names)
+            event.listen(eng.sync_engine, "checkout", _on_checkout)
+            _async_makers[url] = async_sessionmaker(eng, autoflush=False, expire_on_commit=False)
+        return _async_makers[url]
+
+async def get_async_db():
+    async with _async_sessionmaker(settings.DATABASE_URL)() as db:
+        yield db
+
+def async_session() -> AsyncSession:
+    """プライマリの AsyncSession（Depends を使わず短く開け閉めしたい場合。async with で使う）"""
+    return _async_sessionmaker(settings.DATABASE_URL)()
+
+async def get_async_read_db(request: Request):
+    """get_read_db の非同期版"""
+    db = None
+    for r in _replica_candidates(request):
+        db = _async_sessionmaker(r.url)()
+        try:
+            await db.connection()
+            break
+        except Exception as e:
+            await db.close()
+            db = None
+            _mark_down(r, e)
+    if db is None:
+        _count("primary_reads")
+        db = _async_sessionmaker(settings.DATABASE_URL)()
+    else:
+        _count("replica_reads")
+    async with db:
+        yield db
+
+async def dispose_async_engines() -> None:
+    for maker in list(_async_makers.values()):
+        await maker.kw["bind"].dispose()
+    _async_makers.clear()
+
+def replica_stats() -> dict:
+    now = time.monotonic()
+    with _pool_stats_lock:
+        out = dict(_replica_stats)
+    out["replicas"] = [{"index": i, "healthy": r.down_until <= now} for i, r in enumerate(replicas)]
+    return out
+
 def wait_for_db(max_tries: int = 60):
     for _ in range(max_tries):
         try:
@@ -169,16 +393,100 @@ def ensure_schema():
             actor_user_id INT NULL,
             ai_judged_wrong TINYINT NULL,
             crowd_judged_wrong TINYINT NULL,
+            agg_key VARCHAR(64) NULL,
+            actor_count INT NOT NULL DEFAULT 1,
+            recent_actor_ids VARCHAR(255) NULL,
+            seq BIGINT NOT NULL DEFAULT 0,
             seen TINYINT NOT NULL DEFAULT 0,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
             UNIQUE KEY uq_notification_unique_event (user_id, type, problem_id, actor_user_id, ai_judged_wrong, crowd_judged_wrong),
             KEY idx_user (user_id),
             KEY idx_type (type),
+            KEY idx_notif_user_seen (user_id, seen),
+            UNIQUE KEY uq_notif_user_agg_key (user_id, agg_key),
+            KEY idx_notif_user_seq (user_id, seq),
             CONSTRAINT fk_notif_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
             CONSTRAINT fk_notif_problem FOREIGN KEY (problem_id) REFERENCES problems(id) ON DELETE CASCADE,
             CONSTRAINT fk_notif_actor FOREIGN KEY (actor_user_id) REFERENCES users(id) ON DELETE CASCADE
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
         """))
+        # 既存テーブルへ未読件数用のインデックスを追加
+        _ensure_index(conn, "notifications", "idx_notif_user_seen", "user_id, seen")
+
+        # notifications: いいね通知の集約（agg_key で upsert）
+        for col, ddl in (
+            ("agg_key", "VARCHAR(64) NULL"),
+            ("actor_count", "INT NOT NULL DEFAULT 1"),
+            ("recent_actor_ids", "VARCHAR(255) NULL"),
+        ):
+            try:
+                conn.execute(text(f"ALTER TABLE notifications ADD COLUMN IF NOT EXISTS {col} {ddl}"))
+            except Exception:
+                try:
+                    conn.execute(text(f"SELECT {col} FROM notifications LIMIT 1"))
+                except Exception:
+                    conn.execute(text(f"ALTER TABLE notifications ADD COLUMN {col} {ddl}"))
+        _ensure_index(conn, "notifications", "uq_notif_user_agg_key", "user_id, agg_key", unique=True)
+
+        # notifications.seq: 一覧の after_seq / SSE の Last-Event-ID 用の更新順序（既存の行は id を引き継ぐ）
+        try:
+            conn.execute(text("SELECT seq FROM notifications LIMIT 1"))
+        except Exception:
+            conn.execute(text("ALTER TABLE notifications ADD COLUMN seq BIGINT NOT NULL DEFAULT 0"))
+            conn.execute(text("UPDATE notifications SET seq = id"))
+        _ensure_index(conn, "notifications", "idx_notif_user_seq", "user_id, seq")
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS notification_seq (
+            id INT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """))
+
+        # 解答履歴・カテゴリ・解説一覧のホットクエリ用の複合インデックス（python -m services.index_advisor で確認）
+        for table, name, columns in (
+            ("answers", "idx_answers_user_problem_id", "user_id, problem_id, id"),
+            ("answers", "idx_answers_user_correct", "user_id, is_correct, problem_id"),
+            ("answers", "idx_answers_problem_user", "problem_id, user_id"),
+            ("problems", "idx_problems_child_grand_id", "child_id, grand_id, id"),
+            ("explanations", "idx_explanations_problem_likes", "problem_id, like_count"),
+        ):
+            _ensure_index(conn, table, name, columns)
+
+        # user_problem_state: 復習スケジュール（SM-2）と期限順のキュー（/review/due）
+        for col, ddl in (
+            ("child_id", "INT NULL"),
+            ("grand_id", "INT NULL"),
+            ("ease", "FLOAT NOT NULL DEFAULT 2.5"),
+            ("interval_days", "FLOAT NOT NULL DEFAULT 0"),
+            ("repetitions", "INT NOT NULL DEFAULT 0"),
+            ("due_at", "DATETIME NULL"),
+        ):
+            try:
+                conn.execute(text(f"ALTER TABLE user_problem_state ADD COLUMN IF NOT EXISTS {col} {ddl}"))
+            except Exception:
+                try:
+                    conn.execute(text(f"SELECT {col} FROM user_problem_state LIMIT 1"))
+                except Exception:
+                    conn.execute(text(f"ALTER TABLE user_problem_state ADD COLUMN {col} {ddl}"))
+        _ensure_index(conn, "user_problem_state", "idx_ups_user_child_due", "user_id, child_id, due_at")
+        _ensure_index(conn, "user_problem_state", "idx_ups_user_grand_due", "user_id, grand_id, due_at")
+        _ensure_index(conn, "user_problem_state", "idx_ups_user_child_last", "user_id, child_id, last_answer_id")
+
+def _ensure_index(conn, table: str, name: str, columns: str, unique: bool = False):
+    """インデックスが無ければ作る（MySQL は CREATE INDEX IF NOT EXISTS が無いので先に確認する）"""
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    try:
+        exists = conn.execute(text(
+            "SELECT 1 FROM information_schema.statistics"
+            " WHERE table_schema = DATABASE() AND table_name = :t AND index_name = :n LIMIT 1"
+        ), {"t": table, "n": name}).first()
+        if not exists:
+            conn.execute(text(f"CREATE {kind} {name} ON {table} ({columns})"))
+    except Exception:
+        try:
+            conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({columns})"))
+        except Exception:
+            pass
 
 def seed_categories():
     """IT資格/中学/高校/大学カテゴリを冪等投入"""
@@ -237,3 +545,5 @@ def seed_categories():
         info = get_or_create("情報", uni.id, 1)
         for u in ["情報理論","論理回路"]: get_or_create(u, info.id, 2)
         s.commit()
+    from services import category_tree
+    category_tree.invalidate()
@@ -10,8 +10,10 @@ from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 
 from core.config import get_settings
-from core.db import wait_for_db, create_all, ensure_schema, seed_categories
+from core.db import wait_for_db, create_all, ensure_schema, seed_categories, note_write, dispose_async_engines
 from api.router import api_router
+from security.auth import init_secrets, shutdown_hash_pool, parse_token
+from services import ai_jobs, llm_gateway, notification_retention, notification_writer, notify_hub, uploads
 
 settings = get_settings()
 logger = logging.getLogger("uvicorn.error")
@@ -67,6 +69,39 @@ def on_start():
         seed_categories()
     except Exception as e:
         logger.error("Startup error: %s", e)
+    init_secrets()
+    ai_jobs.start_workers()
+    notification_retention.start()
+    notification_writer.start()
+    uploads.start()
+
+@app.on_event("shutdown")
+async def on_stop():
+    ai_jobs.stop_workers()
+    notification_retention.stop()
+    notification_writer.stop()
+    uploads.stop()
+    llm_gateway.close()
+    notify_hub.close()
+    shutdown_hash_pool()
+    await dispose_async_engines()
+
+# 認証ユーザ ID を request.state に載せ、書き込み成功後はそのユーザの読み取りを一定時間プライマリへ送る
+# （get_read_db の read-your-writes）
+_READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    uid = None
+    auth = request.headers.get("authorization") or ""
+    token = auth.split(" ", 1)[1].strip() if auth.lower().startswith("bearer ") else request.headers.get("X-Access-Token")
+    if token:
+        uid = parse_token(token)
+    request.state.auth_user_id = uid
+    response = await call_next(request)
+    if uid is not None and request.method not in _READ_METHODS and response.status_code < 400:
+        note_write(uid)
+    return response
 
 # 422 バリデーションの簡易ロガー
 @app.exception_handler(RequestValidationError)
@@ -94,3 +129,8 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 # ルーター集約（api_router 側の prefix 定義に従う）
 app.include_router(api_router, prefix="")
+
+# 画像アップロードの拒否（サイズ超過・非対応形式）
+@app.exception_handler(uploads.UploadRejected)
+async def upload_rejected_handler(request: Request, exc: uploads.UploadRejected):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
@@ -8,8 +8,10 @@ from .explanation import Explanation, ExplanationImage, ExplanationWrongFlag
 from .answer import Answer
 from .like import ProblemLike, ExplanationLike, ProblemExplLike
 from .assets import ProblemImage
-from .ai import ModelAnswer, AiJudgement
-from .notification import Notification
+from .ai import ModelAnswer, AiJudgement, AiJob, LlmCacheEntry
+from .notification import Notification, NotificationSeq
+from .user_stats import UserStats
+from .user_problem_state import UserProblemState
 
 __all__ = [
     "Base",
@@ -28,5 +30,10 @@ __all__ = [
     "ProblemImage",
     "ModelAnswer",
     "AiJudgement",
+    "AiJob",
+    "LlmCacheEntry",
     "Notification",
+    "NotificationSeq",
+    "UserStats",
+    "UserProblemState",
 ]
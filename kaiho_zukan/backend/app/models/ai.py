@@ -1,6 +1,6 @@
 import datetime as dt
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Integer, ForeignKey, Text, DateTime, UniqueConstraint, Boolean
+from sqlalchemy import Integer, ForeignKey, Text, DateTime, UniqueConstraint, Boolean, String, Index
 from .base import Base
 
 class ModelAnswer(Base):
@@ -24,3 +24,35 @@ class AiJudgement(Base):
     updated_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
 
     __table_args__ = (UniqueConstraint("problem_id", "user_id", name="uq_ai_judgement_pid_uid"),)
+
+class AiJob(Base):
+    """AI 処理（解説生成・判定）の永続ジョブ。services.ai_jobs のワーカーが実行する"""
+    __tablename__ = "ai_jobs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    problem_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    user_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    target_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # judge_explanation の解説 ID
+    status: Mapped[str] = mapped_column(String(16), default="pending")   # pending/running/done/failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    run_after: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+    locked_at: Mapped[dt.datetime | None] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+    updated_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_ai_jobs_status_run_after", "status", "run_after"),
+        Index("idx_ai_jobs_key", "kind", "problem_id", "user_id"),
+    )
+
+class LlmCacheEntry(Base):
+    """LLM 応答キャッシュ。key はモデル・温度・メッセージ（画像はダイジェスト）の sha256"""
+    __tablename__ = "llm_cache"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str] = mapped_column(String(100))
+    response: Mapped[str] = mapped_column(Text)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+    last_used_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow, index=True)
+    expires_at: Mapped[dt.datetime] = mapped_column(DateTime, index=True)
@@ -1,6 +1,6 @@
 import datetime as dt
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Integer, ForeignKey, Text, Boolean, DateTime
+from sqlalchemy import Integer, ForeignKey, Text, Boolean, DateTime, Index
 from .base import Base
 
 class Answer(Base):
@@ -12,3 +12,12 @@ class Answer(Base):
     free_text: Mapped[str | None] = mapped_column(Text, nullable=True)
     is_correct: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
     created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+
+    __table_args__ = (
+        # 問題ごとの最新解答（review の max(id) GROUP BY problem_id、review/item）
+        Index("idx_answers_user_problem_id", "user_id", "problem_id", "id"),
+        # 正解済み問題（problem_sampler）とユーザごとの解答数・正解数
+        Index("idx_answers_user_correct", "user_id", "is_correct", "problem_id"),
+        # 問題の解答者数（解説一覧の solvers_count）
+        Index("idx_answers_problem_user", "problem_id", "user_id"),
+    )
@@ -1,6 +1,6 @@
 import datetime as dt
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Integer, ForeignKey, Text, DateTime, String, UniqueConstraint
+from sqlalchemy import Integer, ForeignKey, Text, DateTime, String, UniqueConstraint, Index
 
 from .base import Base
 
@@ -14,6 +14,11 @@ class Explanation(Base):
     created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
     option_index: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
+    __table_args__ = (
+        # 問題ごとの解説をいいね順に
+        Index("idx_explanations_problem_likes", "problem_id", "like_count"),
+    )
+
 class ExplanationImage(Base):
     __tablename__ = "explanation_images"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -1,6 +1,8 @@
 import datetime as dt
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Integer, String, Boolean, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import Integer, BigInteger, String, Boolean, DateTime, ForeignKey, UniqueConstraint, Index
+from sqlalchemy import event, select, func
+from sqlalchemy.exc import IntegrityError
 from .base import Base
 
 
@@ -20,6 +22,16 @@ class Notification(Base):
     ai_judged_wrong: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
     crowd_judged_wrong: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
 
+    # like aggregation: one row per (recipient, type, problem) with the like count and recent actors
+    # agg_key identifies the row for upserts (NULL for rows that are not written by notification_writer)
+    agg_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    actor_count: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
+    # newest first, comma separated user ids
+    recent_actor_ids: Mapped[str | None] = mapped_column(String(255), nullable=True)
+
+    # change sequence: assigned on every insert / update (see next_seq), used as the paging and Last-Event-ID cursor
+    seq: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+
     # state
     seen: Mapped[bool] = mapped_column(Boolean, default=False)
     created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
@@ -35,5 +47,41 @@ class Notification(Base):
             "crowd_judged_wrong",
             name="uq_notification_unique_event",
         ),
+        # unread count / unseen listing (covering: id is implied as the PK suffix)
+        Index("idx_notif_user_seen", "user_id", "seen"),
+        Index("uq_notif_user_agg_key", "user_id", "agg_key", unique=True),
+        Index("idx_notif_user_seq", "user_id", "seq"),
     )
 
+
+class NotificationSeq(Base):
+    """notifications.seq のカウンタ（id=1 の 1 行だけ）"""
+    __tablename__ = "notification_seq"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    value: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+def next_seq(conn, n: int = 1) -> int:
+    """
+    seq を n 個確保し、最後の値を返す（確保した範囲は 戻り値-n+1 〜 戻り値）。
+    カウンタ行は commit まで行ロックされるので、seq の大小は commit の順序と一致する
+    （after_seq / Last-Event-ID で追うクライアントが、後から commit された小さい seq を取りこぼさない）
+    """
+    t = NotificationSeq.__table__
+    bump = t.update().where(t.c.id == 1).values(value=t.c.value + n)
+    if conn.execute(bump).rowcount == 0:
+        # 初回: 既存の通知より大きい値から始める（同時に入れた側とぶつかったらそちらを使う）
+        start = conn.execute(select(func.coalesce(func.max(Notification.seq), 0))).scalar() or 0
+        try:
+            conn.execute(t.insert().values(id=1, value=start + n))
+        except IntegrityError:
+            conn.execute(bump)
+    return int(conn.execute(select(t.c.value).where(t.c.id == 1)).scalar_one())
+
+
+@event.listens_for(Notification, "before_insert")
+@event.listens_for(Notification, "before_update")
+def _assign_seq(mapper, connection, target):
+    # ORM で追加・更新した通知（誤り判定など）も一覧の after_seq と SSE の再送で拾えるようにする
+    target.seq = next_seq(connection)
+
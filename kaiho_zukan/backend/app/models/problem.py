@@ -1,6 +1,6 @@
 import datetime as dt
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import Integer, String, ForeignKey, Text, DateTime
+from sqlalchemy import Integer, String, ForeignKey, Text, DateTime, Index
 from .base import Base
 
 class Problem(Base):
@@ -15,3 +15,8 @@ class Problem(Base):
     expl_like_count: Mapped[int] = mapped_column(Integer, default=0)
     created_by: Mapped[int] = mapped_column(ForeignKey("users.id"))
     created_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+
+    __table_args__ = (
+        # カテゴリ絞り込み（review の JOIN、サンプリング索引の構築）
+        Index("idx_problems_child_grand_id", "child_id", "grand_id", "id"),
+    )
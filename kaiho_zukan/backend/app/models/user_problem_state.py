@@ -0,0 +1,32 @@
+import datetime as dt
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import Integer, ForeignKey, Boolean, DateTime, Float, Index
+from .base import Base
+
+class UserProblemState(Base):
+    """ユーザ × 問題ごとの最新解答（answers の要約）と復習スケジュール。services.problem_state が解答時に upsert する"""
+    __tablename__ = "user_problem_state"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    problem_id: Mapped[int] = mapped_column(ForeignKey("problems.id", ondelete="CASCADE"), primary_key=True)
+    # 問題のカテゴリの写し（復習キューをカテゴリ別に期限順で引くため）。問題のカテゴリ変更時に更新する
+    child_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    grand_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    last_answer_id: Mapped[int] = mapped_column(Integer)
+    last_is_correct: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
+    attempt_count: Mapped[int] = mapped_column(Integer, default=0)
+    correct_count: Mapped[int] = mapped_column(Integer, default=0)  # 一度でも正解したか（出題の「正解済み除外」）
+    first_answered_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+    last_answered_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow)
+    # SM-2 の状態（services.review_scheduler）
+    ease: Mapped[float] = mapped_column(Float, default=2.5)
+    interval_days: Mapped[float] = mapped_column(Float, default=0)
+    repetitions: Mapped[int] = mapped_column(Integer, default=0)
+    due_at: Mapped[dt.datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # 復習履歴（/review/history）: カテゴリ内で新しい解答順
+        Index("idx_ups_user_child_last", "user_id", "child_id", "last_answer_id"),
+        # 復習キュー（/review/due）: カテゴリ内で期限の早い順
+        Index("idx_ups_user_child_due", "user_id", "child_id", "due_at"),
+        Index("idx_ups_user_grand_due", "user_id", "grand_id", "due_at"),
+    )
@@ -0,0 +1,16 @@
+import datetime as dt
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import Integer, ForeignKey, DateTime
+from .base import Base
+
+class UserStats(Base):
+    """ユーザごとの集計値（ランク表示・プロフィール・ランキング用）。services.user_stats が更新する"""
+    __tablename__ = "user_stats"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    problem_count: Mapped[int] = mapped_column(Integer, default=0)
+    explanation_count: Mapped[int] = mapped_column(Integer, default=0)  # AI 解説は含まない
+    problem_likes: Mapped[int] = mapped_column(Integer, default=0)      # 作成した問題が受けたいいね
+    explanation_likes: Mapped[int] = mapped_column(Integer, default=0)  # 作成した解説が受けたいいね
+    answer_count: Mapped[int] = mapped_column(Integer, default=0)
+    correct_count: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[dt.datetime] = mapped_column(DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow)
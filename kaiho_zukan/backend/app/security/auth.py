@@ -1,4 +1,6 @@
-import time, logging, os
+import time, logging, hashlib, threading, asyncio, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
 from typing import Optional
 from passlib.context import CryptContext
 from jose import jwt
@@ -6,11 +8,50 @@ from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
 from core.config import get_settings
 
 settings = get_settings()
-pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 logger = logging.getLogger("uvicorn.error")
 
 def hash_pw(pw: str) -> str: return pwd.hash(pw)
 def verify_pw(pw: str, hashed: str) -> bool: return pwd.verify(pw, hashed)
+def needs_rehash(hashed: str) -> bool: return pwd.needs_update(hashed)
+
+# bcrypt は CPU を占有するので、リクエスト用スレッドプールではなく専用のプロセスプールで実行する。
+# 投入数は PASSWORD_HASH_WORKERS * 4 までに抑え、それ以上はイベントループ上で待たせる
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+_hash_slots: Optional[asyncio.Semaphore] = None
+
+def _get_hash_pool() -> Optional[ProcessPoolExecutor]:
+    global _hash_pool
+    if settings.PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _hash_pool
+
+async def _run_hash(fn, *args):
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(max(1, settings.PASSWORD_HASH_WORKERS) * 4)
+    async with _hash_slots:
+        return await asyncio.get_running_loop().run_in_executor(_get_hash_pool(), fn, *args)
+
+async def hash_pw_async(pw: str) -> str:
+    return await _run_hash(hash_pw, pw)
+
+async def verify_pw_async(pw: str, hashed: str) -> bool:
+    return await _run_hash(verify_pw, pw, hashed)
+
+def shutdown_hash_pool() -> None:
+    global _hash_pool
+    with _hash_pool_lock:
+        pool, _hash_pool = _hash_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 def make_token(user_id: int) -> str:
     if not settings.JWT_SECRET:
@@ -18,18 +59,53 @@ def make_token(user_id: int) -> str:
     payload = {"sub": str(user_id), "exp": int(time.time()) + settings.JWT_EXPIRES_MIN * 60}
     return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALG)
 
-def parse_token(token: str) -> Optional[int]:
-    secrets: list[str] = []
-    if settings.JWT_SECRET: secrets.append(settings.JWT_SECRET)
-    legacy = os.getenv("OLD_JWT_SECRET")
-    if legacy: secrets.append(legacy)
-    for idx, secret in enumerate(secrets):
+# 検証用の秘密鍵（JWT_SECRET, OLD_JWT_SECRET）は起動時に 1 回だけ解決する
+_secrets: Optional[tuple[str, ...]] = None
+
+def init_secrets() -> tuple[str, ...]:
+    global _secrets
+    _secrets = tuple(s for s in (settings.JWT_SECRET, settings.OLD_JWT_SECRET) if s)
+    return _secrets
+
+def _decode(token: str) -> Optional[tuple[int, int]]:
+    """署名を検証して (user_id, exp) を返す。どの鍵でも通らなければ None"""
+    secrets = _secrets if _secrets is not None else init_secrets()
+    last_error: Exception | None = None
+    for secret in secrets:
         try:
             payload = jwt.decode(token, secret, algorithms=[settings.JWT_ALG])
-            sub = payload.get("sub"); 
-            if sub is not None: return int(sub)
+            sub = payload.get("sub")
+            if sub is not None:
+                return int(sub), int(payload.get("exp") or 0)
         except (ExpiredSignatureError, JWTClaimsError, JWTError) as e:
-            logger.warning("JWT error (idx=%d): %s", idx, e)
+            last_error = e
         except Exception as e:
-            logger.warning("JWT unexpected (idx=%d): %s", idx, e)
+            last_error = e
+    if last_error is not None:
+        logger.info("JWT rejected: %s", last_error)
     return None
+
+# 検証済みトークン: sha256(token) -> (user_id, exp)。LRU で AUTH_TOKEN_CACHE_SIZE 件まで
+_token_cache: "OrderedDict[bytes, tuple[int, int]]" = OrderedDict()
+_token_lock = threading.Lock()
+
+def parse_token(token: str) -> Optional[int]:
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    now = int(time.time())
+    with _token_lock:
+        hit = _token_cache.get(key)
+        if hit is not None:
+            if hit[1] and hit[1] <= now:
+                del _token_cache[key]
+                return None
+            _token_cache.move_to_end(key)
+            return hit[0]
+    decoded = _decode(token)
+    if decoded is None:
+        return None
+    if settings.AUTH_TOKEN_CACHE_SIZE > 0:
+        with _token_lock:
+            _token_cache[key] = decoded
+            while len(_token_cache) > settings.AUTH_TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return decoded[0]
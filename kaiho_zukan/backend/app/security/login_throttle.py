@@ -0,0 +1,56 @@
+"""
+ユーザ名ごとのログイン失敗回数の制限（プロセス内）。
+
+LOGIN_FAILURE_WINDOW_SEC 秒間に LOGIN_MAX_FAILURES 回失敗したユーザ名は、
+最も古い失敗が窓から外れるまで bcrypt を実行せずに 429 を返す。
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from core.config import get_settings
+
+settings = get_settings()
+
+_MAX_NAMES = 50000
+
+_lock = threading.Lock()
+_failures: dict[str, deque] = {}
+
+
+def _key(username: str) -> str:
+    return username.strip().lower()
+
+
+def retry_after(username: str) -> Optional[int]:
+    """制限中なら再試行までの秒数、そうでなければ None"""
+    limit = settings.LOGIN_MAX_FAILURES
+    if limit <= 0:
+        return None
+    window = settings.LOGIN_FAILURE_WINDOW_SEC
+    now = time.monotonic()
+    with _lock:
+        q = _failures.get(_key(username))
+        if not q:
+            return None
+        while q and q[0] <= now - window:
+            q.popleft()
+        if len(q) < limit:
+            return None
+        return max(1, int(q[0] + window - now) + 1)
+
+
+def record_failure(username: str) -> None:
+    if settings.LOGIN_MAX_FAILURES <= 0:
+        return
+    with _lock:
+        if len(_failures) >= _MAX_NAMES:
+            _failures.clear()
+        q = _failures.setdefault(_key(username), deque(maxlen=settings.LOGIN_MAX_FAILURES))
+        q.append(time.monotonic())
+
+
+def reset(username: str) -> None:
+    with _lock:
+        _failures.pop(_key(username), None)
@@ -0,0 +1,69 @@
+"""
+認証ユーザのスナップショットキャッシュ。
+
+get_current_user は毎リクエスト db.get(User) していたが、users 行はほとんど変わらない。
+列の値を AUTH_USER_CACHE_SEC 秒だけ保持し、リクエストのセッションへは db.merge(load=False) で
+SELECT なしに載せる（そのまま属性を変更して commit できる）。
+
+ニックネーム・アイコン・ポイントを変える経路は invalidate() を呼ぶ。
+他プロセスでの変更は TTL 経過で反映される。
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from core.config import get_settings
+from models import User
+
+settings = get_settings()
+
+_MAX_USERS = 10000
+_COLUMNS = tuple(c.key for c in User.__table__.columns)
+
+_lock = threading.Lock()
+_cache: "OrderedDict[int, tuple[float, dict]]" = OrderedDict()
+
+
+def peek(user_id: int) -> Optional[User]:
+    """キャッシュから detached な User を作って返す（非同期ハンドラ用。読み取り専用に使う）。無ければ None"""
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(user_id)
+        if hit is None:
+            return None
+        if hit[0] <= now:
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+        values = hit[1]
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
+
+
+def get(db: Session, user_id: int) -> Optional[User]:
+    """キャッシュから User をセッションに載せて返す。無ければ None"""
+    user = peek(user_id)
+    if user is None:
+        return None
+    return db.merge(user, load=False)
+
+
+def put(user: User) -> None:
+    ttl = settings.AUTH_USER_CACHE_SEC
+    if ttl <= 0:
+        return
+    values = {k: getattr(user, k) for k in _COLUMNS}
+    with _lock:
+        _cache[int(user.id)] = (time.monotonic() + ttl, values)
+        _cache.move_to_end(int(user.id))
+        while len(_cache) > _MAX_USERS:
+            _cache.popitem(last=False)
+
+
+def invalidate(user_id: int) -> None:
+    with _lock:
+        _cache.pop(int(user_id), None)
@@ -1,26 +1,20 @@
-import os, json, base64, time, random
+import os, json, time, random
 from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 from core.config import get_settings
 from core.db import SessionLocal
 from models import Problem, Option, Explanation, ProblemImage, ModelAnswer, ExplanationImage
 from services.util import extract_json_block
+from services.image_payload import image_part
+from services import llm_cache, llm_gateway
 
 settings = get_settings()
 
-def _image_part(path: str) -> dict:
-    ext = os.path.splitext(path)[1].lower()
-    mime = 'image/jpeg' if ext in ('.jpg', '.jpeg') else 'image/png' if ext=='.png' else 'image/webp' if ext=='.webp' else 'application/octet-stream'
-    with open(path, "rb") as fh:
-        b64 = base64.b64encode(fh.read()).decode("ascii")
-    return {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}}
-
 def generate_ai_explanations(problem_id: int):
     """問題ごとの AI 解説生成（MCQ: overall + per-option / free: overall）"""
-    if not (settings.OPENAI_ENABLED and settings.OPENAI_API_KEY):
+    if not llm_gateway.enabled():
         return
-    from openai import OpenAI
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    client = llm_gateway.get_client()
 
     with SessionLocal() as db:
         p = db.get(Problem, problem_id)
@@ -51,17 +45,16 @@ def generate_ai_explanations(problem_id: int):
                 for im in imgs[:4]:
                     fpath = os.path.join(settings.UPLOAD_DIR, im.filename)
                     if os.path.exists(fpath):
-                        message_content.append(_image_part(fpath))
+                        message_content.append(image_part(fpath))
             except Exception:
                 pass
 
-            resp = client.chat.completions.create(
-                model=settings.OPENAI_MODEL,
+            raw = llm_cache.complete(
+                client,
                 messages=[{"role": "user", "content": message_content}],
                 temperature=0.2,
                 max_tokens=700,
-            )
-            raw = (resp.choices[0].message.content or '').strip()
+            ).strip()
             txt = extract_json_block(raw)
             try:
                 data = json.loads(txt)
@@ -109,17 +102,16 @@ def generate_ai_explanations(problem_id: int):
                 for im in imgs[:4]:
                     fpath = os.path.join(settings.UPLOAD_DIR, im.filename)
                     if os.path.exists(fpath):
-                        message_content.append(_image_part(fpath))
+                        message_content.append(image_part(fpath))
             except Exception:
                 pass
 
-            resp = client.chat.completions.create(
-                model=settings.OPENAI_MODEL,
+            content = llm_cache.complete(
+                client,
                 messages=[{"role":"user","content": message_content}],
                 temperature=0.2,
                 max_tokens=500,
-            )
-            content = (resp.choices[0].message.content or '').strip()
+            ).strip()
             txt = extract_json_block(content)
             try:
                 data = json.loads(txt)
@@ -0,0 +1,198 @@
+"""
+AI 処理の永続ジョブキュー（ai_jobs テーブル + 固定数のワーカースレッド）。
+
+- enqueue() はリクエストのトランザクション内でジョブ行を追加する（commit で確定）。
+  同じ (kind, problem_id, user_id, target_id) の pending ジョブがあれば追加しない
+- ワーカーは AI_WORKERS 本だけ起動し、pending を 1 件ずつ取得して実行する
+- 失敗時は指数バックオフで AI_JOB_MAX_ATTEMPTS 回まで再試行、以降は failed
+- running のまま _STALE_AFTER を過ぎたジョブ（再起動などで中断）は再実行する
+- 同じキーのジョブが実行中（running で _STALE_AFTER 以内）の間は、そのキーの pending を取得しない
+  （generate が AI 解説を削除・再作成するなど、同じ処理の同時実行を避ける）
+"""
+import datetime as dt
+import logging
+import threading
+from typing import Callable, Optional
+
+from sqlalchemy import select, update, or_, and_
+from sqlalchemy.orm import Session, aliased
+
+from core.config import get_settings
+from core.db import SessionLocal
+from models import AiJob
+
+settings = get_settings()
+logger = logging.getLogger("uvicorn.error")
+
+_POLL_SEC = 2.0
+_BACKOFF_BASE_SEC = 10
+_BACKOFF_MAX_SEC = 600
+_STALE_AFTER = dt.timedelta(minutes=10)
+
+
+def _run_generate(problem_id: int, user_id: Optional[int], target_id: Optional[int]) -> None:
+    from services.ai_explain import generate_ai_explanations
+    from services.ai_judge import judge_all_explanations, judge_problem_for_user
+
+    generate_ai_explanations(problem_id)
+    judge_all_explanations(problem_id)
+    if user_id is not None:
+        judge_problem_for_user(problem_id, user_id)
+
+
+def _run_judge_problem(problem_id: int, user_id: Optional[int], target_id: Optional[int]) -> None:
+    from services.ai_judge import judge_problem_for_user
+
+    judge_problem_for_user(problem_id, user_id)
+
+
+def _run_judge_explanation(problem_id: int, user_id: Optional[int], target_id: Optional[int]) -> None:
+    from services.ai_judge import judge_explanation_ai
+
+    judge_explanation_ai(target_id)
+
+
+# kind -> handler(problem_id, user_id, target_id)
+HANDLERS: dict[str, Callable[[Optional[int], Optional[int], Optional[int]], None]] = {
+    "generate": _run_generate,
+    "judge_problem": _run_judge_problem,
+    "judge_explanation": _run_judge_explanation,
+}
+
+_wake = threading.Event()
+_stop = threading.Event()
+_threads: list[threading.Thread] = []
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    problem_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    target_id: Optional[int] = None,
+) -> None:
+    """ジョブを追加する（commit は呼び出し側、commit 後に notify() を呼ぶ）"""
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    dup = db.execute(
+        select(AiJob.id).where(
+            AiJob.kind == kind,
+            AiJob.problem_id == problem_id if problem_id is not None else AiJob.problem_id.is_(None),
+            AiJob.user_id == user_id if user_id is not None else AiJob.user_id.is_(None),
+            AiJob.target_id == target_id if target_id is not None else AiJob.target_id.is_(None),
+            AiJob.status == "pending",
+        ).limit(1)
+    ).first()
+    if dup:
+        return
+    db.add(AiJob(kind=kind, problem_id=problem_id, user_id=user_id, target_id=target_id))
+
+
+def notify() -> None:
+    _wake.set()
+
+
+def _claim(db: Session) -> Optional[tuple]:
+    now = dt.datetime.utcnow()
+    other = aliased(AiJob)
+    running_same_key = (
+        select(other.id)
+        .where(
+            other.id != AiJob.id,
+            other.kind == AiJob.kind,
+            other.problem_id.is_not_distinct_from(AiJob.problem_id),
+            other.user_id.is_not_distinct_from(AiJob.user_id),
+            other.target_id.is_not_distinct_from(AiJob.target_id),
+            other.status == "running",
+            other.locked_at >= now - _STALE_AFTER,
+        )
+        .exists()
+    )
+    job = db.execute(
+        select(AiJob)
+        .where(
+            or_(
+                and_(AiJob.status == "pending", AiJob.run_after <= now),
+                and_(AiJob.status == "running", AiJob.locked_at < now - _STALE_AFTER),
+            ),
+            ~running_same_key,
+        )
+        .order_by(AiJob.id.asc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar_one_or_none()
+    if job is None:
+        db.rollback()
+        return None
+    job.status = "running"
+    job.locked_at = now
+    job.attempts = int(job.attempts or 0) + 1
+    claimed = (job.id, job.kind, job.problem_id, job.user_id, job.target_id, job.attempts)
+    db.commit()
+    return claimed
+
+
+def _finish(job_id: int, attempts: int, error: Optional[BaseException]) -> None:
+    values: dict = {"locked_at": None}
+    if error is None:
+        values.update(status="done", last_error=None)
+    elif attempts < settings.AI_JOB_MAX_ATTEMPTS:
+        delay = min(_BACKOFF_MAX_SEC, _BACKOFF_BASE_SEC * (2 ** (attempts - 1)))
+        values.update(
+            status="pending",
+            run_after=dt.datetime.utcnow() + dt.timedelta(seconds=delay),
+            last_error=str(error)[:2000],
+        )
+    else:
+        values.update(status="failed", last_error=str(error)[:2000])
+    with SessionLocal() as db:
+        db.execute(update(AiJob).where(AiJob.id == job_id).values(**values))
+        db.commit()
+
+
+def run_once() -> bool:
+    """pending ジョブを 1 件実行する。実行したら True"""
+    # 取得用のセッションは AI 呼び出しの前に閉じる（長時間コネクションを握らない）
+    with SessionLocal() as db:
+        claimed = _claim(db)
+    if claimed is None:
+        return False
+    job_id, kind, problem_id, user_id, target_id, attempts = claimed
+    error: Optional[BaseException] = None
+    try:
+        HANDLERS[kind](problem_id, user_id, target_id)
+    except Exception as e:  # ジョブ単位で握りつぶして再試行に回す
+        logger.warning("AI job %s (%s) failed: %s", job_id, kind, e)
+        error = e
+    _finish(job_id, attempts, error)
+    return True
+
+
+def _worker() -> None:
+    while not _stop.is_set():
+        try:
+            if run_once():
+                continue
+        except Exception as e:
+            logger.error("AI job worker error: %s", e)
+        _wake.wait(_POLL_SEC)
+        _wake.clear()
+
+
+def start_workers() -> None:
+    if _threads or settings.AI_WORKERS <= 0:
+        return
+    _stop.clear()
+    for i in range(settings.AI_WORKERS):
+        t = threading.Thread(target=_worker, name=f"ai-job-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def stop_workers(timeout: float = 5.0) -> None:
+    _stop.set()
+    _wake.set()
+    for t in _threads:
+        t.join(timeout)
+    _threads.clear()
+
@@ -1,27 +1,25 @@
-import os, json, base64, datetime as dt
+import os, json, time, logging, datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
 from core.config import get_settings
 from core.db import SessionLocal
 from models import (
     Problem, Option, Explanation, ExplanationImage, ProblemImage, ModelAnswer, AiJudgement, Notification
 )
 from services.util import extract_json_block
+from services.image_payload import image_part
+from services import llm_cache, llm_gateway, notify_hub
 
 settings = get_settings()
-
-def _image_part(path: str) -> dict:
-    ext = os.path.splitext(path)[1].lower()
-    mime = 'image/jpeg' if ext in ('.jpg', '.jpeg') else 'image/png' if ext=='.png' else 'image/webp' if ext=='.webp' else 'application/octet-stream'
-    with open(path, "rb") as fh:
-        b64 = base64.b64encode(fh.read()).decode("ascii")
-    return {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}}
+logger = logging.getLogger("uvicorn.error")
 
 def judge_problem_for_user(problem_id: int, target_user_id: int):
     """(pid, uid) 単位で、ユーザの模範解答+全体解説+選択肢別解説をまとめてAI判定し ai_judgements に保存"""
-    if not (settings.OPENAI_ENABLED and settings.OPENAI_API_KEY):
+    if not llm_gateway.enabled():
         return
-    from openai import OpenAI
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    client = llm_gateway.get_client()
 
     with SessionLocal() as db:
         p = db.get(Problem, problem_id)
@@ -109,17 +107,16 @@ def judge_problem_for_user(problem_id: int, target_user_id: int):
             for im in pimgs[:4]:
                 fpath = os.path.join(settings.UPLOAD_DIR, im.filename)
                 if os.path.exists(fpath):
-                    message_content.append(_image_part(fpath))
+                    message_content.append(image_part(fpath))
         except Exception:
             pass
 
-        resp = client.chat.completions.create(
-            model=settings.OPENAI_MODEL,
+        raw = llm_cache.complete(
+            client,
             messages=[{"role": "user", "content": message_content}],
             temperature=0.0,
             max_tokens=400,
-        )
-        raw = (resp.choices[0].message.content or "").strip()
+        ).strip()
         data_txt = extract_json_block(raw)
         try:
             data = json.loads(data_txt)
@@ -165,152 +162,251 @@ def judge_problem_for_user(problem_id: int, target_user_id: int):
                     ).scalar_one_or_none()
                     if existing:
                         existing.ai_judged_wrong = True
+                        n = existing
                     else:
-                        db.add(Notification(
+                        n = Notification(
                             user_id=target_user_id,
                             type="explanation_wrong",
                             problem_id=problem_id,
                             actor_user_id=None,
                             ai_judged_wrong=True,
                             crowd_judged_wrong=False,
-                        ))
+                        )
+                        db.add(n)
+                    db.flush()
+                    notified = (n.user_id, n.id)
                     db.commit()
+                    notify_hub.publish(*notified)
             except Exception:
                 pass
 
-def judge_explanation_ai(expl_id: int):
-    """指定の解説に対して、問題本文・選択肢・画像をコンテキストにAIで正誤二値判定"""
-    if not (settings.OPENAI_ENABLED and settings.OPENAI_API_KEY):
-        return
-    from openai import OpenAI
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+def _explanation_context(db, p: Problem) -> tuple[str, list[dict]]:
+    """解説判定用の問題側コンテキスト（プロンプト前半と問題画像）。バッチ判定では 1 回だけ作る"""
+    opts = []
+    correct_labels = []
+    if p.qtype == "mcq":
+        kana = ['ア','イ','ウ','エ','オ','カ','キ','ク','ケ','コ']
+        rows = list(db.execute(select(Option).where(Option.problem_id==p.id).order_by(Option.id.asc())).scalars().all())
+        for i, o in enumerate(rows):
+            label = kana[i] if i < len(kana) else f"選択肢{i+1}"
+            opts.append(f"{label}: {o.text}")
+            if o.is_correct:
+                correct_labels.append(label)
 
-    with SessionLocal() as db:
-        e = db.get(Explanation, expl_id)
-        if not e: return
-        p = db.get(Problem, e.problem_id)
-        if not p: return
+    prompt = (
+        "あなたは厳密な答案レビューアです。以下の“解説”が、与えられた問題設定に照らして"
+        "事実誤認や論理誤りを含むかを二値で判定してください。\n"
+        "ただし解説が不十分でも模範解答があっていれば正解と確信してください。\n"
+        "出力は必ずJSONのみ：{is_wrong: true|false, score: 0..100, reason: string}\n"
+        "- is_wrong: 解説が誤っているなら true、それ以外は false\n"
+        "- score: 判定の確信度\n"
+        "- reason: 最大2〜3文で簡潔に\n\n"
+        f"[問題タイトル]\n{p.title}\n"
+        f"[問題文]\n{p.body or ''}\n"
+    )
+    if opts:
+        prompt += f"[選択肢]\n" + "\n".join(opts) + "\n"
+        if correct_labels:
+            prompt += f"[正解ラベル]\n{', '.join(correct_labels)}\n"
 
-        opts = []
-        correct_labels = []
-        if p.qtype == "mcq":
-            kana = ['ア','イ','ウ','エ','オ','カ','キ','ク','ケ','コ']
-            rows = list(db.execute(select(Option).where(Option.problem_id==p.id).order_by(Option.id.asc())).scalars().all())
-            for i, o in enumerate(rows):
-                label = kana[i] if i < len(kana) else f"選択肢{i+1}"
-                opts.append(f"{label}: {o.text}")
-                if o.is_correct:
-                    correct_labels.append(label)
+    # 問題画像（最大4）
+    image_parts = []
+    try:
+        pimgs = list(db.execute(select(ProblemImage).where(ProblemImage.problem_id==p.id).order_by(ProblemImage.id.asc())).scalars().all())
+        for im in pimgs[:4]:
+            fpath = os.path.join(settings.UPLOAD_DIR, im.filename)
+            if os.path.exists(fpath):
+                image_parts.append(image_part(fpath))
+    except Exception:
+        pass
+    return prompt, image_parts
 
-        message_content = []
-        prompt = (
-            "あなたは厳密な答案レビューアです。以下の“解説”が、与えられた問題設定に照らして"
-            "事実誤認や論理誤りを含むかを二値で判定してください。\n"
-            "ただし解説が不十分でも模範解答があっていれば正解と確信してください。\n"
-            "出力は必ずJSONのみ：{is_wrong: true|false, score: 0..100, reason: string}\n"
-            "- is_wrong: 解説が誤っているなら true、それ以外は false\n"
-            "- score: 判定の確信度\n"
-            "- reason: 最大2〜3文で簡潔に\n\n"
-            f"[問題タイトル]\n{p.title}\n"
-            f"[問題文]\n{p.body or ''}\n"
-        )
-        if opts:
-            prompt += f"[選択肢]\n" + "\n".join(opts) + "\n"
-            if correct_labels:
-                prompt += f"[正解ラベル]\n{', '.join(correct_labels)}\n"
-        prompt += f"\n[レビュー対象の解説]\n{e.content}\n"
-        message_content.append({"type": "text", "text": prompt})
 
-        # 問題画像（最大4）
+def _explanation_message(context: tuple[str, list[dict]], content: str, expl_image_files: list[str]) -> list[dict]:
+    prompt, problem_parts = context
+    message_content = [{"type": "text", "text": prompt + f"\n[レビュー対象の解説]\n{content}\n"}]
+    message_content.extend(problem_parts)
+    # 解説画像（最大2）
+    for fn in expl_image_files[:2]:
         try:
-            pimgs = list(db.execute(select(ProblemImage).where(ProblemImage.problem_id==p.id).order_by(ProblemImage.id.asc())).scalars().all())
-            for im in pimgs[:4]:
-                fpath = os.path.join(settings.UPLOAD_DIR, im.filename)
-                if os.path.exists(fpath):
-                    message_content.append(_image_part(fpath))
-        except Exception:
-            pass
-        # 解説画像（最大2）
-        try:
-            eimgs = list(db.execute(select(ExplanationImage).where(ExplanationImage.explanation_id==e.id).order_by(ExplanationImage.id.asc())).scalars().all())
-            for im in eimgs[:2]:
-                fpath = os.path.join(settings.UPLOAD_DIR, im.filename)
-                if os.path.exists(fpath):
-                    message_content.append(_image_part(fpath))
+            fpath = os.path.join(settings.UPLOAD_DIR, fn)
+            if os.path.exists(fpath):
+                message_content.append(image_part(fpath))
         except Exception:
             pass
+    return message_content
 
-        resp = client.chat.completions.create(
-            model=settings.OPENAI_MODEL,
-            messages=[{"role":"user","content": message_content}],
-            temperature=0.0,
-            max_tokens=400,
-        )
-        raw = (resp.choices[0].message.content or "").strip()
-        data_txt = extract_json_block(raw)
+
+def _call_judge(client, message_content: list[dict]) -> tuple[Optional[bool], Optional[int], Optional[str]]:
+    raw = llm_cache.complete(
+        client,
+        messages=[{"role":"user","content": message_content}],
+        temperature=0.0,
+        max_tokens=400,
+    ).strip()
+    data_txt = extract_json_block(raw)
+    try:
+        data = json.loads(data_txt)
+    except Exception:
+        data = None
+
+    is_wrong = None; score = None; reason = None
+    if isinstance(data, dict):
+        v = str(data.get("is_wrong", "")).strip().lower()
+        if v in ("true", "false"):
+            is_wrong = (v == "true")
+        elif isinstance(data.get("is_wrong"), bool):
+            is_wrong = bool(data["is_wrong"])
+        if isinstance(data.get("score"), (int, float)):
+            score = int(max(0, min(100, round(float(data["score"])))))
+        if isinstance(data.get("reason"), str):
+            reason = data["reason"].strip()
+    return is_wrong, score, reason
+
+
+def _apply_explanation_judgement(db, e: Explanation, is_wrong, score, reason, notified: Optional[list] = None) -> bool:
+    """判定結果を反映（commit は呼び出し側）。変更があれば True。
+    通知を追加・更新したら notified に (user_id, notification_id) を積む（commit 後に notify_hub.publish する）"""
+    changed = False
+    if is_wrong is not None:
+        e.ai_is_wrong = is_wrong  # 旧カラムを使わないならスキップしてOK
+        changed = True
+    if score is not None:
+        e.ai_judge_score = score
+        changed = True
+    if reason:
+        e.ai_judge_reason = reason[:2000]
+        changed = True
+    if changed and (is_wrong is True) and (e.user_id is not None):
+        # notify (upsert) author if AI judged wrong
+        # 通知はセーブポイント内で書く（失敗しても判定結果と同じトランザクションの他の行は残す）
         try:
-            data = json.loads(data_txt)
-        except Exception:
-            data = None
+            with db.begin_nested():
+                existing = db.execute(
+                    select(Notification).where(
+                        Notification.user_id == e.user_id,
+                        Notification.type == "explanation_wrong",
+                        Notification.problem_id == e.problem_id,
+                    )
+                ).scalar_one_or_none()
+                if existing:
+                    existing.ai_judged_wrong = True
+                    # keep crowd_judged_wrong as is (might be set elsewhere)
+                    n = existing
+                else:
+                    n = Notification(
+                        user_id=e.user_id,
+                        type="explanation_wrong",
+                        problem_id=e.problem_id,
+                        actor_user_id=None,
+                        ai_judged_wrong=True,
+                        crowd_judged_wrong=False,
+                    )
+                    db.add(n)
+                db.flush()
+            if notified is not None:
+                notified.append((n.user_id, n.id))
+        except SQLAlchemyError as ex:
+            logger.warning("explanation_wrong notification failed (explanation %s): %s", e.id, ex)
+    return changed
 
-        is_wrong = None; score = None; reason = None
-        if isinstance(data, dict):
-            v = str(data.get("is_wrong", "")).strip().lower()
-            if v in ("true", "false"):
-                is_wrong = (v == "true")
-            elif isinstance(data.get("is_wrong"), bool):
-                is_wrong = bool(data["is_wrong"])
-            if isinstance(data.get("score"), (int, float)):
-                score = int(max(0, min(100, round(float(data["score"])))))
-            if isinstance(data.get("reason"), str):
-                reason = data["reason"].strip()
 
-        changed = False
-        if is_wrong is not None:
-            e.ai_is_wrong = is_wrong  # 旧カラムを使わないならスキップしてOK
-            changed = True
-        if score is not None:
-            e.ai_judge_score = score
-            changed = True
-        if reason:
-            e.ai_judge_reason = reason[:2000]
-            changed = True
-        if changed:
+def judge_explanation_ai(expl_id: int, client=None):
+    """指定の解説に対して、問題本文・選択肢・画像をコンテキストにAIで正誤二値判定"""
+    if client is None:
+        if not llm_gateway.enabled():
+            return
+        client = llm_gateway.get_client()
+
+    with SessionLocal() as db:
+        e = db.get(Explanation, expl_id)
+        if not e: return
+        p = db.get(Problem, e.problem_id)
+        if not p: return
+        eimgs = [
+            fn for (fn,) in db.execute(
+                select(ExplanationImage.filename).where(ExplanationImage.explanation_id==e.id).order_by(ExplanationImage.id.asc())
+            ).all()
+        ]
+        message_content = _explanation_message(_explanation_context(db, p), e.content, eimgs)
+        result = _call_judge(client, message_content)
+        notified: list = []
+        if _apply_explanation_judgement(db, e, *result, notified=notified):
             db.commit()
+            for user_id, nid in notified:
+                notify_hub.publish(user_id, nid)
+
+
+def judge_all_explanations(problem_id: int, client=None, concurrency: Optional[int] = None) -> Optional[dict]:
+    """
+    指定問題の全解説をまとめてAI誤り判定する。
+    問題・選択肢・問題画像は 1 回だけ読み込み、LLM 呼び出しは最大 concurrency 並列
+    （既定 AI_JUDGE_CONCURRENCY）、結果は 1 トランザクションで書き込む。
+    DB の失敗は例外のまま呼び出し側（ai_jobs の再試行）へ返す。
+    戻り値: {"count", "failed", "wall_ms", "call_ms": [...]}（判定対象が無ければ None）
+    """
+    if client is None:
+        if not llm_gateway.enabled():
+            return None
+        client = llm_gateway.get_client()
+    concurrency = max(1, int(concurrency or settings.AI_JUDGE_CONCURRENCY))
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        p = db.get(Problem, problem_id)
+        if not p:
+            return None
+        exps = list(db.execute(
+            select(Explanation).where(Explanation.problem_id==problem_id).order_by(Explanation.id.asc())
+        ).scalars().all())
+        if not exps:
+            return None
+        images: dict[int, list[str]] = {e.id: [] for e in exps}
+        for eid, fn in db.execute(
+            select(ExplanationImage.explanation_id, ExplanationImage.filename)
+            .where(ExplanationImage.explanation_id.in_(list(images)))
+            .order_by(ExplanationImage.id.asc())
+        ).all():
+            images[int(eid)].append(fn)
+        context = _explanation_context(db, p)
+        messages = {e.id: _explanation_message(context, e.content, images[e.id]) for e in exps}
+        ids = [e.id for e in exps]
+        # LLM 呼び出し中はコネクションを返しておく（commit 後は失効したインスタンスに触らない）
+        db.commit()
+
+        def _timed(eid: int):
+            t0 = time.perf_counter()
             try:
-                # notify (upsert) author if AI judged wrong
-                if (is_wrong is True) and (e.user_id is not None):
-                    existing = db.execute(
-                        select(Notification).where(
-                            Notification.user_id == e.user_id,
-                            Notification.type == "explanation_wrong",
-                            Notification.problem_id == e.problem_id,
-                        )
-                    ).scalar_one_or_none()
-                    if existing:
-                        existing.ai_judged_wrong = True
-                        # keep crowd_judged_wrong as is (might be set elsewhere)
-                    else:
-                        db.add(Notification(
-                            user_id=e.user_id,
-                            type="explanation_wrong",
-                            problem_id=e.problem_id,
-                            actor_user_id=None,
-                            ai_judged_wrong=True,
-                            crowd_judged_wrong=False,
-                        ))
-                    db.commit()
-            except Exception:
-                pass
+                return eid, _call_judge(client, messages[eid]), None, (time.perf_counter() - t0) * 1000
+            except Exception as ex:
+                return eid, None, ex, (time.perf_counter() - t0) * 1000
 
-def judge_all_explanations(problem_id: int):
-    """指定問題の全解説に対して順次AI誤り判定"""
-    try:
-        with SessionLocal() as db:
-            ids = [row[0] for row in db.execute(
-                select(Explanation.id).where(Explanation.problem_id==problem_id)
-            ).all()]
-        for eid in ids:
-            judge_explanation_ai(eid)
-    except Exception:
-        pass
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(exps))) as pool:
+            results = list(pool.map(_timed, ids))
+
+        failed = 0
+        notified: list = []
+        for eid, result, err, _ms in results:
+            if err is not None or result is None:
+                failed += 1
+                logger.warning("AI judge failed (explanation %s): %s", eid, err)
+                continue
+            e = db.get(Explanation, eid, populate_existing=True)
+            if e is None:
+                # 判定中に削除された
+                continue
+            _apply_explanation_judgement(db, e, *result, notified=notified)
+        db.commit()
+        for user_id, nid in notified:
+            notify_hub.publish(user_id, nid)
+
+    stats = {
+        "count": len(results),
+        "failed": failed,
+        "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+        "call_ms": [round(ms, 1) for _eid, _r, _e, ms in results],
+    }
+    logger.info(
+        "judge_all_explanations pid=%s n=%d failed=%d wall=%.1fms max_call=%.1fms",
+        problem_id, stats["count"], failed, stats["wall_ms"], max(stats["call_ms"] or [0]),
+    )
+    return stats
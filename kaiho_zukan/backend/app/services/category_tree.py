@@ -0,0 +1,93 @@
+"""
+カテゴリ木（/categories/tree）のメモリ上スナップショット。
+
+categories を 1 回の SELECT で全件読み、親子関係はメモリ上で組み立てる（ノードごとの遅延ロードはしない）。
+応答の JSON もスナップショット作成時に 1 度だけ作り、version はその内容のハッシュ
+（内容が同じならワーカーや再構築をまたいで同じ ETag になる）。
+
+- カテゴリを変更する処理（seed_categories など）は commit 後に invalidate() を呼び、次の読み出しで再構築する
+- 他プロセス（CLI・別ワーカー）での変更は CATEGORY_TREE_TTL_SEC 秒ごとの再構築で反映する
+- cached() は DB に触れずに有効なスナップショットを返す（If-None-Match の照合用）
+"""
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from core.config import get_settings
+from models import Category
+
+settings = get_settings()
+
+
+@dataclass
+class Snapshot:
+    version: str
+    built_at: float
+    tree: list[dict]
+    body: bytes  # tree の JSON（そのまま応答に使う）
+
+
+_lock = threading.Lock()
+_snapshot: Optional[Snapshot] = None
+_builds = 0
+
+
+def invalidate() -> None:
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+
+def _build(db: Session) -> Snapshot:
+    global _builds
+    rows = db.execute(
+        select(Category.id, Category.name, Category.parent_id).order_by(Category.id.asc())
+    ).all()
+    nodes = {int(cid): {"id": int(cid), "name": name} for cid, name, _parent in rows}
+    children: dict[int, list[dict]] = {}
+    roots: list[dict] = []
+    for cid, _name, parent_id in rows:
+        if parent_id is None:
+            roots.append(nodes[int(cid)])
+        elif int(parent_id) in nodes:
+            children.setdefault(int(parent_id), []).append(nodes[int(cid)])
+    # 従来どおり 3 階層（大分類 → 中分類 → 小分類）。小分類には children を付けない
+    tree = []
+    for root in roots:
+        mids = []
+        for mid in children.get(root["id"], []):
+            mids.append({**mid, "children": [dict(g) for g in children.get(mid["id"], [])]})
+        tree.append({**root, "children": mids})
+    body = json.dumps(tree, ensure_ascii=False, separators=(",", ":")).encode()
+    _builds += 1
+    return Snapshot(hashlib.sha1(body).hexdigest()[:16], time.monotonic(), tree, body)
+
+
+def cached() -> Optional[Snapshot]:
+    """有効期限内のスナップショット（無ければ None。DB には触れない）"""
+    snap = _snapshot
+    if snap is not None and time.monotonic() - snap.built_at < settings.CATEGORY_TREE_TTL_SEC:
+        return snap
+    return None
+
+
+def get_snapshot(db: Session) -> Snapshot:
+    global _snapshot
+    snap = cached()
+    if snap is not None:
+        return snap
+    new = _build(db)
+    with _lock:
+        _snapshot = new
+    return new
+
+
+def stats() -> dict:
+    snap = _snapshot
+    return {"version": snap.version if snap else None, "builds": _builds}
@@ -0,0 +1,119 @@
+"""
+LLM に渡す画像パート（data URL）の生成とキャッシュ。
+
+同じ画像は 解説生成 → 全解説判定 → ユーザ別判定 と何度も送られるので、
+(パス, mtime, サイズ) をキーに base64 済みの data URL を LRU で保持する（上限 IMAGE_CACHE_MAX_MB）。
+IMAGE_MAX_EDGE > 0 のときは長辺をその値まで縮小・再圧縮してから符号化する
+（送信バイト数と画像トークンの削減。Pillow が無ければ原寸のまま）。
+"""
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from core.config import get_settings
+
+settings = get_settings()
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow は任意
+    Image = None
+
+_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+
+_lock = threading.Lock()
+_cache: "OrderedDict[tuple[str, int, int], str]" = OrderedDict()
+_cache_bytes = 0
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "resized": 0}
+
+
+def _mime_for(path: str) -> str:
+    return _MIME.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+
+def _shrink(blob: bytes, mime: str) -> tuple[bytes, str]:
+    """長辺が IMAGE_MAX_EDGE を超える静止画を縮小・再圧縮する"""
+    max_edge = settings.IMAGE_MAX_EDGE
+    if Image is None or max_edge <= 0 or mime == "image/gif":
+        return blob, mime
+    try:
+        with Image.open(io.BytesIO(blob)) as im:
+            if max(im.size) <= max_edge:
+                return blob, mime
+            im.thumbnail((max_edge, max_edge))
+            out = io.BytesIO()
+            if im.mode in ("RGBA", "LA", "P"):
+                im.save(out, format="PNG", optimize=True)
+                new_mime = "image/png"
+            else:
+                im.convert("RGB").save(out, format="JPEG", quality=settings.IMAGE_JPEG_QUALITY, optimize=True)
+                new_mime = "image/jpeg"
+        with _lock:
+            _stats["resized"] += 1
+        return out.getvalue(), new_mime
+    except Exception:
+        return blob, mime
+
+
+def data_url_from_bytes(blob: bytes, mime: str) -> str:
+    blob, mime = _shrink(blob, mime)
+    return f"data:{mime};base64,{base64.b64encode(blob).decode('ascii')}"
+
+
+def _put(key: tuple[str, int, int], url: str) -> None:
+    global _cache_bytes
+    limit = settings.IMAGE_CACHE_MAX_MB * 1024 * 1024
+    if len(url) > limit:
+        return
+    with _lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _cache_bytes -= len(old)
+        _cache[key] = url
+        _cache_bytes += len(url)
+        while _cache_bytes > limit and _cache:
+            _k, v = _cache.popitem(last=False)
+            _cache_bytes -= len(v)
+            _stats["evictions"] += 1
+
+
+def data_url(path: str) -> Optional[str]:
+    """ファイルを data URL にする（キャッシュあり）。読めなければ None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _lock:
+        url = _cache.get(key)
+        if url is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return url
+        _stats["misses"] += 1
+    with open(path, "rb") as fh:
+        url = data_url_from_bytes(fh.read(), _mime_for(path))
+    _put(key, url)
+    return url
+
+
+def image_part(path: str) -> dict:
+    """chat.completions の image_url パート"""
+    url = data_url(path)
+    if url is None:
+        raise FileNotFoundError(path)
+    return {"type": "image_url", "image_url": {"url": url}}
+
+
+def stats() -> dict:
+    with _lock:
+        return {**_stats, "entries": len(_cache), "bytes": _cache_bytes}
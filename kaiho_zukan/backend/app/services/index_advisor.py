@@ -0,0 +1,115 @@
+"""
+ホットクエリの実行計画チェック。
+
+登録したクエリを EXPLAIN（SQLite は EXPLAIN QUERY PLAN）し、テーブルの全件走査・インデックスの全走査を報告する。
+パラメータには DB 内の実在の ID（最新の解答のユーザ・問題・カテゴリ）を使う。
+空に近い DB ではオプティマイザが全件走査を選ぶことがあるので、本番相当のデータで実行すること。
+
+    python -m services.index_advisor   （app/ ディレクトリで実行。全件走査があれば終了コード 1）
+
+新しいホットクエリは _hot_queries() に (名前, ビルダ) を追加する。ビルダはハンドラと同じ select を返す関数を使う。
+"""
+import datetime as dt
+import re
+import sys
+from typing import Callable
+
+from sqlalchemy import select, func, text
+from sqlalchemy.orm import Session
+
+from models import Answer, Notification, Problem
+
+
+def _sample(db: Session) -> dict:
+    row = db.execute(
+        select(Answer.user_id, Answer.problem_id, Problem.child_id, Problem.grand_id)
+        .join(Problem, Problem.id == Answer.problem_id)
+        .order_by(Answer.id.desc())
+        .limit(1)
+    ).first()
+    if row is None:
+        row = db.execute(select(Problem.created_by, Problem.id, Problem.child_id, Problem.grand_id).limit(1)).first()
+    uid, pid, child_id, grand_id = row or (1, 1, 1, 1)
+    return {"user_id": int(uid), "pid": int(pid), "child_id": int(child_id), "grand_id": int(grand_id)}
+
+
+def _hot_queries() -> list[tuple[str, Callable[[dict], object]]]:
+    from api.explanations import _explanations_query, _solvers_query
+    from api.notifications import _select_notifications
+    from api.review import _history_query, _latest_answer_query, _stats_query
+    from services.problem_sampler import solved_query
+    from services.review_scheduler import due_query
+
+    return [
+        ("review.stats", lambda s: _stats_query(s["user_id"], s["child_id"], s["grand_id"])),
+        ("review.history", lambda s: _history_query(s["user_id"], s["child_id"], s["grand_id"])),
+        ("review.item", lambda s: _latest_answer_query(s["user_id"], s["pid"])),
+        ("review.due", lambda s: due_query(s["user_id"], s["child_id"], None, dt.datetime.utcnow(), 20)),
+        ("review.due grand", lambda s: due_query(s["user_id"], s["child_id"], s["grand_id"], dt.datetime.utcnow(), 20)),
+        ("problems.next solved", lambda s: solved_query(s["user_id"], s["child_id"], s["grand_id"])),
+        ("problems.next index", lambda s: select(Problem.id, Problem.like_count).where(Problem.child_id == s["child_id"], Problem.grand_id == s["grand_id"]).order_by(Problem.id.asc())),
+        ("explanations.list", lambda s: _explanations_query(s["pid"], "likes", 10)),
+        ("explanations.solvers", lambda s: _solvers_query(s["pid"])),
+        ("notifications.list", lambda s: _select_notifications(s["user_id"]).order_by(Notification.seq.desc()).limit(50)),
+        ("notifications.unread", lambda s: select(func.count()).select_from(Notification).where(Notification.user_id == s["user_id"], Notification.seen == False)),  # noqa: E712
+    ]
+
+
+def _derived(table: str) -> bool:
+    """サブクエリの結果（SQLite の anon_N、MySQL の <derivedN>）は走査しても問題にしない"""
+    return table.startswith("anon_") or table.startswith("<")
+
+
+def _explain_sqlite(db: Session, sql: str) -> list[dict]:
+    out = []
+    for row in db.execute(text("EXPLAIN QUERY PLAN " + sql)).all():
+        detail = str(row[-1])
+        m = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+        problem = None
+        if m and _derived(m.group(1)):
+            pass
+        elif m and "INDEX" not in detail:
+            problem = "full table scan"
+        elif m and "COVERING INDEX" in detail and "SUBQUERY" not in detail:
+            problem = "full index scan"
+        out.append({"table": m.group(1) if m else "", "plan": detail, "problem": problem})
+    return out
+
+
+def _explain_mysql(db: Session, sql: str) -> list[dict]:
+    out = []
+    res = db.execute(text("EXPLAIN " + sql))
+    cols = list(res.keys())
+    for row in res.all():
+        r = dict(zip(cols, row))
+        access = r.get("type")
+        problem = None if _derived(r.get("table") or "") else {"ALL": "full table scan", "index": "full index scan"}.get(access)
+        plan = f"type={access} key={r.get('key')} rows={r.get('rows')} extra={r.get('Extra') or ''}"
+        out.append({"table": r.get("table") or "", "plan": plan, "problem": problem})
+    return out
+
+
+def advise(db: Session) -> list[dict]:
+    """登録クエリの実行計画。各要素は {name, table, plan, problem}（problem が None なら問題なし）"""
+    dialect = db.get_bind().dialect
+    sample = _sample(db)
+    explain = _explain_mysql if dialect.name == "mysql" else _explain_sqlite
+    report = []
+    for name, build in _hot_queries():
+        sql = str(build(sample).compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+        for step in explain(db, sql):
+            report.append({"name": name, **step})
+    return report
+
+
+if __name__ == "__main__":
+    from core.db import SessionLocal
+
+    with SessionLocal() as db:
+        report = advise(db)
+    scans = [r for r in report if r["problem"]]
+    for r in report:
+        mark = f"!! {r['problem']}" if r["problem"] else "ok"
+        print(f"{r['name']:<24} {r['table']:<16} {mark:<22} {r['plan']}")
+    print(f"\n{len(scans)} scan(s) in {len({r['name'] for r in report})} queries")
+    sys.exit(1 if scans else 0)
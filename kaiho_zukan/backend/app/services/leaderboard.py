@@ -0,0 +1,146 @@
+"""
+ランキングのメモリ上スナップショット。
+
+全ユーザの指標値を 1 回の走査で読み込み、指標ごとに降順ソート済みの配列を作る。
+/leaderboard はスナップショットから返すだけで DB にはアクセスしない。
+順位は二分探索で求まるので、LIMIT では答えられない「自分の順位」も O(log n)。
+
+- 書き込み経路（user_stats の更新）の commit 後に mark_dirty() され、次の読み出しで再構築する
+  （最短 _MIN_REBUILD_SEC 秒間隔）
+- 他ワーカーでの更新は LEADERBOARD_REFRESH_SEC 秒ごとの再構築で反映する
+- version は内容（ユーザの表示項目と指標値）のハッシュ。内容が変わらない再構築やワーカー違いでも ETag が変わらない
+"""
+import bisect
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from core.config import get_settings
+from models import User, UserStats
+
+settings = get_settings()
+
+# metric -> user_stats の列（points は users.points）
+METRICS = {
+    "created_problems": "problem_count",
+    "created_expl": "explanation_count",
+    "likes_problems": "problem_likes",
+    "likes_expl": "explanation_likes",
+    "points": "points",
+}
+
+_MIN_REBUILD_SEC = 5.0
+
+
+@dataclass
+class Entry:
+    user_id: int
+    username: str
+    nickname: Optional[str]
+    icon_path: Optional[str]
+    total_creations: int
+    values: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class Snapshot:
+    version: str
+    built_at: float
+    entries: dict[int, Entry]
+    # metric -> (value desc, user_id asc) 順の user_id 配列と、二分探索用の -value 配列
+    order: dict[str, list[int]]
+    neg_values: dict[str, list[int]]
+
+    def top(self, metric: str, limit: int) -> list[Entry]:
+        return [self.entries[uid] for uid in self.order[metric][:limit]]
+
+    def rank_of(self, metric: str, user_id: int) -> tuple[Optional[int], int]:
+        """(順位, 値)。同値は同順位。points 以外で値 0 のユーザは圏外 (None)"""
+        e = self.entries.get(user_id)
+        value = e.values.get(metric, 0) if e else 0
+        if value <= 0 and metric != "points":
+            return None, value
+        return bisect.bisect_left(self.neg_values[metric], -value) + 1, value
+
+
+_lock = threading.Lock()
+_snapshot: Optional[Snapshot] = None
+_dirty = False
+_building = False
+_builds = 0
+
+
+def mark_dirty() -> None:
+    global _dirty
+    _dirty = True
+
+
+def _build(db: Session) -> Snapshot:
+    global _builds
+    from services import user_stats
+
+    rows = db.execute(
+        select(User.id, User.username, User.nickname, User.icon_path, User.points, UserStats)
+        .outerjoin(UserStats, UserStats.user_id == User.id)
+    ).all()
+    missing = [int(r[0]) for r in rows if r[5] is None]
+    computed = user_stats.load(db, missing) if missing else {}
+
+    entries: dict[int, Entry] = {}
+    for uid, username, nickname, icon_path, points, st in rows:
+        uid = int(uid)
+        if st is not None:
+            stats = {k: int(getattr(st, k) or 0) for k in user_stats.FIELDS}
+        else:
+            stats = computed.get(uid) or {}
+        values = {m: int(stats.get(col, 0)) for m, col in METRICS.items() if col != "points"}
+        values["points"] = int(points or 0)
+        entries[uid] = Entry(uid, username, nickname, icon_path, user_stats.total_creations(stats), values)
+
+    order: dict[str, list[int]] = {}
+    neg_values: dict[str, list[int]] = {}
+    for m in METRICS:
+        ranked = sorted(
+            (e for e in entries.values() if m == "points" or e.values[m] > 0),
+            key=lambda e: (-e.values[m], e.user_id),
+        )
+        order[m] = [e.user_id for e in ranked]
+        neg_values[m] = [-e.values[m] for e in ranked]
+    _builds += 1
+    content = [
+        [e.user_id, e.username, e.nickname, e.icon_path, e.total_creations, e.values]
+        for _uid, e in sorted(entries.items())
+    ]
+    version = hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+    return Snapshot(version, time.monotonic(), entries, order, neg_values)
+
+
+def get_snapshot(db: Session) -> Snapshot:
+    global _snapshot, _dirty, _building
+    snap = _snapshot
+    if snap is not None:
+        age = time.monotonic() - snap.built_at
+        if age < settings.LEADERBOARD_REFRESH_SEC and not (_dirty and age >= _MIN_REBUILD_SEC):
+            return snap
+    # DB 読み込み中はロックを持たない（非同期ハンドラの run_sync からも呼ばれ、
+    # 同じスレッド上の別コルーチンがロック待ちでイベントループを止めてしまうため）
+    with _lock:
+        # 他が再構築済みなら使い回し、再構築中なら古いスナップショットで応答する
+        if _snapshot is not snap or (_building and snap is not None):
+            return _snapshot
+        _building = True
+        _dirty = False
+    try:
+        new = _build(db)
+    finally:
+        with _lock:
+            _building = False
+    with _lock:
+        _snapshot = new
+    return new
@@ -0,0 +1,62 @@
+"""
+いいね（問題 / 解説 / 問題の解説まとめ）の登録・取り消しとカウンタ更新。
+
+ORM で行を読んでから like_count += 1 して書き戻すと、同時いいねで更新が失われる。ここでは
+- 最初に対象（問題 / 解説）の行を SELECT ... FOR UPDATE でロックする。
+  InnoDB ではいいね表への INSERT が外部キー検査で対象行に共有ロックを取るため、先に INSERT すると
+  同じ対象への同時いいね同士が互いの UPDATE（排他ロック）を待ってデッドロックする
+- 登録: INSERT IGNORE（SQLite は INSERT OR IGNORE）で一意制約に任せ、
+  実際に挿入できたとき（rowcount == 1）だけ UPDATE ... SET like_count = like_count + 1
+- 取り消し: DELETE の rowcount が 1 のときだけ UPDATE ... SET like_count = like_count - 1（0 未満にしない）
+カウンタは DB 側で加減算するので並行実行しても数がずれない。
+commit は呼び出し側（集計やいいね通知と同じトランザクション）。並行性のテストは tests/test_likes.py
+"""
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import Explanation, ExplanationLike, Problem, ProblemExplLike, ProblemLike
+
+# 種類 -> (いいね表, 対象 ID の列, カウンタを持つ表, カウンタ列)
+KINDS = {
+    "problem": (ProblemLike, ProblemLike.problem_id, Problem, Problem.like_count),
+    "explanation": (ExplanationLike, ExplanationLike.explanation_id, Explanation, Explanation.like_count),
+    "problem_expl": (ProblemExplLike, ProblemExplLike.problem_id, Problem, Problem.expl_like_count),
+}
+
+
+def _lock_target(db: Session, target, target_id: int) -> None:
+    # 対象行の排他ロックを先に取る（SQLite では FOR UPDATE は付かず、書き込みは直列化される）
+    db.execute(select(target.id).where(target.id == target_id).with_for_update())
+
+
+def like(db: Session, kind: str, target_id: int, user_id: int) -> bool:
+    """いいねを登録する。新規に登録できたら True（既にいいね済みなら何もしない）"""
+    table, fk, target, counter = KINDS[kind]
+    _lock_target(db, target, target_id)
+    res = db.execute(
+        insert(table)
+        .values({fk.key: target_id, "user_id": user_id})
+        .prefix_with("IGNORE", dialect="mysql")
+        .prefix_with("OR IGNORE", dialect="sqlite")
+    )
+    if res.rowcount != 1:
+        return False
+    db.execute(update(target).where(target.id == target_id).values({counter: counter + 1}))
+    return True
+
+
+def unlike(db: Session, kind: str, target_id: int, user_id: int) -> bool:
+    """いいねを取り消す。取り消せたら True"""
+    table, fk, target, counter = KINDS[kind]
+    _lock_target(db, target, target_id)
+    res = db.execute(delete(table).where(fk == target_id, table.user_id == user_id))
+    if not res.rowcount:
+        return False
+    db.execute(update(target).where(target.id == target_id, counter > 0).values({counter: counter - 1}))
+    return True
+
+
+def count(db: Session, kind: str, target_id: int) -> int:
+    """現在のカウンタ値（like/unlike の後、同じトランザクション内で読めば自分の更新を含む確定値）"""
+    _table, _fk, target, counter = KINDS[kind]
+    return int(db.execute(select(counter).where(target.id == target_id)).scalar() or 0)
@@ -0,0 +1,169 @@
+"""
+LLM 応答の永続キャッシュ（llm_cache テーブル）。
+
+同じプロンプト・同じ画像の呼び出し（中身の変わらない編集後の再判定、同じスクリーンショットの OCR など）は
+保存済みの応答を返し、API を呼ばない。
+
+- キー: sha256(model, temperature, max_tokens, messages)。data URL の画像は sha256 ダイジェストに置き換えてから直列化する
+- LLM_CACHE_TTL_SEC で失効。行数が LLM_CACHE_MAX_ENTRIES を超えたら最終利用が古い順に削除する
+- LLM_CACHE_ENABLED=false で全体を、complete(..., bypass=True) で呼び出し単位にキャッシュを通さない
+- キャッシュの読み書きは専用セッションで行い、失敗しても LLM 呼び出し自体は続行する
+"""
+import datetime as dt
+import hashlib
+import json
+import logging
+import threading
+from typing import Any, Optional
+
+from sqlalchemy import select, update, delete, func
+
+from core.config import get_settings
+from core.db import SessionLocal
+from models import LlmCacheEntry
+
+settings = get_settings()
+logger = logging.getLogger("uvicorn.error")
+
+_PRUNE_EVERY = 50
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "pruned": 0}
+_puts_since_prune = 0
+
+
+def _digest_images(value: Any) -> Any:
+    """messages 内の data URL を sha256 ダイジェストに置き換える（キーを短く・安定に）"""
+    if isinstance(value, dict):
+        if value.get("type") == "image_url":
+            url = (value.get("image_url") or {}).get("url") or ""
+            if url.startswith("data:"):
+                return {"type": "image_url", "image_sha256": hashlib.sha256(url.encode("ascii")).hexdigest()}
+        return {k: _digest_images(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_digest_images(v) for v in value]
+    return value
+
+
+def cache_key(model: str, messages: list, temperature: float, max_tokens: Optional[int]) -> str:
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "messages": _digest_images(messages),
+    }
+    blob = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _get(key: str) -> Optional[str]:
+    now = dt.datetime.utcnow()
+    with SessionLocal() as db:
+        row = db.execute(
+            select(LlmCacheEntry.response).where(LlmCacheEntry.key == key, LlmCacheEntry.expires_at > now)
+        ).first()
+        if row is None:
+            return None
+        db.execute(
+            update(LlmCacheEntry)
+            .where(LlmCacheEntry.key == key)
+            .values(hits=LlmCacheEntry.hits + 1, last_used_at=now)
+        )
+        db.commit()
+        return row[0]
+
+
+def _put(key: str, model: str, response: str) -> None:
+    global _puts_since_prune
+    now = dt.datetime.utcnow()
+    expires = now + dt.timedelta(seconds=settings.LLM_CACHE_TTL_SEC)
+    with SessionLocal() as db:
+        row = db.get(LlmCacheEntry, key)
+        if row is None:
+            db.add(LlmCacheEntry(key=key, model=model, response=response, created_at=now, last_used_at=now, expires_at=expires))
+        else:
+            row.response = response
+            row.created_at = now
+            row.last_used_at = now
+            row.expires_at = expires
+        db.commit()
+    with _lock:
+        _stats["stores"] += 1
+        _puts_since_prune += 1
+        due = _puts_since_prune >= _PRUNE_EVERY
+        if due:
+            _puts_since_prune = 0
+    if due:
+        prune()
+
+
+def prune() -> int:
+    """失効行と上限超過分（最終利用が古い順）を削除する"""
+    removed = 0
+    with SessionLocal() as db:
+        removed += db.execute(
+            delete(LlmCacheEntry).where(LlmCacheEntry.expires_at <= dt.datetime.utcnow())
+        ).rowcount or 0
+        total = int(db.execute(select(func.count()).select_from(LlmCacheEntry)).scalar() or 0)
+        excess = total - settings.LLM_CACHE_MAX_ENTRIES
+        if excess > 0:
+            keys = [
+                r[0]
+                for r in db.execute(
+                    select(LlmCacheEntry.key).order_by(LlmCacheEntry.last_used_at.asc()).limit(excess)
+                ).all()
+            ]
+            if keys:
+                removed += db.execute(delete(LlmCacheEntry).where(LlmCacheEntry.key.in_(keys))).rowcount or 0
+        db.commit()
+    with _lock:
+        _stats["pruned"] += removed
+    return removed
+
+
+def complete(
+    client,
+    *,
+    messages: list,
+    temperature: float,
+    max_tokens: Optional[int] = None,
+    model: Optional[str] = None,
+    bypass: bool = False,
+) -> str:
+    """chat.completions.create を呼び、応答本文を返す（キャッシュ経由）"""
+    model = model or settings.OPENAI_MODEL
+    use_cache = settings.LLM_CACHE_ENABLED and not bypass
+    key = None
+    if use_cache:
+        key = cache_key(model, messages, temperature, max_tokens)
+        try:
+            hit = _get(key)
+        except Exception as e:
+            logger.warning("llm cache read failed: %s", e)
+            hit = None
+        with _lock:
+            _stats["hits" if hit is not None else "misses"] += 1
+        if hit is not None:
+            return hit
+    else:
+        with _lock:
+            _stats["bypassed"] += 1
+
+    kwargs: dict = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    resp = client.chat.completions.create(**kwargs)
+    text = resp.choices[0].message.content or ""
+
+    # 空応答はキャッシュしない（次回は API を呼び直す）
+    if use_cache and text.strip():
+        try:
+            _put(key, model, text)
+        except Exception as e:
+            logger.warning("llm cache write failed: %s", e)
+    return text
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,108 @@
+"""
+プロセス共有の LLM クライアント。
+
+呼び出しごとに OpenAI() を作ると、import と HTTP 接続確立を毎回払い、タイムアウトや再試行も制御できない。
+ここで 1 つだけ遅延生成し、全 AI 経路（解説生成・判定・OCR）で使い回す。
+
+- HTTP keep-alive の接続プール（httpx）、LLM_TIMEOUT_SEC / LLM_MAX_RETRIES を設定
+- chat.completions.create は LLM_MAX_CONCURRENCY のセマフォでプロセス全体の同時呼び出し数を制限
+- バックエンドは LLM_BACKEND で切り替え: openai（既定。LLM_BASE_URL で互換サーバにも向けられる）/ stub
+  テスト・ベンチマークでは set_backend(StubClient(...)) で差し替える
+"""
+import threading
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from core.config import get_settings
+
+settings = get_settings()
+
+_lock = threading.Lock()
+_client: Optional["GatewayClient"] = None
+_override: Any = None
+
+
+class _Completions:
+    def __init__(self, backend: Any, sem: threading.BoundedSemaphore):
+        self._backend = backend
+        self._sem = sem
+
+    def create(self, **kwargs):
+        with self._sem:
+            return self._backend.chat.completions.create(**kwargs)
+
+
+class GatewayClient:
+    """OpenAI 互換の chat.completions.create だけを公開するラッパ"""
+
+    def __init__(self, backend: Any, max_concurrency: int):
+        self.backend = backend
+        self.chat = SimpleNamespace(completions=_Completions(backend, threading.BoundedSemaphore(max(1, max_concurrency))))
+
+    def close(self) -> None:
+        close = getattr(self.backend, "close", None)
+        if callable(close):
+            close()
+
+
+def _make_openai():
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONCURRENCY,
+            max_keepalive_connections=settings.LLM_MAX_CONCURRENCY,
+        ),
+        timeout=settings.LLM_TIMEOUT_SEC,
+    )
+    return OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.LLM_BASE_URL or None,
+        timeout=settings.LLM_TIMEOUT_SEC,
+        max_retries=settings.LLM_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+
+def _make_backend():
+    if _override is not None:
+        return _override
+    if settings.LLM_BACKEND == "stub":
+        from services.llm_stub import StubClient
+
+        return StubClient()
+    return _make_openai()
+
+
+def enabled() -> bool:
+    """LLM を呼べる設定か（stub バックエンドは常に可）"""
+    if _override is not None or settings.LLM_BACKEND == "stub":
+        return True
+    return bool(settings.OPENAI_ENABLED and settings.OPENAI_API_KEY)
+
+
+def get_client() -> GatewayClient:
+    global _client
+    client = _client
+    if client is not None:
+        return client
+    with _lock:
+        if _client is None:
+            _client = GatewayClient(_make_backend(), settings.LLM_MAX_CONCURRENCY)
+        return _client
+
+
+def set_backend(backend: Any) -> None:
+    """バックエンドを差し替える（None で設定どおりに戻す）。次の get_client() から有効"""
+    global _override
+    _override = backend
+    close()
+
+
+def close() -> None:
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
@@ -0,0 +1,36 @@
+"""
+OpenAI 互換の最小スタブクライアント（オフライン確認・ベンチマーク用）。
+
+    client = StubClient('{"is_wrong": false, "score": 90, "reason": "ok"}', latency=0.2)
+    judge_all_explanations(pid, client=client, concurrency=8)
+
+client.chat.completions.create(...) だけを実装し、固定文字列または responder(kwargs) の戻り値を返す。
+"""
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Union
+
+
+class _Completions:
+    def __init__(self, owner: "StubClient"):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        owner = self._owner
+        with owner._lock:
+            owner.calls.append(kwargs)
+        if owner.latency:
+            time.sleep(owner.latency)
+        reply = owner.reply(kwargs) if callable(owner.reply) else owner.reply
+        message = SimpleNamespace(content=reply, role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, index=0, finish_reason="stop")])
+
+
+class StubClient:
+    def __init__(self, reply: Union[str, Callable[[dict], str]] = "{}", latency: float = 0.0):
+        self.reply = reply
+        self.latency = latency
+        self.calls: list[dict] = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_Completions(self))
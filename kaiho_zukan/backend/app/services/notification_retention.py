@@ -0,0 +1,94 @@
+"""
+既読通知の保持期間管理。
+
+既読のまま NOTIFICATION_RETENTION_DAYS 日を過ぎた通知を削除し、notifications テーブルと
+idx_user / idx_notif_user_seen を小さく保つ。
+
+- 削除は id 順に NOTIFICATION_RETENTION_BATCH 件ずつ（1 回のトランザクション・ロックを短くする）
+  古い行ほど id が小さいので、主キー順に読めば対象はすぐ見つかる
+- アプリ内では NOTIFICATION_RETENTION_INTERVAL_SEC ごとにバックグラウンドスレッドで実行（0 で無効）
+- 手動実行: python -m services.notification_retention purge（app/ ディレクトリで実行）
+"""
+import datetime as dt
+import logging
+import sys
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import delete, select
+
+from core.config import get_settings
+from core.db import SessionLocal
+from models import Notification
+
+settings = get_settings()
+logger = logging.getLogger("uvicorn.error")
+
+# バッチ間の待ち（他のトランザクションにロックを譲る）
+_PAUSE_SEC = 0.05
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def purge(days: Optional[int] = None, batch: Optional[int] = None) -> int:
+    """既読で days 日より古い通知を削除し、削除件数を返す"""
+    days = settings.NOTIFICATION_RETENTION_DAYS if days is None else days
+    batch = max(1, batch or settings.NOTIFICATION_RETENTION_BATCH)
+    if days <= 0:
+        return 0
+    cutoff = dt.datetime.utcnow() - dt.timedelta(days=days)
+    total = 0
+    while not _stop.is_set():
+        with SessionLocal() as db:
+            ids = list(db.execute(
+                select(Notification.id)
+                .where(Notification.seen == True, Notification.created_at < cutoff)  # noqa: E712
+                .order_by(Notification.id.asc())
+                .limit(batch)
+            ).scalars().all())
+            if not ids:
+                break
+            db.execute(delete(Notification).where(Notification.id.in_(ids)))
+            db.commit()
+        total += len(ids)
+        if len(ids) < batch:
+            break
+        time.sleep(_PAUSE_SEC)
+    if total:
+        logger.info("notification retention: deleted %d seen notifications older than %d days", total, days)
+    return total
+
+
+def _loop() -> None:
+    while not _stop.is_set():
+        try:
+            purge()
+        except Exception as e:
+            logger.warning("notification retention failed: %s", e)
+        _stop.wait(settings.NOTIFICATION_RETENTION_INTERVAL_SEC)
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or settings.NOTIFICATION_RETENTION_INTERVAL_SEC <= 0 or settings.NOTIFICATION_RETENTION_DAYS <= 0:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="notification-retention", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5.0) -> None:
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["purge"]:
+        print("usage: python -m services.notification_retention purge")
+        sys.exit(2)
+    print(f"notifications: {purge()} deleted")
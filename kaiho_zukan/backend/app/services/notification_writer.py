@@ -0,0 +1,217 @@
+"""
+いいね通知の書き込み（集約・一括 upsert）。
+
+人気の問題にいいねが集中すると、1 いいねごとに「存在確認 SELECT + INSERT」を
+リクエストのトランザクション内で行い、notifications の行数とロック競合が膨らんでいた。
+
+- record_like() はいいねの commit 後に呼ぶ。メモリ上の保留分に積むだけで DB には触れない
+- フラッシュスレッドが NOTIFICATION_FLUSH_SEC ごとに保留分を (受信者, 種類, 問題) でまとめ、
+  INSERT ... ON DUPLICATE KEY UPDATE（SQLite は ON CONFLICT）で書く
+- NOTIFICATION_LIKE_MODE
+  - aggregate: (受信者, 種類, 問題) ごとに 1 行。actor_count に件数を足し、actor_user_id は最新のユーザ、
+    recent_actor_ids に直近のユーザを新しい順で持つ。新しいいいねが来たら未読に戻す。
+    一覧の after_seq と SSE の Last-Event-ID は seq で追うので、upsert で新しい seq を振り直す
+    （id は変えない。seq は models.notification.next_seq でチャンクごとにまとめて確保する）
+  - per_actor: 従来どおりいいねした人ごとに 1 行（同じ人の 2 回目は何もしない）
+- 書いた行は notify_hub へ publish する
+- 書き込みに失敗した分は保留分へ戻し、次のフラッシュで書き直す
+- フラッシュスレッドが動いていない（NOTIFICATION_FLUSH_SEC=0、CLI など）ときはその場で書く。
+  プロセス終了時は stop() で残りを書き出す（異常終了時は保留分の通知だけが失われる）
+"""
+import datetime as dt
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import select, tuple_, func, literal
+
+from core.config import get_settings
+from core.db import SessionLocal
+from models import Notification
+from models.notification import next_seq
+from services import notify_hub
+
+settings = get_settings()
+logger = logging.getLogger("uvicorn.error")
+
+# recent_actor_ids に残す人数
+RECENT_ACTORS = 5
+_RECENT_MAX_LEN = 255
+# 1 文で upsert する行数
+_CHUNK = 100
+
+# (受信者, 種類, 問題, agg_key) -> [件数, いいねしたユーザ（古い順）]
+_pending: dict[tuple[int, str, Optional[int], str], list] = {}
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _aggregate() -> bool:
+    return settings.NOTIFICATION_LIKE_MODE != "per_actor"
+
+
+def agg_key(type_: str, problem_id: Optional[int], actor_id: int) -> str:
+    if _aggregate():
+        return f"{type_}:{problem_id}"
+    return f"{type_}:{problem_id}:{actor_id}"
+
+
+def parse_recent(value: Optional[str]) -> list[int]:
+    """recent_actor_ids を新しい順の ID リストにする（重複は除く）"""
+    if not value:
+        return []
+    parts = value.split(",")
+    if len(value) >= _RECENT_MAX_LEN:
+        # 長さで切り詰めた場合（SQLite）、末尾の ID は途中で切れている可能性がある
+        parts = parts[:-1]
+    out: list[int] = []
+    for p in parts:
+        if p.isdigit() and int(p) not in out:
+            out.append(int(p))
+    return out[:RECENT_ACTORS]
+
+
+def record_like(recipient_id: Optional[int], type_: str, problem_id: Optional[int], actor_id: int) -> None:
+    """いいね通知を 1 件積む（自分へのいいねは通知しない）。いいねの commit 後に呼ぶ"""
+    if not recipient_id or recipient_id == actor_id:
+        return
+    key = (int(recipient_id), type_, problem_id, agg_key(type_, problem_id, actor_id))
+    with _lock:
+        entry = _pending.setdefault(key, [0, []])
+        entry[0] += 1
+        entry[1].append(actor_id)
+    if _thread is None:
+        flush()
+
+
+def _requeue(batch: dict) -> None:
+    with _lock:
+        for key, (count, actors) in batch.items():
+            entry = _pending.get(key)
+            if entry is None:
+                _pending[key] = [count, actors]
+            else:
+                entry[0] += count
+                entry[1] = actors + entry[1]
+
+
+def _upsert(dialect: str, rows: list[dict]):
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        stmt = insert(Notification).values(rows)
+        new = stmt.inserted
+        recent = func.substring_index(
+            func.concat_ws(",", new.recent_actor_ids, Notification.recent_actor_ids), ",", RECENT_ACTORS
+        )
+        if not _aggregate():
+            return stmt.on_duplicate_key_update(id=Notification.id)
+        return stmt.on_duplicate_key_update(
+            actor_count=Notification.actor_count + new.actor_count,
+            actor_user_id=new.actor_user_id,
+            recent_actor_ids=recent,
+            seen=False,
+            created_at=new.created_at,
+            seq=new.seq,
+        )
+    from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(Notification).values(rows)
+    if not _aggregate():
+        return stmt.on_conflict_do_nothing(index_elements=["user_id", "agg_key"])
+    new = stmt.excluded
+    recent = func.substr(
+        func.coalesce(new.recent_actor_ids + literal(",") + Notification.recent_actor_ids, new.recent_actor_ids),
+        1, _RECENT_MAX_LEN,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "agg_key"],
+        set_={
+            "actor_count": Notification.actor_count + new.actor_count,
+            "actor_user_id": new.actor_user_id,
+            "recent_actor_ids": recent,
+            "seen": False,
+            "created_at": new.created_at,
+            "seq": new.seq,
+        },
+    )
+
+
+def flush() -> int:
+    """保留中のいいね通知を書き込み、書いた行数を返す"""
+    with _flush_lock:
+        with _lock:
+            batch = dict(_pending)
+            _pending.clear()
+        if not batch:
+            return 0
+        now = dt.datetime.utcnow()
+        rows = []
+        for (recipient_id, type_, problem_id, key), (count, actors) in batch.items():
+            recent: list[int] = []
+            for a in reversed(actors):
+                if a not in recent:
+                    recent.append(a)
+            rows.append({
+                "user_id": recipient_id,
+                "type": type_,
+                "problem_id": problem_id,
+                "actor_user_id": actors[-1],
+                "agg_key": key,
+                "actor_count": count,
+                "recent_actor_ids": ",".join(str(a) for a in recent[:RECENT_ACTORS]),
+                "seen": False,
+                "created_at": now,
+            })
+        try:
+            with SessionLocal() as db:
+                dialect = db.get_bind().dialect.name
+                for i in range(0, len(rows), _CHUNK):
+                    chunk = rows[i:i + _CHUNK]
+                    last = next_seq(db.connection(), len(chunk))
+                    for k, r in enumerate(chunk):
+                        r["seq"] = last - len(chunk) + 1 + k
+                    db.execute(_upsert(dialect, chunk))
+                db.commit()
+                keys = [(r["user_id"], r["agg_key"]) for r in rows]
+                written = db.execute(
+                    select(Notification.user_id, Notification.id)
+                    .where(tuple_(Notification.user_id, Notification.agg_key).in_(keys))
+                ).all()
+        except Exception as e:
+            # 落とさずに保留分へ戻し、次のフラッシュで書き直す（その間に積まれた分より古いので前に付ける）
+            _requeue(batch)
+            logger.warning("notification flush failed (%d rows requeued): %s", len(rows), e)
+            return 0
+    for user_id, nid in written:
+        notify_hub.publish(user_id, nid)
+    return len(rows)
+
+
+def _loop() -> None:
+    while not _stop.wait(settings.NOTIFICATION_FLUSH_SEC):
+        try:
+            flush()
+        except Exception as e:
+            logger.warning("notification flusher error: %s", e)
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or settings.NOTIFICATION_FLUSH_SEC <= 0:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="notification-flusher", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5.0) -> None:
+    """フラッシュスレッドを止め、残りを書き出す"""
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
+    flush()
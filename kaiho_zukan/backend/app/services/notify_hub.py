@@ -0,0 +1,182 @@
+"""
+通知のプッシュ配信（/notifications/stream 用の pub/sub ハブ）。
+
+- 通知行を追加・更新した処理は commit 後に publish(user_id, notification_id) を呼ぶ
+  （どのスレッドからでも呼べる。購読側のイベントループへ call_soon_threadsafe で渡す）
+- ストリーム接続ごとに subscribe() で購読し、届いた通知 ID の行を DB から読んで送る。
+  届くのは ID だけなので、取りこぼしは Last-Event-ID からの再送（notifications テーブル）で埋める
+- 中継方法は NOTIFY_BACKEND で選ぶ
+  - memory: このプロセス内だけで配信（uvicorn ワーカー 1 本の場合）
+  - redis: NOTIFY_REDIS_URL の Pub/Sub を経由して全ワーカーへ配信
+    （ローカルで複数ワーカーを動かすときは redis-server を立てて代用する）
+  テストでは set_backend() で差し替える
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+from core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger("uvicorn.error")
+
+_CHANNEL = "kaiho:notifications"
+
+
+class Subscription:
+    """1 接続分の購読。wait() で届いた通知 ID をまとめて受け取る"""
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self._pending: set[int] = set()
+        self._event = asyncio.Event()
+
+    def _push(self, notification_id: int) -> None:
+        self._pending.add(notification_id)
+        self._event.set()
+
+    async def wait(self, timeout: float) -> list[int]:
+        """通知が届くか timeout 秒たつまで待ち、届いた ID を昇順で返す（無ければ空）"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+        ids = sorted(self._pending)
+        self._pending.clear()
+        return ids
+
+
+_subs: dict[int, set[Subscription]] = {}
+_subs_lock = threading.Lock()
+
+
+def _deliver(user_id: int, notification_id: int) -> None:
+    """このプロセスの購読者へ配る"""
+    with _subs_lock:
+        subs = list(_subs.get(user_id, ()))
+    for sub in subs:
+        try:
+            sub.loop.call_soon_threadsafe(sub._push, notification_id)
+        except RuntimeError:
+            # イベントループが閉じている（終了処理中）
+            pass
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def publish(self, user_id: int, notification_id: int) -> None:
+        _deliver(user_id, notification_id)
+
+    def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """Redis Pub/Sub で全ワーカーへ中継する。受信は redis-py の購読スレッドで行う"""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=5)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{_CHANNEL: self._on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True, exception_handler=self._on_error)
+
+    def _on_error(self, exc, pubsub, thread) -> None:
+        # 接続が切れても購読スレッドは止めない（再接続時に redis-py が購読し直す）
+        logger.warning("notification broker error: %s", exc)
+        time.sleep(1.0)
+
+    def _on_message(self, message) -> None:
+        try:
+            user_id, notification_id = (int(x) for x in message["data"].split(b":", 1))
+        except (ValueError, TypeError):
+            return
+        _deliver(user_id, notification_id)
+
+    def publish(self, user_id: int, notification_id: int) -> None:
+        self._client.publish(_CHANNEL, f"{user_id}:{notification_id}")
+
+    def close(self) -> None:
+        self._thread.stop()
+        self._pubsub.close()
+        self._client.close()
+
+
+_lock = threading.Lock()
+_backend = None
+
+
+def _make_backend():
+    if settings.NOTIFY_BACKEND == "redis":
+        return RedisBackend(settings.NOTIFY_REDIS_URL)
+    return MemoryBackend()
+
+
+def get_backend():
+    global _backend
+    backend = _backend
+    if backend is not None:
+        return backend
+    with _lock:
+        if _backend is None:
+            _backend = _make_backend()
+        return _backend
+
+
+def set_backend(backend) -> None:
+    """中継方法を差し替える（None で設定どおりに戻す）"""
+    global _backend
+    with _lock:
+        old, _backend = _backend, backend
+    if old is not None and old is not backend:
+        old.close()
+
+
+def publish(user_id: Optional[int], notification_id: Optional[int]) -> None:
+    """通知の追加・更新を知らせる。commit 後に呼ぶ（失敗しても呼び出し元は止めない）"""
+    if user_id is None or notification_id is None:
+        return
+    try:
+        get_backend().publish(int(user_id), int(notification_id))
+    except Exception as e:
+        # broker に届かなくてもこのプロセスの購読者には配り、残りは再接続時の再送に任せる
+        logger.warning("notification publish failed: %s", e)
+        _deliver(int(user_id), int(notification_id))
+
+
+def subscribe(user_id: int) -> Subscription:
+    """実行中のイベントループ上で呼ぶ。終わったら unsubscribe() する"""
+    get_backend()
+    sub = Subscription(user_id, asyncio.get_running_loop())
+    with _subs_lock:
+        _subs.setdefault(user_id, set()).add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscription) -> None:
+    with _subs_lock:
+        subs = _subs.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del _subs[sub.user_id]
+
+
+def stats() -> dict:
+    with _subs_lock:
+        users = len(_subs)
+        connections = sum(len(s) for s in _subs.values())
+    backend = _backend
+    return {"backend": getattr(backend, "name", settings.NOTIFY_BACKEND), "users": users, "connections": connections}
+
+
+def close() -> None:
+    set_backend(None)
@@ -0,0 +1,250 @@
+"""
+/problems/next 用の重み付きサンプリング索引。
+
+(child_id, grand_id) ごとに (problem_id, like_count) を配列で保持し、Fenwick 木で
+重みの累積和を管理する。抽選は O(log n)、いいね増減・問題追加/削除は O(log n) で
+インクリメンタルに反映する。ユーザごとの正解済み問題は、カテゴリ索引の位置に対応する
+ビットマップで持つ。
+
+索引はプロセス内キャッシュなので、複数ワーカー構成では他ワーカーの更新が
+PROBLEM_SAMPLER_TTL_SEC 秒以内に再構築で反映される。
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from core.config import get_settings
+from models import Problem, UserProblemState
+
+settings = get_settings()
+
+# 除外対象に当たったときの再抽選回数。超えたら未正解の位置だけで線形に抽選する
+_MAX_REJECTIONS = 16
+_MAX_SOLVED_ENTRIES = 4096
+
+
+def _weight(like_count: Optional[int]) -> int:
+    return max(1, int(like_count or 0))
+
+
+class _CategoryIndex:
+    def __init__(self, rows: list[tuple[int, int]]):
+        self.ids: list[int] = []
+        self.weights: list[int] = []
+        self.pos: dict[int, int] = {}
+        self.tree: list[int] = [0]
+        self.total = 0
+        self.live = 0
+        self.built_at = time.monotonic()
+        for pid, likes in rows:
+            self._append(int(pid), _weight(likes))
+
+    # --- Fenwick tree ---
+    def _add(self, i: int, delta: int) -> None:
+        i += 1
+        n = len(self.tree) - 1
+        while i <= n:
+            self.tree[i] += delta
+            i += i & (-i)
+        self.total += delta
+
+    def _append(self, pid: int, w: int) -> None:
+        i = len(self.ids)
+        self.ids.append(pid)
+        self.weights.append(0)
+        self.pos[pid] = i
+        # 新しいノード i+1 の担当区間 (i+1 - lowbit, i+1] の既存分を集計して初期化
+        k = i + 1
+        node = 0
+        j = k - 1
+        stop = k - (k & (-k))
+        while j > stop:
+            node += self.tree[j]
+            j -= j & (-j)
+        self.tree.append(node)
+        self.weights[i] = w
+        self._add(i, w)
+        self.live += 1
+
+    def set_weight(self, pid: int, w: int) -> None:
+        i = self.pos.get(pid)
+        if i is None:
+            self._append(pid, w)
+            return
+        if self.weights[i] == 0 and w > 0:
+            self.live += 1
+        elif self.weights[i] > 0 and w == 0:
+            self.live -= 1
+        delta = w - self.weights[i]
+        if delta:
+            self.weights[i] = w
+            self._add(i, delta)
+
+    def remove(self, pid: int) -> None:
+        if pid in self.pos:
+            self.set_weight(pid, 0)
+
+    def find(self, r: float) -> int:
+        """累積和が r を超える最小の位置"""
+        i = 0
+        n = len(self.tree) - 1
+        step = 1 << n.bit_length()
+        while step:
+            j = i + step
+            if j <= n and self.tree[j] <= r:
+                i = j
+                r -= self.tree[j]
+            step >>= 1
+        return min(i, len(self.ids) - 1)
+
+    def draw(self, solved: Optional[bytearray]) -> Optional[int]:
+        if self.total <= 0:
+            return None
+        for _ in range(_MAX_REJECTIONS):
+            i = self.find(random.random() * self.total)
+            if self.weights[i] <= 0:
+                continue
+            if solved is None or not _bit(solved, i):
+                return self.ids[i]
+        if solved is None:
+            return None
+        # ほぼ全問正解済みのユーザ向け: 残りの位置だけで抽選（DB アクセスなし）
+        cand = [i for i, w in enumerate(self.weights) if w > 0 and not _bit(solved, i)]
+        if not cand:
+            return None
+        i = random.choices(cand, weights=[self.weights[i] for i in cand], k=1)[0]
+        return self.ids[i]
+
+
+def _bit(bm: bytearray, i: int) -> bool:
+    b = i >> 3
+    return b < len(bm) and bool(bm[b] & (1 << (i & 7)))
+
+
+def _set_bit(bm: bytearray, i: int) -> None:
+    b = i >> 3
+    if b >= len(bm):
+        bm.extend(b"\x00" * (b + 1 - len(bm)))
+    bm[b] |= 1 << (i & 7)
+
+
+_lock = threading.Lock()
+_indexes: dict[tuple[int, Optional[int]], _CategoryIndex] = {}
+# (user_id, child_id, grand_id) -> カテゴリ索引の位置に対応する正解済みビットマップ
+_solved: "OrderedDict[tuple[int, int, Optional[int]], bytearray]" = OrderedDict()
+
+
+def _keys(child_id: int, grand_id: Optional[int]) -> list[tuple[int, Optional[int]]]:
+    keys: list[tuple[int, Optional[int]]] = [(int(child_id), None)]
+    if grand_id is not None:
+        keys.append((int(child_id), int(grand_id)))
+    return keys
+
+
+def _get_index(db: Session, child_id: int, grand_id: Optional[int]) -> _CategoryIndex:
+    key = (child_id, grand_id)
+    with _lock:
+        idx = _indexes.get(key)
+        if idx is not None and time.monotonic() - idx.built_at < settings.PROBLEM_SAMPLER_TTL_SEC:
+            return idx
+    q = select(Problem.id, Problem.like_count).where(Problem.child_id == child_id)
+    if grand_id is not None:
+        q = q.where(Problem.grand_id == grand_id)
+    idx = _CategoryIndex([(pid, likes) for pid, likes in db.execute(q.order_by(Problem.id.asc())).all()])
+    with _lock:
+        _indexes[key] = idx
+        # 位置がずれるので同カテゴリのビットマップは作り直す
+        for k in [k for k in _solved if (k[1], k[2]) == key]:
+            del _solved[k]
+    return idx
+
+
+def solved_query(user_id: int, child_id: int, grand_id: Optional[int] = None):
+    """カテゴリ内で正解済みの問題 ID（user_problem_state の主キー引き）"""
+    q = (
+        select(UserProblemState.problem_id)
+        .join(Problem, Problem.id == UserProblemState.problem_id)
+        .where(UserProblemState.user_id == user_id, UserProblemState.correct_count > 0, Problem.child_id == child_id)
+    )
+    if grand_id is not None:
+        q = q.where(Problem.grand_id == grand_id)
+    return q
+
+
+def _get_solved(db: Session, user_id: int, child_id: int, grand_id: Optional[int], idx: _CategoryIndex) -> bytearray:
+    key = (user_id, child_id, grand_id)
+    with _lock:
+        # キャッシュのビットマップは今の索引の位置に対応する（idx が作り直される前のものなら使わない）
+        bm = _solved.get(key) if _indexes.get((child_id, grand_id)) is idx else None
+        if bm is not None:
+            _solved.move_to_end(key)
+            return bm
+    bm = bytearray((len(idx.ids) + 7) >> 3)
+    for (pid,) in db.execute(solved_query(user_id, child_id, grand_id)).all():
+        i = idx.pos.get(int(pid))
+        if i is not None:
+            _set_bit(bm, i)
+    with _lock:
+        # 読んでいる間に別スレッドが索引を作り直していたら位置が合わないので保存しない（今回の抽選には使える）
+        if _indexes.get((child_id, grand_id)) is idx:
+            _solved[key] = bm
+            while len(_solved) > _MAX_SOLVED_ENTRIES:
+                _solved.popitem(last=False)
+    return bm
+
+
+def pick_problem_id(
+    db: Session,
+    user_id: int,
+    child_id: int,
+    grand_id: Optional[int] = None,
+    include_answered: bool = False,
+) -> Optional[int]:
+    """like_count で重み付けしてカテゴリ内の問題 ID を 1 つ選ぶ（正解済みは既定で除外）"""
+    idx = _get_index(db, child_id, grand_id)
+    solved = None if include_answered else _get_solved(db, user_id, child_id, grand_id, idx)
+    with _lock:
+        return idx.draw(solved)
+
+
+# --- 書き込み経路からのインクリメンタル更新 ---
+
+def on_problem_added(problem_id: int, child_id: int, grand_id: Optional[int], like_count: int = 0) -> None:
+    with _lock:
+        for key in _keys(child_id, grand_id):
+            idx = _indexes.get(key)
+            if idx is not None:
+                idx.set_weight(int(problem_id), _weight(like_count))
+
+
+def on_problem_removed(problem_id: int, child_id: int, grand_id: Optional[int]) -> None:
+    with _lock:
+        for key in _keys(child_id, grand_id):
+            idx = _indexes.get(key)
+            if idx is not None:
+                idx.remove(int(problem_id))
+
+
+def on_like_changed(problem_id: int, child_id: int, grand_id: Optional[int], like_count: int) -> None:
+    with _lock:
+        for key in _keys(child_id, grand_id):
+            idx = _indexes.get(key)
+            if idx is not None and int(problem_id) in idx.pos:
+                idx.set_weight(int(problem_id), _weight(like_count))
+
+
+def on_solved(user_id: int, problem_id: int, child_id: int, grand_id: Optional[int]) -> None:
+    with _lock:
+        for key in _keys(child_id, grand_id):
+            bm = _solved.get((int(user_id),) + key)
+            idx = _indexes.get(key)
+            if bm is None or idx is None:
+                continue
+            i = idx.pos.get(int(problem_id))
+            if i is not None:
+                _set_bit(bm, i)
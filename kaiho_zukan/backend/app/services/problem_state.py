@@ -0,0 +1,155 @@
+"""
+ユーザ × 問題ごとの解答状態 (user_problem_state) の読み書き。
+
+answers は解答のたびに 1 行増えるので、「問題ごとの最新解答」を answers の GROUP BY で毎回求めると
+解答履歴が長いユーザほど復習画面・出題が重くなる。ここでは解答時に要約行を upsert しておき、
+review_stats / review_history / 出題の「正解済み除外」は user_problem_state の主キー引きにする。
+
+- 書き込み経路（answer_problem / review_mark）は Answer を flush して ID を得てから、同じトランザクション内で record() を呼ぶ
+- last_* は解答 ID が大きい方を残す（並行する解答の upsert 順が前後しても最新解答が勝つ）
+- correct_count は正解回数。出題の「正解済み」は一度でも正解したか（correct_count > 0）で判定する
+- 復習スケジュール（ease / interval_days / repetitions / due_at）は upsert 後に services.review_scheduler が進める
+- 既存データの一括投入: python -m services.problem_state backfill
+"""
+import datetime as dt
+import sys
+from typing import Optional
+
+from sqlalchemy import select, func, case, delete
+from sqlalchemy.orm import Session
+
+from models import Answer, Problem, User, UserProblemState
+from services import review_scheduler
+
+
+def _upsert(dialect: str, row: dict):
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        stmt = insert(UserProblemState).values(row)
+        new = stmt.inserted
+        newer = new.last_answer_id > UserProblemState.last_answer_id
+        # MySQL は左から順に代入し、後の式は代入済みの値を見るので last_answer_id は最後に更新する
+        return stmt.on_duplicate_key_update([
+            ("child_id", new.child_id),
+            ("grand_id", new.grand_id),
+            ("last_is_correct", case((newer, new.last_is_correct), else_=UserProblemState.last_is_correct)),
+            ("last_answered_at", case((newer, new.last_answered_at), else_=UserProblemState.last_answered_at)),
+            ("first_answered_at", func.least(UserProblemState.first_answered_at, new.first_answered_at)),
+            ("attempt_count", UserProblemState.attempt_count + new.attempt_count),
+            ("correct_count", UserProblemState.correct_count + new.correct_count),
+            ("last_answer_id", func.greatest(UserProblemState.last_answer_id, new.last_answer_id)),
+        ])
+    from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(UserProblemState).values(row)
+    new = stmt.excluded
+    newer = new.last_answer_id > UserProblemState.last_answer_id
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "problem_id"],
+        set_={
+            "child_id": new.child_id,
+            "grand_id": new.grand_id,
+            "last_is_correct": case((newer, new.last_is_correct), else_=UserProblemState.last_is_correct),
+            "last_answered_at": case((newer, new.last_answered_at), else_=UserProblemState.last_answered_at),
+            "first_answered_at": func.min(UserProblemState.first_answered_at, new.first_answered_at),
+            "attempt_count": UserProblemState.attempt_count + new.attempt_count,
+            "correct_count": UserProblemState.correct_count + new.correct_count,
+            "last_answer_id": func.max(UserProblemState.last_answer_id, new.last_answer_id),
+        },
+    )
+
+
+def record(
+    db: Session,
+    user_id: int,
+    problem: Problem,
+    answer_id: int,
+    is_correct: Optional[bool],
+    answered_at: Optional[dt.datetime] = None,
+) -> None:
+    """解答 1 件を反映し、復習スケジュールを進める。commit は呼び出し側"""
+    at = answered_at or dt.datetime.utcnow()
+    db.execute(_upsert(db.get_bind().dialect.name, {
+        "user_id": user_id,
+        "problem_id": problem.id,
+        "child_id": problem.child_id,
+        "grand_id": problem.grand_id,
+        "last_answer_id": answer_id,
+        "last_is_correct": is_correct,
+        "attempt_count": 1,
+        "correct_count": 1 if is_correct else 0,
+        "first_answered_at": at,
+        "last_answered_at": at,
+    }))
+    review_scheduler.apply(db, user_id, problem.id, answer_id, is_correct, at)
+
+
+def _compute(db: Session, uids: list[int]) -> list[dict]:
+    """answers を古い順に読み直して (ユーザ, 問題) ごとの状態を作る（backfill 用）"""
+    states: dict[tuple[int, int], dict] = {}
+    history: dict[tuple[int, int], list] = {}
+    rows = db.execute(
+        select(Answer.user_id, Answer.problem_id, Answer.id, Answer.is_correct, Answer.created_at, Problem.child_id, Problem.grand_id)
+        .join(Problem, Problem.id == Answer.problem_id)
+        .where(Answer.user_id.in_(uids))
+        .order_by(Answer.id.asc())
+    ).all()
+    for r in rows:
+        key = (int(r.user_id), int(r.problem_id))
+        st = states.get(key)
+        if st is None:
+            st = states[key] = {
+                "user_id": key[0],
+                "problem_id": key[1],
+                "attempt_count": 0,
+                "correct_count": 0,
+                "first_answered_at": r.created_at,
+            }
+            history[key] = []
+        st.update(
+            child_id=r.child_id,
+            grand_id=r.grand_id,
+            last_answer_id=int(r.id),
+            last_is_correct=r.is_correct,
+            last_answered_at=r.created_at,
+        )
+        st["attempt_count"] += 1
+        st["correct_count"] += 1 if r.is_correct else 0
+        history[key].append((r.is_correct, r.created_at))
+    for key, st in states.items():
+        st.update(review_scheduler.replay(history[key]))
+    return list(states.values())
+
+
+def backfill(db: Session, batch: int = 50) -> int:
+    """全ユーザの user_problem_state を answers から作り直し、書いた行数を返す"""
+    last = 0
+    done = 0
+    while True:
+        uids = [
+            int(r[0])
+            for r in db.execute(
+                select(User.id).where(User.id > last).order_by(User.id.asc()).limit(batch)
+            ).all()
+        ]
+        if not uids:
+            break
+        rows = _compute(db, uids)
+        db.execute(delete(UserProblemState).where(UserProblemState.user_id.in_(uids)))
+        if rows:
+            db.execute(UserProblemState.__table__.insert(), rows)
+        db.commit()
+        done += len(rows)
+        last = uids[-1]
+    return done
+
+
+if __name__ == "__main__":
+    from core.db import SessionLocal
+
+    if sys.argv[1:] != ["backfill"]:
+        print("usage: python -m services.problem_state backfill")
+        sys.exit(2)
+    with SessionLocal() as s:
+        print(f"user_problem_state: {backfill(s)} rows")
@@ -0,0 +1,124 @@
+"""
+復習スケジューラ（SM-2）。
+
+user_problem_state の行ごとに ease / interval_days / repetitions / due_at を持ち、解答のたびに更新する。
+- 品質: 正解 = 4、不正解 = 1（自己採点なしの解答は None でスケジュールを動かさない）
+- 不正解なら repetitions を 0 に戻して 1 日後、正解なら 1 日 → 6 日 → interval × ease と間隔を伸ばす
+- ease は SM-2 の式で更新し、1.3 を下限とする
+- /review/due は (user_id, child_id, due_at) / (user_id, grand_id, due_at) のインデックスを期限順に読むだけで、
+  解答履歴の長さに関係なく先頭の数件を返す
+
+ベンチマーク: python bench/review_due.py [件数]（backend/ ディレクトリで実行。既定は使い捨ての SQLite）
+"""
+import datetime as dt
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from models import Problem, UserProblemState
+
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+# 正解の 1 回目・2 回目の間隔（日）
+FIRST_INTERVALS = (1.0, 6.0)
+
+
+def quality(is_correct: Optional[bool]) -> Optional[int]:
+    if is_correct is None:
+        return None
+    return 4 if is_correct else 1
+
+
+def next_state(
+    ease: float, interval_days: float, repetitions: int, q: int, at: dt.datetime
+) -> tuple[float, float, int, dt.datetime]:
+    """SM-2 の 1 ステップ。(ease, interval_days, repetitions, due_at) を返す"""
+    if q < 3:
+        repetitions = 0
+        interval_days = FIRST_INTERVALS[0]
+    else:
+        repetitions += 1
+        if repetitions <= len(FIRST_INTERVALS):
+            interval_days = FIRST_INTERVALS[repetitions - 1]
+        else:
+            interval_days = round(interval_days * ease, 1)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - q) * (0.08 + (5 - q) * 0.02))
+    return ease, interval_days, repetitions, at + dt.timedelta(days=interval_days)
+
+
+def apply(db: Session, user_id: int, problem_id: int, answer_id: int, is_correct: Optional[bool], at: dt.datetime) -> None:
+    """problem_state.record() の upsert 後に呼ぶ。この解答が最新のときだけスケジュールを進める"""
+    st = db.execute(
+        select(
+            UserProblemState.last_answer_id,
+            UserProblemState.ease,
+            UserProblemState.interval_days,
+            UserProblemState.repetitions,
+            UserProblemState.due_at,
+        )
+        .where(UserProblemState.user_id == user_id, UserProblemState.problem_id == problem_id)
+        .with_for_update()
+    ).first()
+    if st is None or st.last_answer_id != answer_id:
+        return
+    q = quality(is_correct)
+    if q is None:
+        if st.due_at is None:
+            db.execute(
+                update(UserProblemState)
+                .where(UserProblemState.user_id == user_id, UserProblemState.problem_id == problem_id)
+                .values(due_at=at + dt.timedelta(days=FIRST_INTERVALS[0]))
+            )
+        return
+    ease, interval_days, repetitions, due_at = next_state(
+        st.ease if st.ease is not None else INITIAL_EASE, st.interval_days or 0, st.repetitions or 0, q, at
+    )
+    db.execute(
+        update(UserProblemState)
+        .where(UserProblemState.user_id == user_id, UserProblemState.problem_id == problem_id)
+        .values(ease=ease, interval_days=interval_days, repetitions=repetitions, due_at=due_at)
+    )
+
+
+def replay(answers: list[tuple[Optional[bool], dt.datetime]]) -> dict:
+    """古い順の (正誤, 解答日時) からスケジュールを作り直す（backfill 用）"""
+    ease, interval_days, repetitions, due_at = INITIAL_EASE, 0.0, 0, None
+    for is_correct, at in answers:
+        q = quality(is_correct)
+        if q is None:
+            if due_at is None:
+                due_at = at + dt.timedelta(days=FIRST_INTERVALS[0])
+            continue
+        ease, interval_days, repetitions, due_at = next_state(ease, interval_days, repetitions, q, at)
+    return {"ease": ease, "interval_days": interval_days, "repetitions": repetitions, "due_at": due_at}
+
+
+def _category_filter(q, user_id: int, category_id: int, grand_id: Optional[int]):
+    # grand_id はカテゴリ木で一意なので、指定があれば (user_id, grand_id, due_at) だけで引ける
+    if grand_id is not None:
+        return q.where(UserProblemState.user_id == user_id, UserProblemState.grand_id == grand_id)
+    return q.where(UserProblemState.user_id == user_id, UserProblemState.child_id == category_id)
+
+
+def due_query(user_id: int, category_id: int, grand_id: Optional[int], now: dt.datetime, limit: int):
+    """期限切れの問題を期限の早い順に limit 件"""
+    q = select(UserProblemState, Problem).join(Problem, Problem.id == UserProblemState.problem_id)
+    return (
+        _category_filter(q, user_id, category_id, grand_id)
+        .where(UserProblemState.due_at <= now)
+        .order_by(UserProblemState.due_at.asc())
+        .limit(limit)
+    )
+
+
+def next_due_query(user_id: int, category_id: int, grand_id: Optional[int], now: dt.datetime):
+    """次に期限が来る日時（期限切れが無いときの案内用）"""
+    q = select(UserProblemState.due_at)
+    return (
+        _category_filter(q, user_id, category_id, grand_id)
+        .where(UserProblemState.due_at > now)
+        .order_by(UserProblemState.due_at.asc())
+        .limit(1)
+    )
+
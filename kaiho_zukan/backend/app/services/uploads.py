@@ -0,0 +1,318 @@
+"""
+問題・解説画像のアップロード保存。
+
+- 固定サイズのチャンクで一時ファイルへ書き出す（ファイルサイズに比例したメモリを使わない）。
+  UPLOAD_MAX_BYTES を超えた時点で打ち切る
+- 形式は拡張子ではなく先頭バイト（マジックナンバー）で判定する（png/jpeg/gif/webp のみ）
+- 書き込みながら sha256 を計算し、img/<先頭2桁>/<sha256>.<ext> に保存する。同じ内容の画像は 1 ファイルを共有する
+- 表示用の縮小版（thumb/medium）はバックグラウンドで作る。無ければ原寸の URL を返す
+- 共有ファイルは行の削除を commit した後に release() で削除候補にし、sweep() が
+  UPLOAD_RELEASE_GRACE_SEC 秒後に参照が無いものだけ削除する。同じ内容を同時にアップロードした
+  リクエストがまだ行を commit していなくても、そのファイルを消さないため（再利用時は mtime を更新し、
+  猶予中に再利用されたファイルは消さない）
+- save_images() は途中の画像が拒否されたら、そのリクエストで新しく書いたファイルを release() してから例外を返す
+- アプリ内では UPLOAD_SWEEP_INTERVAL_SEC ごとにバックグラウンドスレッドで sweep() する（0 で無効）。
+  手動実行: python -m services.uploads sweep（app/ ディレクトリで実行）
+"""
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from core.config import get_settings
+from core.db import SessionLocal
+from models import ExplanationImage, ProblemImage
+
+settings = get_settings()
+logger = logging.getLogger("uvicorn.error")
+
+_CHUNK = 64 * 1024
+
+# 表示用の縮小版: 名前 -> 長辺 px
+VARIANTS = {"thumb": 320, "medium": 1024}
+
+# 削除候補の印を置くディレクトリ（UPLOAD_DIR からの相対）
+_RELEASED = "released"
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+class UploadRejected(Exception):
+    """アップロードを受け付けない（main.py で status_code/detail のレスポンスにする）"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_image(head: bytes) -> Optional[str]:
+    """先頭バイトから拡張子を返す。対応外なら None"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def _abs(rel: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, rel)
+
+
+def save_stream(src: BinaryIO, name: str = "image") -> Optional[str]:
+    """
+    src をチャンク単位で保存し、UPLOAD_DIR からの相対パスを返す（空ファイルは None）。
+    サイズ超過は 413、画像でなければ 400 の UploadRejected。
+    """
+    return _save_stream(src, name)[0]
+
+
+def _save_stream(src: BinaryIO, name: str) -> tuple[Optional[str], bool]:
+    """save_stream の本体。(相対パス, 今回新しく書いたか) を返す"""
+    limit = settings.UPLOAD_MAX_BYTES
+    tmp_dir = os.path.join(settings.UPLOAD_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(_CHUNK)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = sniff_image(chunk[:16])
+                    if ext is None:
+                        raise UploadRejected(400, f"unsupported image format: {name}")
+                size += len(chunk)
+                if size > limit:
+                    raise UploadRejected(413, f"image too large: {name} (max {limit} bytes)")
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            return None, False
+        sha = digest.hexdigest()
+        rel = f"img/{sha[:2]}/{sha}{ext}"
+        dest = _abs(rel)
+        if os.path.exists(dest):
+            try:
+                # sweep() に再利用されたことを伝える（削除候補でも猶予中なら消されない）
+                os.utime(dest, None)
+                return rel, False
+            except FileNotFoundError:
+                pass
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp_path, dest)
+        tmp_path = None
+        _schedule_variants(rel)
+        return rel, True
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_images(files) -> list[str]:
+    """
+    UploadFile のリストを保存して相対パスのリストを返す（空ファイルは飛ばす）。
+    途中で拒否されたら、ここで新しく書いたファイルを release() してから例外を返す
+    """
+    saved: list[str] = []
+    created: list[str] = []
+    try:
+        for f in files or []:
+            rel, new = _save_stream(f.file, os.path.basename(f.filename or "image"))
+            if rel:
+                saved.append(rel)
+            if new:
+                created.append(rel)
+    except Exception:
+        release(created)
+        raise
+    return saved
+
+
+def _variant_rel(rel: str, variant: str) -> str:
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{variant}{'.png' if ext == '.png' else '.jpg'}"
+
+
+def make_variants(rel: str) -> None:
+    """縮小版を作る（元画像より大きくなるものは作らない。GIF は対象外）"""
+    from PIL import Image
+
+    src = _abs(rel)
+    if rel.endswith(".gif") or not os.path.exists(src):
+        return
+    with Image.open(src) as im:
+        im.load()
+        for variant, edge in VARIANTS.items():
+            dest = _abs(_variant_rel(rel, variant))
+            if os.path.exists(dest) or max(im.size) <= edge:
+                continue
+            v = im.copy()
+            v.thumbnail((edge, edge))
+            tmp = dest + ".tmp"
+            if dest.endswith(".png"):
+                v.save(tmp, format="PNG", optimize=True)
+            else:
+                v.convert("RGB").save(tmp, format="JPEG", quality=85, optimize=True)
+            os.replace(tmp, dest)
+
+
+def _run_variants(rel: str) -> None:
+    try:
+        make_variants(rel)
+    except Exception as e:
+        logger.warning("image variants failed for %s: %s", rel, e)
+
+
+def _schedule_variants(rel: str) -> None:
+    global _executor
+    # アップロードは複数スレッドから来るので、作成はロック下で 1 回だけ
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="img-variants")
+    _executor.submit(_run_variants, rel)
+
+
+def url(rel: str, variant: Optional[str] = None) -> str:
+    """/uploads の URL。縮小版が無ければ原寸"""
+    if variant:
+        vrel = _variant_rel(rel, variant)
+        if os.path.exists(_abs(vrel)):
+            return f"/uploads/{vrel}"
+    return f"/uploads/{rel}"
+
+
+def explanation_files(db: Session, explanation_ids: Iterable[int]) -> list[str]:
+    """解説画像のファイル名（行を消す前に読み、commit 後に release() へ渡す）"""
+    ids = list(explanation_ids)
+    if not ids:
+        return []
+    return [
+        r[0]
+        for r in db.execute(select(ExplanationImage.filename).where(ExplanationImage.explanation_id.in_(ids))).all()
+    ]
+
+
+def release(filenames: Iterable[str]) -> None:
+    """
+    画像行を消したファイルを削除候補にする。行の削除を commit した後に呼ぶ。
+    その場では消さず、UPLOAD_DIR/released/ に印を置くだけ（実際の削除は sweep()）
+    """
+    for fn in {fn for fn in filenames if fn}:
+        marker = os.path.join(_released_dir(), fn)
+        try:
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            with open(marker, "a"):
+                pass
+            os.utime(marker, None)
+        except OSError as e:
+            logger.warning("image release failed for %s: %s", fn, e)
+
+
+def _released_dir() -> str:
+    return _abs(_RELEASED)
+
+
+def _referenced(names: list[str]) -> set[str]:
+    with SessionLocal() as db:
+        still = {r[0] for r in db.execute(select(ProblemImage.filename).where(ProblemImage.filename.in_(names))).all()}
+        still |= {
+            r[0] for r in db.execute(select(ExplanationImage.filename).where(ExplanationImage.filename.in_(names))).all()
+        }
+    return still
+
+
+def sweep(grace_sec: Optional[int] = None) -> int:
+    """
+    release() から grace_sec（既定 UPLOAD_RELEASE_GRACE_SEC）秒たった候補のうち、
+    どの画像行からも参照されず、その間に再利用（save_stream が mtime を更新）もされていないファイルと縮小版を削除する。
+    再利用中でまだ行が無いものは候補のまま残し、次回もう一度確かめる。削除した件数を返す
+    """
+    grace = settings.UPLOAD_RELEASE_GRACE_SEC if grace_sec is None else grace_sec
+    cutoff = time.time() - grace
+    root = _released_dir()
+    due: dict[str, str] = {}
+    for d, _dirs, files in os.walk(root):
+        for f in files:
+            marker = os.path.join(d, f)
+            try:
+                if os.path.getmtime(marker) <= cutoff:
+                    due[os.path.relpath(marker, root).replace(os.sep, "/")] = marker
+            except OSError:
+                continue
+    if not due:
+        return 0
+    still = _referenced(list(due))
+    removed = 0
+    for fn, marker in due.items():
+        src = _abs(fn)
+        if fn not in still:
+            try:
+                reused = os.path.getmtime(src) > cutoff
+            except OSError:
+                reused = False
+            if reused:
+                continue
+            for path in [src] + [_abs(_variant_rel(fn, v)) for v in VARIANTS]:
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except OSError:
+                    pass
+            removed += 1
+        try:
+            os.remove(marker)
+        except OSError:
+            pass
+    return removed
+
+
+def _loop() -> None:
+    while not _stop.wait(settings.UPLOAD_SWEEP_INTERVAL_SEC):
+        try:
+            sweep()
+        except Exception as e:
+            logger.warning("image sweep failed: %s", e)
+
+
+def start() -> None:
+    global _thread
+    if _thread is not None or settings.UPLOAD_SWEEP_INTERVAL_SEC <= 0:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="upload-sweeper", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5.0) -> None:
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["sweep"]:
+        print("usage: python -m services.uploads sweep")
+        sys.exit(2)
+    print(f"uploads: {sweep()} files removed")
@@ -0,0 +1,192 @@
+"""
+ユーザ集計値 (user_stats) の読み書き。
+
+- 書き込み経路（作成/削除/いいね/解答）は同じトランザクション内で bump() か refresh() を呼ぶ
+- 行の作成は INSERT ... ON DUPLICATE KEY UPDATE（SQLite は ON CONFLICT）で行い、同時に初回の更新が来ても衝突しない
+- ランキング（leaderboard）はそのセッションの commit 後に古いとする。commit 前に古いとすると、
+  その間に再構築したスナップショットが更新前の値を読んだまま新しいものとして扱われる
+- 読み出しは load() で主キー引き。行が未作成のユーザだけ元テーブルから集計する
+- 既存データの一括投入: python -m services.user_stats backfill
+"""
+import datetime as dt
+import sys
+from typing import Iterable, Optional
+
+from sqlalchemy import event, select, func, update, case
+from sqlalchemy.orm import Session
+
+from models import Answer, Explanation, ExplanationLike, Problem, ProblemLike, User, UserStats
+from services import leaderboard
+
+FIELDS = (
+    "problem_count",
+    "explanation_count",
+    "problem_likes",
+    "explanation_likes",
+    "answer_count",
+    "correct_count",
+)
+
+
+def total_creations(stats: dict) -> int:
+    return int(stats.get("problem_count", 0)) + int(stats.get("explanation_count", 0))
+
+
+# session.info のキー: commit 後に leaderboard.mark_dirty() する
+_DIRTY = "user_stats_dirty"
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    if session.info.pop(_DIRTY, False):
+        leaderboard.mark_dirty()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session: Session, transaction) -> None:
+    # ロールバックで終わった場合は何もしない（commit なら _after_commit で処理済み）
+    if transaction.parent is None:
+        session.info.pop(_DIRTY, None)
+
+
+def _empty() -> dict[str, int]:
+    return {k: 0 for k in FIELDS}
+
+
+def _compute(db: Session, uids: list[int]) -> dict[int, dict[str, int]]:
+    """元テーブルから集計（行が無いユーザ・refresh・backfill 用）"""
+    out = {uid: _empty() for uid in uids}
+    if not uids:
+        return out
+    for uid, cnt in db.execute(
+        select(Problem.created_by, func.count()).where(Problem.created_by.in_(uids)).group_by(Problem.created_by)
+    ).all():
+        out[int(uid)]["problem_count"] = int(cnt or 0)
+    for uid, cnt in db.execute(
+        select(Explanation.user_id, func.count()).where(Explanation.user_id.in_(uids)).group_by(Explanation.user_id)
+    ).all():
+        out[int(uid)]["explanation_count"] = int(cnt or 0)
+    for uid, cnt in db.execute(
+        select(Problem.created_by, func.count(ProblemLike.id))
+        .join(ProblemLike, ProblemLike.problem_id == Problem.id)
+        .where(Problem.created_by.in_(uids))
+        .group_by(Problem.created_by)
+    ).all():
+        out[int(uid)]["problem_likes"] = int(cnt or 0)
+    for uid, cnt in db.execute(
+        select(Explanation.user_id, func.count(ExplanationLike.id))
+        .join(ExplanationLike, ExplanationLike.explanation_id == Explanation.id)
+        .where(Explanation.user_id.in_(uids))
+        .group_by(Explanation.user_id)
+    ).all():
+        out[int(uid)]["explanation_likes"] = int(cnt or 0)
+    for uid, cnt, correct in db.execute(
+        select(
+            Answer.user_id,
+            func.count(Answer.id),
+            func.sum(case((Answer.is_correct == True, 1), else_=0)),  # noqa: E712
+        )
+        .where(Answer.user_id.in_(uids))
+        .group_by(Answer.user_id)
+    ).all():
+        out[int(uid)]["answer_count"] = int(cnt or 0)
+        out[int(uid)]["correct_count"] = int(correct or 0)
+    return out
+
+
+def load(db: Session, uids: Iterable[int]) -> dict[int, dict[str, int]]:
+    """uid -> 集計値。user_stats に行が無いユーザは元テーブルから集計して返す（書き込みはしない）"""
+    uids = list({int(u) for u in uids if u is not None})
+    if not uids:
+        return {}
+    out: dict[int, dict[str, int]] = {}
+    for row in db.execute(select(UserStats).where(UserStats.user_id.in_(uids))).scalars().all():
+        out[row.user_id] = {k: int(getattr(row, k) or 0) for k in FIELDS}
+    missing = [u for u in uids if u not in out]
+    if missing:
+        out.update(_compute(db, missing))
+    return out
+
+
+def _upsert(db: Session, values: dict[int, dict[str, int]], deltas: Optional[dict[str, int]] = None) -> None:
+    """values の行を入れる。既に行があれば values で上書きする（deltas を渡すと代わりに差分を足す）"""
+    rows = [{"user_id": uid, **vals} for uid, vals in values.items()]
+    if not rows:
+        return
+    if db.get_bind().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        stmt = insert(UserStats).values(rows)
+        db.execute(stmt.on_duplicate_key_update(_conflict_values(stmt.inserted, deltas)))
+        return
+    from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(UserStats).values(rows)
+    db.execute(stmt.on_conflict_do_update(index_elements=["user_id"], set_=_conflict_values(stmt.excluded, deltas)))
+
+
+def _conflict_values(new, deltas: Optional[dict[str, int]]) -> dict:
+    # upsert の UPDATE 側では onupdate が効かないので updated_at も書く
+    if deltas:
+        values = {k: getattr(UserStats, k) + v for k, v in deltas.items()}
+    else:
+        values = {k: getattr(new, k) for k in FIELDS}
+    values["updated_at"] = dt.datetime.utcnow()
+    return values
+
+
+def refresh(db: Session, uids: Iterable[int]) -> None:
+    """指定ユーザの集計を元テーブルから取り直す（削除など差分が読みにくい経路用）。commit は呼び出し側"""
+    uids = list({int(u) for u in uids if u is not None})
+    if not uids:
+        return
+    db.flush()
+    _upsert(db, _compute(db, uids))
+    db.info[_DIRTY] = True
+
+
+def bump(db: Session, user_id: int | None, **deltas: int) -> None:
+    """集計値を差分更新する（UPDATE ... SET col = col + :d）。commit は呼び出し側"""
+    if user_id is None:
+        return
+    deltas = {k: int(v) for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    values = {getattr(UserStats, k): getattr(UserStats, k) + v for k, v in deltas.items()}
+    db.info[_DIRTY] = True
+    res = db.execute(update(UserStats).where(UserStats.user_id == user_id).values(values))
+    if res.rowcount:
+        return
+    # 行が無い場合は今回の変更を含めて元テーブルから作る（並行リクエストが先に作成していれば差分を足す）
+    db.flush()
+    _upsert(db, _compute(db, [user_id]), deltas)
+
+
+def backfill(db: Session, batch: int = 500) -> int:
+    """全ユーザの user_stats を作り直す"""
+    last = 0
+    done = 0
+    while True:
+        uids = [
+            int(r[0])
+            for r in db.execute(
+                select(User.id).where(User.id > last).order_by(User.id.asc()).limit(batch)
+            ).all()
+        ]
+        if not uids:
+            break
+        _upsert(db, _compute(db, uids))
+        db.commit()
+        done += len(uids)
+        last = uids[-1]
+    return done
+
+
+if __name__ == "__main__":
+    from core.db import SessionLocal
+
+    if sys.argv[1:] != ["backfill"]:
+        print("usage: python -m services.user_stats backfill")
+        sys.exit(2)
+    with SessionLocal() as s:
+        print(f"user_stats: {backfill(s)} users")
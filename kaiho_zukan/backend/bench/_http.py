@@ -0,0 +1,129 @@
+"""
+HTTP ベンチ（bench/http_load.py・bench/login_burst.py）の共通部分。
+
+- DB は既定で一時ディレクトリの使い捨て SQLite。MySQL で測る場合は BENCH_DATABASE_URL に
+  ベンチ専用の DB を明示する（作ったデータは終了時に削除する）
+- アプリは uvicorn の子プロセスとして 127.0.0.1 の空きポートで起動する（同じ DB を使う）
+"""
+import contextlib
+import datetime as dt
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+PASSWORD = "bench-password"
+
+_tmp = tempfile.mkdtemp(prefix="kaiho-bench-")
+os.environ["DATABASE_URL"] = os.environ.get("BENCH_DATABASE_URL") or f"sqlite:///{_tmp}/bench.db"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_tmp, "uploads"))
+sys.path.insert(0, APP_DIR)
+
+from sqlalchemy import delete, select  # noqa: E402
+
+from core.db import SessionLocal, create_all  # noqa: E402
+from models import Category, Explanation, Problem, User  # noqa: E402
+from security.auth import hash_pw  # noqa: E402
+
+
+def seed(users: int, problems: int, explanations: int = 3) -> dict:
+    """ベンチ用のユーザ（パスワードは PASSWORD）・カテゴリ・問題・解説を作る"""
+    create_all()
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    hashed = hash_pw(PASSWORD)
+    now = dt.datetime.utcnow()
+    with SessionLocal() as db:
+        child = Category(name=f"{tag}-c", parent_id=None, level=1)
+        db.add(child)
+        db.flush()
+        grand = Category(name=f"{tag}-g", parent_id=child.id, level=2)
+        db.add(grand)
+        db.flush()
+        names = [f"{tag}-u{i}" for i in range(users)]
+        db.execute(User.__table__.insert(), [
+            {"username": n, "password_hash": hashed, "nickname": n} for n in names
+        ])
+        uids = db.execute(select(User.id).where(User.username.in_(names))).scalars().all()
+        db.execute(Problem.__table__.insert(), [
+            {"title": f"{tag}-p{i}", "body": "-", "qtype": "free", "child_id": child.id, "grand_id": grand.id,
+             "created_by": uids[i % len(uids)], "like_count": i % 7, "expl_like_count": 0, "created_at": now}
+            for i in range(problems)
+        ])
+        pids = db.execute(select(Problem.id).where(Problem.child_id == child.id)).scalars().all()
+        if explanations:
+            db.execute(Explanation.__table__.insert(), [
+                {"problem_id": pid, "user_id": uids[(pid + k) % len(uids)], "content": "-", "like_count": k,
+                 "created_at": now}
+                for pid in pids for k in range(explanations)
+            ])
+        db.commit()
+        return {"tag": tag, "child_id": child.id, "grand_id": grand.id, "usernames": names, "pids": pids}
+
+
+def cleanup(data: dict) -> None:
+    """seed() で作った行を消す（MySQL のベンチ専用 DB を使い回せるように）"""
+    with SessionLocal() as db:
+        db.execute(delete(Explanation).where(Explanation.problem_id.in_(data["pids"])))
+        db.execute(delete(Problem).where(Problem.id.in_(data["pids"])))
+        db.execute(delete(User).where(User.username.in_(data["usernames"])))
+        db.execute(delete(Category).where(Category.id.in_([data["grand_id"], data["child_id"]])))
+        db.commit()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def server(workers: int = 1):
+    """アプリを uvicorn で起動して base URL を返す（終了時に止める）"""
+    import httpx
+
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=dict(os.environ),
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if httpx.get(f"{base}/categories/tree", timeout=2).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("server did not start")
+            time.sleep(0.2)
+        yield base
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summary(values_ms: list[float]) -> str:
+    return (
+        f"n={len(values_ms):6d}  p50={percentile(values_ms, 50):7.1f}ms  "
+        f"p99={percentile(values_ms, 99):7.1f}ms  max={max(values_ms or [0]):7.1f}ms"
+    )
@@ -0,0 +1,100 @@
+"""
+ログイン集中時に他のエンドポイントの応答時間が悪化しないかを測る。
+
+GET /me（DB を 1 回引くだけの軽いエンドポイント）を samplers 本の並列で叩き続け、
+最初の seconds 秒（平常時）と、続く seconds 秒に burst 個のクライアントが POST /auth/login を
+繰り返している間（ログイン集中時）の /me の p50/p99 を並べて表示する。
+
+    python bench/login_burst.py [ログインのクライアント数] [秒数] [ワーカー数]
+    （backend/ ディレクトリで実行。既定 200 クライアント・10 秒・1 ワーカー）
+
+bcrypt のコスト・並列数は BCRYPT_ROUNDS / PASSWORD_HASH_WORKERS、DB プールは DB_POOL_SIZE /
+DB_MAX_OVERFLOW をそのまま子プロセスへ渡す。MySQL で測る場合は BENCH_DATABASE_URL にベンチ専用の DB を指定する
+（bench/http_load.py と同じ）。
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+
+import _http  # noqa: E402
+
+_SAMPLERS = 4
+
+
+async def _run(base: str, data: dict, burst: int, seconds: float) -> None:
+    limits = httpx.Limits(max_connections=burst + _SAMPLERS, max_keepalive_connections=burst + _SAMPLERS)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as client:
+        r = await client.post("/auth/login", json={"username": data["usernames"][0], "password": _http.PASSWORD})
+        r.raise_for_status()
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+        phase = {"name": "baseline"}
+        samples: dict[str, list[float]] = {"baseline": [], "burst": []}
+        sample_errors = {"baseline": 0, "burst": 0}
+        logins: list[float] = []
+        login_errors = [0]
+        stop = asyncio.Event()
+
+        async def sampler() -> None:
+            while not stop.is_set():
+                name = phase["name"]
+                t0 = time.perf_counter()
+                try:
+                    ok = (await client.get("/me", headers=headers)).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                samples[name].append((time.perf_counter() - t0) * 1000)
+                if not ok:
+                    sample_errors[name] += 1
+                await asyncio.sleep(0.01)
+
+        async def login(i: int, deadline: float) -> None:
+            # ユーザ名ごとの失敗制限にかからないよう、正しいパスワードでユーザを順に使う
+            username = data["usernames"][i % len(data["usernames"])]
+            while time.monotonic() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    ok = (await client.post(
+                        "/auth/login", json={"username": username, "password": _http.PASSWORD}
+                    )).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                logins.append((time.perf_counter() - t0) * 1000)
+                if not ok:
+                    login_errors[0] += 1
+
+        tasks = [asyncio.create_task(sampler()) for _ in range(_SAMPLERS)]
+        await asyncio.sleep(seconds)
+        phase["name"] = "burst"
+        deadline = time.monotonic() + seconds
+        await asyncio.gather(*(login(i, deadline) for i in range(burst)))
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    print(f"GET /me  baseline          {_http.summary(samples['baseline'])}  errors={sample_errors['baseline']}")
+    print(f"GET /me  during {burst:4d} logins {_http.summary(samples['burst'])}  errors={sample_errors['burst']}")
+    print(f"POST /auth/login         {_http.summary(logins)}  errors={login_errors[0]}  "
+          f"({len(logins) / seconds:.1f} logins/s)")
+
+
+def main(burst: int = 200, seconds: float = 10, workers: int = 1) -> None:
+    data = _http.seed(users=200, problems=10, explanations=0)
+    try:
+        with _http.server(workers) as base:
+            asyncio.run(_run(base, data, burst, seconds))
+    finally:
+        _http.cleanup(data)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        int(args[0]) if args else 200,
+        float(args[1]) if len(args) > 1 else 10,
+        int(args[2]) if len(args) > 2 else 1,
+    )
@@ -0,0 +1,99 @@
+"""
+/review/due のクエリのベンチマーク（SM-2 の復習キュー）。
+
+items 件の解答状態を持つユーザを作り、/review/due と同じクエリを runs 回引いて所要時間と実行計画を表示する。
+
+    python bench/review_due.py [件数] [回数]   （backend/ ディレクトリで実行。既定 50000 件・200 回）
+
+既定では一時ディレクトリの使い捨て SQLite に作る。MySQL で測る場合は BENCH_DATABASE_URL に
+ベンチ専用の DB を明示する（作ったデータは終了時に削除する）。
+"""
+import datetime as dt
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+_url = os.environ.get("BENCH_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp(prefix='kaiho-bench-')}/bench.db"
+os.environ["DATABASE_URL"] = _url
+os.environ["DATABASE_REPLICA_URLS"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from sqlalchemy import select  # noqa: E402
+
+from core.db import SessionLocal, create_all  # noqa: E402
+from models import Category, Problem, User, UserProblemState  # noqa: E402
+from services.index_advisor import _explain_mysql, _explain_sqlite  # noqa: E402
+from services.review_scheduler import due_query, replay  # noqa: E402
+
+
+def main(items: int = 50000, runs: int = 200) -> None:
+    create_all()
+    tag = f"review-bench-{uuid.uuid4().hex[:8]}"
+    now = dt.datetime.utcnow()
+    rnd = random.Random(0)
+    with SessionLocal() as db:
+        cat = Category(name=tag, parent_id=None, level=0)
+        db.add(cat)
+        db.flush()
+        user = User(username=tag, password_hash="-", nickname=tag)
+        db.add(user)
+        db.flush()
+        uid, cid = user.id, cat.id
+        db.commit()
+        t0 = time.perf_counter()
+        for start in range(0, items, 1000):
+            n = min(1000, items - start)
+            db.execute(Problem.__table__.insert(), [
+                {"title": f"{tag}-{start + i}", "body": "-", "qtype": "mcq", "child_id": cid, "grand_id": cid,
+                 "created_by": uid, "like_count": 0, "expl_like_count": 0, "created_at": now}
+                for i in range(n)
+            ])
+            pids = db.execute(
+                select(Problem.id).where(Problem.child_id == cid).order_by(Problem.id.desc()).limit(n)
+            ).scalars().all()
+            rows = []
+            for pid in pids:
+                correct = rnd.random() < 0.7
+                at = now - dt.timedelta(days=rnd.uniform(0, 60))
+                st = replay([(correct, at)])
+                st["due_at"] = now + dt.timedelta(days=rnd.uniform(-30, 30))
+                rows.append({
+                    "user_id": uid, "problem_id": pid, "child_id": cid, "grand_id": cid,
+                    "last_answer_id": pid, "last_is_correct": correct, "attempt_count": 1,
+                    "correct_count": 1 if correct else 0, "first_answered_at": at, "last_answered_at": at, **st,
+                })
+            db.execute(UserProblemState.__table__.insert(), rows)
+            db.commit()
+        setup = time.perf_counter() - t0
+
+    try:
+        with SessionLocal() as db:
+            dialect = db.get_bind().dialect
+            stmt = due_query(uid, cid, None, now, 20)
+            timings = []
+            for _ in range(runs):
+                t = time.perf_counter()
+                got = db.execute(stmt).all()
+                timings.append(time.perf_counter() - t)
+            sql = str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+            explain = _explain_mysql if dialect.name == "mysql" else _explain_sqlite
+            plan = explain(db, sql)
+        timings.sort()
+        print(f"review due bench: {items} items (setup {setup:.1f}s), {runs} runs, limit 20 -> {len(got)} rows")
+        print(f"  p50={timings[len(timings) // 2] * 1000:.2f}ms p95={timings[int(len(timings) * 0.95)] * 1000:.2f}ms")
+        for step in plan:
+            print(f"  {'!! ' + step['problem'] if step['problem'] else 'ok'}  {step['table']}: {step['plan']}")
+    finally:
+        with SessionLocal() as db:
+            db.execute(UserProblemState.__table__.delete().where(UserProblemState.user_id == uid))
+            db.execute(Problem.__table__.delete().where(Problem.child_id == cid))
+            db.execute(User.__table__.delete().where(User.id == uid))
+            db.execute(Category.__table__.delete().where(Category.id == cid))
+            db.commit()
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,32 @@
+"""
+parse_token の 1 回あたりのコスト（署名検証のみ / 検証済みトークンキャッシュあり）を表示する。
+
+    python bench/token_cache.py [回数]   （backend/ ディレクトリで実行。DB には接続しない）
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from security.auth import _decode, init_secrets, make_token, parse_token  # noqa: E402
+
+
+def main(n: int = 2000) -> None:
+    token = make_token(1)
+    init_secrets()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        _decode(token)
+    uncached = (time.perf_counter() - t0) / n * 1e6
+    parse_token(token)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        parse_token(token)
+    cached = (time.perf_counter() - t0) / n * 1e6
+    print(f"parse_token: decode {uncached:.1f} us/call, cached {cached:.1f} us/call")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:2]))
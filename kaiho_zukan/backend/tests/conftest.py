@@ -0,0 +1,76 @@
+"""
+テスト共通設定。
+
+core.config は import 時に環境変数を読むので、アプリのモジュールを import する前に
+使い捨ての SQLite（一時ディレクトリのファイル）を DATABASE_URL に設定する。
+DATABASE_URL が本番や開発の DB を指していても、テストがそこへ書き込むことはない。
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="kaiho-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["DATABASE_ASYNC_URL"] = ""
+os.environ["JWT_SECRET"] = "test-secret"
+os.environ["UPLOAD_DIR"] = os.path.join(_tmp, "uploads")
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+os.environ["NOTIFICATION_FLUSH_SEC"] = "0"
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def engine():
+    from core import db
+
+    db.create_all()
+    return db.engine
+
+
+@pytest.fixture
+def session_factory(engine):
+    from core.db import SessionLocal
+
+    return SessionLocal
+
+
+@pytest.fixture
+def make_user(session_factory):
+    """ユーザを作って id を返す"""
+    import uuid
+    from models import User
+
+    def _make(name: str | None = None) -> int:
+        name = name or f"u-{uuid.uuid4().hex[:8]}"
+        with session_factory() as db:
+            u = User(username=name, password_hash="-", nickname=name)
+            db.add(u)
+            db.commit()
+            return u.id
+
+    return _make
+
+
+@pytest.fixture
+def make_problem(session_factory, make_user):
+    """カテゴリ（2 階層）と問題を作って (problem_id, child_id, grand_id) を返す"""
+    import uuid
+    from models import Category, Problem
+
+    def _make(owner: int | None = None, title: str = "p") -> tuple[int, int, int]:
+        owner = owner or make_user()
+        tag = uuid.uuid4().hex[:8]
+        with session_factory() as db:
+            child = Category(name=f"c-{tag}", parent_id=None, level=1)
+            db.add(child)
+            db.flush()
+            grand = Category(name=f"g-{tag}", parent_id=child.id, level=2)
+            db.add(grand)
+            db.flush()
+            p = Problem(title=title, body="b", qtype="free", child_id=child.id, grand_id=grand.id, created_by=owner)
+            db.add(p)
+            db.commit()
+            return p.id, child.id, grand.id
+
+    return _make
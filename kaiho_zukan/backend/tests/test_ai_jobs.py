@@ -0,0 +1,61 @@
+"""services.ai_jobs: 同じキーのジョブが実行中なら pending を取得しない"""
+import datetime as dt
+
+import pytest
+from sqlalchemy import delete
+
+from models import AiJob
+from services import ai_jobs
+
+
+@pytest.fixture
+def jobs(session_factory):
+    with session_factory() as db:
+        db.execute(delete(AiJob))
+        db.commit()
+    yield
+    with session_factory() as db:
+        db.execute(delete(AiJob))
+        db.commit()
+
+
+def _add(db, status, locked_at=None, problem_id=1, user_id=None):
+    job = AiJob(kind="generate", problem_id=problem_id, user_id=user_id, status=status, locked_at=locked_at,
+                run_after=dt.datetime.utcnow() - dt.timedelta(seconds=1))
+    db.add(job)
+    db.flush()
+    return job.id
+
+
+def test_pending_waits_for_running_job_with_same_key(session_factory, jobs):
+    now = dt.datetime.utcnow()
+    with session_factory() as db:
+        _add(db, "running", locked_at=now)
+        _add(db, "pending")
+        other = _add(db, "pending", problem_id=2)
+        db.commit()
+    with session_factory() as db:
+        claimed = ai_jobs._claim(db)
+    assert claimed is not None and claimed[0] == other
+    with session_factory() as db:
+        assert ai_jobs._claim(db) is None
+
+
+def test_stale_running_job_does_not_block(session_factory, jobs):
+    stale = dt.datetime.utcnow() - ai_jobs._STALE_AFTER - dt.timedelta(minutes=1)
+    with session_factory() as db:
+        first = _add(db, "running", locked_at=stale)
+        _add(db, "pending")
+        db.commit()
+    with session_factory() as db:
+        claimed = ai_jobs._claim(db)
+    assert claimed is not None and claimed[0] == first
+
+
+def test_null_key_columns_match(session_factory, jobs):
+    with session_factory() as db:
+        _add(db, "running", locked_at=dt.datetime.utcnow(), problem_id=None)
+        _add(db, "pending", problem_id=None)
+        db.commit()
+    with session_factory() as db:
+        assert ai_jobs._claim(db) is None
@@ -0,0 +1,72 @@
+"""services.ai_judge.judge_all_explanations: 一括判定の書き込み"""
+from sqlalchemy import delete, event, select
+from sqlalchemy.exc import OperationalError
+
+from models import Explanation, Notification
+from services import ai_judge
+from services.llm_stub import StubClient
+
+WRONG = '{"is_wrong": true, "score": 10, "reason": "誤り"}'
+
+
+def _explanations(session_factory, pid: int, authors: list[int]) -> list[int]:
+    with session_factory() as db:
+        ids = []
+        for uid in authors:
+            e = Explanation(problem_id=pid, user_id=uid, content=f"解説 {uid}")
+            db.add(e)
+            db.flush()
+            ids.append(e.id)
+        db.commit()
+        return ids
+
+
+def test_judgements_and_notifications_are_written(session_factory, make_user, make_problem):
+    authors = [make_user(), make_user()]
+    pid, _c, _g = make_problem()
+    eids = _explanations(session_factory, pid, authors)
+    stats = ai_judge.judge_all_explanations(pid, client=StubClient(WRONG), concurrency=2)
+    assert stats["count"] == 2 and stats["failed"] == 0
+    assert len(eids) == 2
+    with session_factory() as db:
+        users = db.execute(select(Notification.user_id).where(Notification.problem_id == pid)).scalars().all()
+        assert sorted(users) == sorted(authors)
+
+
+def test_notification_failure_is_isolated(session_factory, make_user, make_problem):
+    broken, ok = make_user(), make_user()
+    pid, _c, _g = make_problem()
+    _explanations(session_factory, pid, [broken, ok])
+
+    def fail(_mapper, _conn, n):
+        if n.user_id == broken:
+            raise OperationalError("INSERT INTO notifications", {}, Exception("boom"))
+
+    event.listen(Notification, "before_insert", fail)
+    try:
+        ai_judge.judge_all_explanations(pid, client=StubClient(WRONG), concurrency=1)
+    finally:
+        event.remove(Notification, "before_insert", fail)
+    # 失敗した 1 件のセーブポイントだけが巻き戻り、残りの通知は commit される
+    with session_factory() as db:
+        users = db.execute(select(Notification.user_id).where(Notification.problem_id == pid)).scalars().all()
+        assert users == [ok]
+
+
+def test_explanation_deleted_while_judging_is_skipped(session_factory, make_user, make_problem):
+    gone, kept = make_user(), make_user()
+    pid, _c, _g = make_problem()
+    eids = _explanations(session_factory, pid, [gone, kept])
+
+    def reply(_kwargs):
+        with session_factory() as db:
+            db.execute(delete(Explanation).where(Explanation.id == eids[0]))
+            db.commit()
+        return WRONG
+
+    stats = ai_judge.judge_all_explanations(pid, client=StubClient(reply), concurrency=1)
+    assert stats["count"] == 2
+    with session_factory() as db:
+        assert db.get(Explanation, eids[0]) is None
+        users = db.execute(select(Notification.user_id).where(Notification.problem_id == pid)).scalars().all()
+        assert users == [kept]
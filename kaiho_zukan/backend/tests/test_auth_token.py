@@ -0,0 +1,16 @@
+"""security.auth.parse_token: 検証済みトークンのキャッシュ"""
+from security import auth
+
+
+def test_parse_token_caches_decoded_token(monkeypatch):
+    token = auth.make_token(42)
+    calls = []
+    real = auth._decode
+    monkeypatch.setattr(auth, "_decode", lambda t: calls.append(t) or real(t))
+    assert auth.parse_token(token) == 42
+    assert auth.parse_token(token) == 42
+    assert len(calls) == 1
+
+
+def test_parse_token_rejects_bad_signature():
+    assert auth.parse_token(auth.make_token(7) + "x") is None
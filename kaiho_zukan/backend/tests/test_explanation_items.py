@@ -0,0 +1,54 @@
+"""api.explanations._explanation_items: 解説の件数に関係なくクエリ数が一定であること"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from api.explanations import _explanation_items
+from models import AiJudgement, Explanation, ExplanationImage, ExplanationLike, ExplanationWrongFlag
+
+
+@contextmanager
+def _count_queries(engine):
+    counter = {"n": 0}
+
+    def _before(*_args):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", _before)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _before)
+
+
+def _seed(session_factory, make_user, make_problem, n: int) -> tuple[int, int]:
+    """n 人の投稿者がそれぞれ画像・いいね・誤りフラグ・AI判定つきの解説を書いた問題を作る"""
+    viewer = make_user()
+    pid, _c, _g = make_problem()
+    authors = [make_user() for _ in range(n)]
+    with session_factory() as db:
+        for uid in authors:
+            e = Explanation(problem_id=pid, user_id=uid, content=f"解説 {uid}", like_count=1)
+            db.add(e)
+            db.flush()
+            db.add_all([
+                ExplanationImage(explanation_id=e.id, filename=f"explanations/{e.id}.webp"),
+                ExplanationLike(explanation_id=e.id, user_id=viewer),
+                ExplanationWrongFlag(explanation_id=e.id, user_id=viewer),
+                AiJudgement(problem_id=pid, user_id=uid, is_wrong=False, score=90, reason="ok"),
+            ])
+        db.add(Explanation(problem_id=pid, user_id=None, content="AI の解説"))
+        db.commit()
+    return pid, viewer
+
+
+def test_query_count_is_constant(engine, session_factory, make_user, make_problem):
+    counts = {}
+    for n in (1, 12):
+        pid, viewer = _seed(session_factory, make_user, make_problem, n)
+        with session_factory() as db, _count_queries(engine) as counter:
+            items = _explanation_items(db, pid, viewer)
+        assert len(items) == n + 1
+        assert all(it["liked"] and it["flagged_wrong"] and len(it["images"]) == 1 for it in items if not it["is_ai"])
+        counts[n] = counter["n"]
+    assert counts[1] == counts[12]
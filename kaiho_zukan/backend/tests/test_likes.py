@@ -0,0 +1,61 @@
+"""services.likes の並行性: 同じ問題へ多数スレッドから like / unlike してもカウンタがいいね行数と一致する"""
+import threading
+
+from sqlalchemy import func, select
+
+from models import ProblemLike
+from services import likes
+
+THREADS = 8
+USERS = 40
+
+
+def test_concurrent_like_unlike_keeps_counter(session_factory, make_user, make_problem):
+    uids = [make_user() for _ in range(USERS)]
+    pid, _child, _grand = make_problem(owner=uids[0])
+    errors: list[BaseException] = []
+    barrier = threading.Barrier(THREADS)
+
+    def worker() -> None:
+        # 全ユーザがいいね → 奇数番目が取り消し → 3 の倍数番目がもう一度いいね（各スレッドが同じ操作を重ねて打つ）
+        try:
+            with session_factory() as db:
+                for phase in ("like", "unlike", "relike"):
+                    for i, uid in enumerate(uids):
+                        if phase == "like":
+                            likes.like(db, "problem", pid, uid)
+                        elif phase == "unlike" and i % 2 == 1:
+                            likes.unlike(db, "problem", pid, uid)
+                        elif phase == "relike" and i % 3 == 0:
+                            likes.like(db, "problem", pid, uid)
+                        db.commit()
+                    barrier.wait()
+        except BaseException as e:
+            errors.append(e)
+            barrier.abort()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors, errors
+    expected = sum(1 for i in range(USERS) if i % 2 == 0 or i % 3 == 0)
+    with session_factory() as db:
+        rows = db.execute(select(func.count()).select_from(ProblemLike).where(ProblemLike.problem_id == pid)).scalar_one()
+        assert likes.count(db, "problem", pid) == rows == expected
+
+
+def test_like_twice_counts_once(session_factory, make_user, make_problem):
+    uid = make_user()
+    pid, _child, _grand = make_problem()
+    with session_factory() as db:
+        assert likes.like(db, "problem", pid, uid) is True
+        assert likes.like(db, "problem", pid, uid) is False
+        db.commit()
+        assert likes.count(db, "problem", pid) == 1
+        assert likes.unlike(db, "problem", pid, uid) is True
+        assert likes.unlike(db, "problem", pid, uid) is False
+        db.commit()
+        assert likes.count(db, "problem", pid) == 0
@@ -0,0 +1,58 @@
+"""api.problems.retrieval._next_problem: 索引が古いときの引き直し"""
+from models import Problem
+from api.problems.retrieval import _next_problem
+from services import problem_sampler
+
+
+def _move(session_factory, pid: int, child_id: int, grand_id: int) -> None:
+    """別のワーカーでの移動（このプロセスの索引は更新されない）"""
+    with session_factory() as db:
+        p = db.get(Problem, pid)
+        p.child_id, p.grand_id = child_id, grand_id
+        db.commit()
+
+
+def test_problem_moved_to_another_category_is_not_served(session_factory, make_user, make_problem):
+    user = make_user()
+    pid, child, grand = make_problem()
+    _other, other_child, other_grand = make_problem()
+    with session_factory() as db:
+        assert _next_problem(db, user, child, grand, True)["id"] == pid
+
+    _move(session_factory, pid, other_child, other_grand)
+    with session_factory() as db:
+        assert _next_problem(db, user, child, grand, True) == {"problem": None}
+        assert _next_problem(db, user, child, None, True) == {"problem": None}
+        # 索引からも外れている
+        assert problem_sampler.pick_problem_id(db, user, child, grand, include_answered=True) is None
+
+
+def test_problem_moved_to_another_grand_stays_in_child(session_factory, make_user, make_problem):
+    user = make_user()
+    pid, child, grand = make_problem()
+    _other, _other_child, other_grand = make_problem()
+    with session_factory() as db:
+        assert _next_problem(db, user, child, None, True)["id"] == pid
+        assert _next_problem(db, user, child, grand, True)["id"] == pid
+
+    _move(session_factory, pid, child, other_grand)
+    with session_factory() as db:
+        assert _next_problem(db, user, child, grand, True) == {"problem": None}
+        assert _next_problem(db, user, child, None, True)["id"] == pid
+
+
+def test_solved_bitmap_for_a_replaced_index_is_not_cached(session_factory, make_user, make_problem):
+    user = make_user()
+    _pid, child, _grand = make_problem()
+    with session_factory() as db:
+        idx = problem_sampler._get_index(db, child, None)
+        # ビットマップを読んでいる間に別スレッドが索引を作り直した
+        problem_sampler._indexes[(child, None)] = problem_sampler._CategoryIndex([])
+        problem_sampler._get_solved(db, user, child, None, idx)
+        assert (user, child, None) not in problem_sampler._solved
+
+        current = problem_sampler._get_index(db, child, None)
+        bm = problem_sampler._get_solved(db, user, child, None, current)
+        assert problem_sampler._solved[(user, child, None)] is bm
+        # 古い索引を持った呼び出しには今の索引用のビットマップを返さない
+        assert problem_sampler._get_solved(db, user, child, None, idx) is not bm
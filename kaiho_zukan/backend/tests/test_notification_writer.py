@@ -0,0 +1,71 @@
+"""services.notification_writer: いいね通知の集約"""
+from sqlalchemy import select
+
+from models import Notification
+from services import notification_writer, notify_hub
+
+
+def _rows(session_factory, user_id: int) -> list[Notification]:
+    with session_factory() as db:
+        return db.execute(select(Notification).where(Notification.user_id == user_id)).scalars().all()
+
+
+def test_bumped_aggregate_gets_a_new_seq(session_factory, make_user, make_problem, monkeypatch):
+    owner = make_user()
+    pid, _c, _g = make_problem(owner=owner)
+    a, b, c = make_user(), make_user(), make_user()
+    published = []
+    monkeypatch.setattr(notify_hub, "publish", lambda uid, nid: published.append((uid, nid)))
+
+    notification_writer.record_like(owner, "problem_like", pid, a)
+    notification_writer.record_like(owner, "problem_like", pid, b)
+    (first,) = _rows(session_factory, owner)
+    assert first.actor_count == 2
+
+    with session_factory() as db:
+        db.get(Notification, first.id).seen = True
+        db.commit()
+    notification_writer.record_like(owner, "problem_like", pid, c)
+
+    # 既読にしたクライアントが after_seq=first.seq で追っても更新が見える（行は同じ id のまま）
+    (bumped,) = _rows(session_factory, owner)
+    assert bumped.id == first.id
+    assert bumped.seq > first.seq
+    assert bumped.actor_count == 3
+    assert bumped.actor_user_id == c
+    assert notification_writer.parse_recent(bumped.recent_actor_ids) == [c, b, a]
+    assert bumped.seen is False
+    assert published[-1] == (owner, bumped.id)
+
+
+def test_orm_updates_also_get_a_new_seq(session_factory, make_user, make_problem):
+    owner = make_user()
+    pid, _c, _g = make_problem(owner=owner)
+    with session_factory() as db:
+        n = Notification(user_id=owner, type="explanation_wrong", problem_id=pid, ai_judged_wrong=True)
+        db.add(n)
+        db.commit()
+        first = n.seq
+        n.crowd_judged_wrong = True
+        db.commit()
+        assert n.seq > first > 0
+
+
+def test_failed_flush_is_retried(session_factory, make_user, make_problem, monkeypatch):
+    owner = make_user()
+    pid, _c, _g = make_problem(owner=owner)
+    a, b = make_user(), make_user()
+    monkeypatch.setattr(notify_hub, "publish", lambda uid, nid: None)
+
+    def broken():
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(notification_writer, "SessionLocal", broken)
+    notification_writer.record_like(owner, "problem_like", pid, a)
+    assert _rows(session_factory, owner) == []
+
+    monkeypatch.setattr(notification_writer, "SessionLocal", session_factory)
+    notification_writer.record_like(owner, "problem_like", pid, b)
+    (row,) = _rows(session_factory, owner)
+    assert row.actor_count == 2
+    assert notification_writer.parse_recent(row.recent_actor_ids) == [b, a]
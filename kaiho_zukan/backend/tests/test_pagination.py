@@ -0,0 +1,21 @@
+"""api.pagination: limit / cursor の既定"""
+from api import pagination
+from core.config import get_settings
+
+
+def test_no_limit_and_no_cursor_returns_everything():
+    assert pagination.page_limit(None) is None
+    rows = list(range(get_settings().LIST_PAGE_SIZE * 2))
+    assert pagination.page(rows, None, "new", lambda r: (r,)) == (rows, None)
+
+
+def test_cursor_without_limit_uses_page_size():
+    cursor = pagination.encode_cursor("new", [10])
+    assert pagination.page_limit(None, cursor) == get_settings().LIST_PAGE_SIZE
+    assert pagination.page_limit(10_000, cursor) == get_settings().LIST_PAGE_MAX
+
+
+def test_page_returns_next_cursor():
+    rows, nxt = pagination.page([5, 4, 3], 2, "new", lambda r: (r,))
+    assert rows == [5, 4]
+    assert pagination.decode_cursor(nxt, "new", 1) == [4]
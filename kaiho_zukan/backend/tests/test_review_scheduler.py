@@ -0,0 +1,44 @@
+"""services.review_scheduler: SM-2 の間隔と /review/due の期限順"""
+import datetime as dt
+
+from models import Answer, Problem
+from services import problem_state, review_scheduler
+
+T0 = dt.datetime(2024, 1, 1)
+
+
+def test_sm2_intervals():
+    ease, interval, reps, due = review_scheduler.next_state(2.5, 0, 0, 4, T0)
+    assert (interval, reps, due) == (1.0, 1, T0 + dt.timedelta(days=1))
+    ease, interval, reps, _ = review_scheduler.next_state(ease, interval, reps, 4, T0)
+    assert (interval, reps) == (6.0, 2)
+    ease, interval, reps, _ = review_scheduler.next_state(ease, interval, reps, 4, T0)
+    assert interval == round(6.0 * ease, 1) and reps == 3
+    ease2, interval, reps, _ = review_scheduler.next_state(ease, interval, reps, 1, T0)
+    assert (interval, reps) == (1.0, 0) and ease2 < ease
+    assert review_scheduler.next_state(1.3, 1, 0, 1, T0)[0] == review_scheduler.MIN_EASE
+
+
+def test_due_query_returns_due_items_in_order(session_factory, make_user, make_problem):
+    uid = make_user()
+    pid, child, grand = make_problem()
+    with session_factory() as db:
+        pids = [pid]
+        for i in range(3):
+            p = Problem(title=f"q{i}", body="b", qtype="free", child_id=child, grand_id=grand, created_by=uid)
+            db.add(p)
+            db.flush()
+            pids.append(p.id)
+        # 1 時間ずつずらして不正解にする（どれも 1 日後が期限）
+        for i, p_id in enumerate(pids):
+            a = Answer(problem_id=p_id, user_id=uid, is_correct=False, created_at=T0 + dt.timedelta(hours=i))
+            db.add(a)
+            db.flush()
+            problem_state.record(db, uid, db.get(Problem, p_id), a.id, False, a.created_at)
+        db.commit()
+
+        now = T0 + dt.timedelta(days=1, hours=1, minutes=30)
+        rows = db.execute(review_scheduler.due_query(uid, child, None, now, 10)).all()
+        assert [p.id for _st, p in rows] == pids[:2]
+        nxt = db.execute(review_scheduler.next_due_query(uid, child, grand, now)).scalar()
+        assert nxt == T0 + dt.timedelta(days=1, hours=2)
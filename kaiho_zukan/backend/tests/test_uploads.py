@@ -0,0 +1,120 @@
+"""services.uploads: 共有ファイルの片付け"""
+import hashlib
+import io
+import os
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from models import ProblemImage
+from services import uploads
+
+
+def _png() -> SimpleNamespace:
+    buf = io.BytesIO()
+    Image.new("RGB", (2, 2), tuple(random.randrange(256) for _ in range(3))).save(buf, format="PNG")
+    buf.seek(0)
+    return SimpleNamespace(file=buf, filename="a.png")
+
+
+def _exists(rel: str) -> bool:
+    return os.path.exists(os.path.join(uploads.settings.UPLOAD_DIR, rel))
+
+
+def test_rejected_request_removes_files_it_wrote(engine):
+    first = _png()
+    sha = hashlib.sha256(first.file.getvalue()).hexdigest()
+    rel = f"img/{sha[:2]}/{sha}.png"
+
+    bad = SimpleNamespace(file=io.BytesIO(b"not an image"), filename="x.txt")
+    with pytest.raises(uploads.UploadRejected):
+        uploads.save_images([first, bad])
+    assert _exists(rel)  # 猶予中は残る
+    uploads.sweep(grace_sec=0)
+    assert not _exists(rel)
+
+
+def test_rejected_request_keeps_files_shared_with_other_rows(session_factory, make_problem):
+    pid, _c, _g = make_problem()
+    shared = _png()
+    (rel,) = uploads.save_images([shared])
+    with session_factory() as db:
+        db.add(ProblemImage(problem_id=pid, filename=rel))
+        db.commit()
+
+    shared.file.seek(0)
+    bad = SimpleNamespace(file=io.BytesIO(b"not an image"), filename="x.txt")
+    with pytest.raises(uploads.UploadRejected):
+        uploads.save_images([shared, bad])
+    uploads.sweep(grace_sec=0)
+    assert _exists(rel)
+
+
+def test_release_checks_committed_rows(session_factory, make_problem):
+    pid, _c, _g = make_problem()
+    kept, gone = uploads.save_images([_png(), _png()])
+    with session_factory() as db:
+        db.add(ProblemImage(problem_id=pid, filename=kept))
+        db.commit()
+    uploads.release([kept, gone])
+    assert uploads.sweep(grace_sec=0) == 1
+    assert _exists(kept)
+    assert not _exists(gone)
+
+
+def test_file_reused_during_grace_period_is_kept(engine):
+    img = _png()
+    (rel,) = uploads.save_images([img])
+    uploads.release([rel])
+    # 削除候補になってから猶予が過ぎたことにする
+    old = time.time() - 120
+    os.utime(os.path.join(uploads.settings.UPLOAD_DIR, rel), (old, old))
+    os.utime(os.path.join(uploads.settings.UPLOAD_DIR, "released", rel), (old, old))
+
+    # 別リクエストが同じ内容をアップロードし、まだ行を commit していない
+    img.file.seek(0)
+    assert uploads.save_images([img]) == [rel]
+    assert uploads.sweep(grace_sec=60) == 0
+    assert _exists(rel)
+    # 候補は残り、猶予が過ぎても行が無ければ次の sweep で消える
+    uploads.sweep(grace_sec=0)
+    assert not _exists(rel)
+
+
+def _explanation_with_image(session_factory, pid: int, uid: int) -> tuple[int, str]:
+    from models import Explanation, ExplanationImage
+
+    (rel,) = uploads.save_images([_png()])
+    with session_factory() as db:
+        e = Explanation(problem_id=pid, user_id=uid, content="x")
+        db.add(e)
+        db.flush()
+        db.add(ExplanationImage(explanation_id=e.id, filename=rel))
+        db.commit()
+        return e.id, rel
+
+
+@pytest.mark.parametrize("how", ["delete", "clear", "delete_mine", "delete_mine_legacy"])
+def test_removed_explanation_images_are_released(session_factory, make_user, make_problem, how):
+    from api import explanations as api_explanations
+    from api.problems import explanations as api_problem_explanations
+    from models import User
+
+    uid = make_user()
+    pid, _c, _g = make_problem()
+    eid, rel = _explanation_with_image(session_factory, pid, uid)
+    with session_factory() as db:
+        user = db.get(User, uid)
+        if how == "delete":
+            api_explanations.edit_explanation(eid, content="", images=None, clear_images=False, user=user, db=db)
+        elif how == "clear":
+            api_explanations.edit_explanation(eid, content=None, images=None, clear_images=True, user=user, db=db)
+        elif how == "delete_mine":
+            api_explanations.delete_my_explanations(pid, user=user, db=db)
+        else:
+            api_problem_explanations.delete_my_explanations_for_problem(pid, user=user, db=db)
+    uploads.sweep(grace_sec=0)
+    assert not _exists(rel)
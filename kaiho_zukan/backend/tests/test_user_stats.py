@@ -0,0 +1,51 @@
+"""services.user_stats: 行の作成と leaderboard への通知"""
+from models import User, UserStats
+from services import leaderboard, user_stats
+
+
+def test_first_bump_creates_the_row(session_factory, make_user, make_problem):
+    owner = make_user()
+    make_problem(owner=owner)
+    with session_factory() as db:
+        user_stats.bump(db, owner, problem_likes=1)
+        db.commit()
+        assert db.get(UserStats, owner).problem_count == 1
+
+
+def test_upsert_adds_deltas_to_a_row_created_concurrently(session_factory, make_user):
+    uid = make_user()
+    with session_factory() as db:
+        db.add(UserStats(user_id=uid, answer_count=5))
+        db.commit()
+    with session_factory() as db:
+        # UPDATE が 0 行だった後に並行リクエストが行を作った場合
+        user_stats._upsert(db, {uid: user_stats._empty()}, {"answer_count": 1})
+        db.commit()
+        assert db.get(UserStats, uid).answer_count == 6
+
+
+def test_leaderboard_is_marked_dirty_after_commit(session_factory, make_user, monkeypatch):
+    calls = []
+    monkeypatch.setattr(leaderboard, "mark_dirty", lambda: calls.append(1))
+    uid = make_user()
+    with session_factory() as db:
+        user_stats.bump(db, uid, answer_count=1)
+        assert calls == []
+        db.commit()
+        assert calls == [1]
+
+        user_stats.bump(db, uid, answer_count=1)
+        db.rollback()
+        db.commit()
+        assert calls == [1]
+
+
+def test_leaderboard_version_follows_the_contents(session_factory, make_user):
+    uid = make_user()
+    with session_factory() as db:
+        first = leaderboard._build(db)
+        # 内容が同じなら再構築しても（別ワーカーでも）同じ ETag になる
+        assert leaderboard._build(db).version == first.version
+        db.get(User, uid).points = 10
+        db.commit()
+        assert leaderboard._build(db).version != first.version